@@ -6,6 +6,7 @@ from fastapi import APIRouter, HTTPException, Depends, Header
 
 from log.logger_config import setup_logging
 from schemas.resquest import ControlRequest
+from repository.cache import control_mode_cache
 from database.dependencies import repo_manager
 
 load_dotenv()
@@ -37,9 +38,9 @@ async def takeover_conversation(request: ControlRequest):
             "mode_switched_at": datetime.now(timezone.utc).isoformat()
         }
         
-        response = async_customer_repo.update_customer(
+        response = await async_customer_repo.update_customer_by_chat_id(
             chat_id=request.chat_id,
-            payload=update_payload
+            update_payload=update_payload
         )
         
         if not response:
@@ -48,15 +49,20 @@ async def takeover_conversation(request: ControlRequest):
                 detail="Chat ID not found"
             )
 
-        logger.info(f"Admin has taken over chat_id: {request.chat_id}")
+        # Push the new mode so the bot stops answering this chat right away
+        control_mode_cache.set(request.chat_id, "ADMIN")
+        
+        await logger.info(f"Admin has taken over chat_id: {request.chat_id}")
         return {
             "status": "success", 
             "message": f"Conversation {request.chat_id} is now under ADMIN control."
         }
+    except HTTPException:
+        raise
     except Exception as e:
         error_details = traceback.format_exc()
-        logger.error(f"Error while taking over conversation: {e}")
-        logger.error(f"Error details:\n{error_details}")
+        await logger.error(f"Error while taking over conversation: {e}")
+        await logger.error(f"Error details:\n{error_details}")
         
         raise HTTPException(status_code=500, detail=str(e))
     
@@ -72,9 +78,9 @@ async def release_conversation(request: ControlRequest):
             "control_mode": "BOT",
             "mode_switched_at": None
         }
-        response = async_customer_repo.update_customer(
+        response = await async_customer_repo.update_customer_by_chat_id(
             chat_id=request.chat_id,
-            payload=update_payload
+            update_payload=update_payload
         )
         
         if not response:
@@ -83,13 +89,17 @@ async def release_conversation(request: ControlRequest):
                 detail="Chat ID not found"
             )
 
-        logger.info(f"Admin has released chat_id: {request.chat_id} back to Bot control.")
+        control_mode_cache.set(request.chat_id, "BOT")
+        
+        await logger.info(f"Admin has released chat_id: {request.chat_id} back to Bot control.")
         return {
             "status": "success", 
             "message": f"Conversation {request.chat_id} has been released back to BOT control."
         }
+    except HTTPException:
+        raise
     except Exception as e:
         error_details = traceback.format_exc()
-        logger.error(f"Error while releasing conversation: {e}\n{error_details}")
+        await logger.error(f"Error while releasing conversation: {e}\n{error_details}")
         
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,27 +1,37 @@
+import os
 import traceback
 from dotenv import load_dotenv
 
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 
 from schemas.response import ChatResponse
 from log.logger_config import setup_logging
-from services.utils import now_vietnam_time
+from services.mailbox import chat_mailbox
+from services.idempotency import idempotency_store
+from services.write_behind import write_behind
+from services.callback_outbox import callback_outbox
+from repository.cache import customer_cache
+from services.worker_pool import PoolClosedError, PoolSaturatedError, worker_pool
 from services.v5.process_chat import ChatbotService
-from core.graph.build_graph import create_main_graph
-from database.dependencies import get_chatbot_service
+from langgraph.graph.state import CompiledStateGraph
+from database.dependencies import get_chatbot_service, get_graph
 from services.utils import cal_duration_ms, now_vietnam_time
-from schemas.resquest import NormalChatRequest, WebhookChatRequest
+from api.admin.v1.routes import verify_admin_key
+from schemas.resquest import BatchChatRequest, NormalChatRequest, WebhookChatRequest
 
 load_dotenv()
 logger = setup_logging(__name__)
 
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 500))
+
 router = APIRouter()
-graph = create_main_graph()  # Initialize the main conversation graph once at startup
 
 @router.post("/chat/invoke", response_model=ChatResponse)
 async def chat(
     request: NormalChatRequest,
-    service: ChatbotService = Depends(get_chatbot_service)
+    service: ChatbotService = Depends(get_chatbot_service),
+    graph: CompiledStateGraph = Depends(get_graph)
 ) -> ChatResponse | HTTPException:
     """
     Handle direct chat invocation requests (non-webhook).
@@ -61,10 +71,104 @@ async def chat(
             detail=f"Internal Server Error: {str(e)}"
         )
         
+@router.post("/chat/stream")
+async def chat_stream(
+    request: NormalChatRequest,
+    service: ChatbotService = Depends(get_chatbot_service),
+    graph: CompiledStateGraph = Depends(get_graph)
+) -> StreamingResponse:
+    """
+    Stream the reply of a direct chat invocation as Server-Sent Events:
+    agent tokens as they are generated, plus routing and tool progress events.
+    """
+    chat_id = request.chat_id
+    user_input = request.user_input
+    
+    timestamp_start = now_vietnam_time()
+    await logger.info(f"Chat ID: {chat_id} | Received stream request at {timestamp_start.isoformat()}")
+    
+    try:
+        return await service.handle_stream_request(
+            chat_id=chat_id,
+            user_input=user_input,
+            graph=graph,
+            timestamp_start=timestamp_start
+        )
+    
+    except PoolSaturatedError as e:
+        await logger.warning(f"Chat ID: {chat_id} | Rejected stream request: {e}")
+        raise HTTPException(
+            status_code=429,
+            detail=f"Too Many Requests: {str(e)}",
+            headers={"Retry-After": "1"}
+        )
+        
+    except PoolClosedError as e:
+        await logger.warning(f"Chat ID: {chat_id} | Rejected stream request: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail=f"Service Unavailable: {str(e)}",
+            headers={"Retry-After": "5"}
+        )
+    
+    except Exception as e:
+        error_details = traceback.format_exc()
+        await logger.error(
+            f"Chat ID: {chat_id} | Exception: {e}\nDetail: {error_details}"
+        )
+        
+        raise HTTPException(
+            status_code=500, 
+            detail=f"Internal Server Error: {str(e)}"
+        )
+        
+@router.post("/chat/batch", dependencies=[Depends(verify_admin_key)])
+async def chat_batch(
+    request: BatchChatRequest,
+    service: ChatbotService = Depends(get_chatbot_service),
+    graph: CompiledStateGraph = Depends(get_graph)
+) -> dict:
+    """
+    Replay or pre-warm many chats at once with bounded concurrency (admin only).
+    Returns per-item results and timings in the order they were sent.
+    """
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many items: {len(request.items)} > {BATCH_MAX_ITEMS}"
+        )
+    
+    timestamp_start = now_vietnam_time()
+    await logger.info(f"Received batch request of {len(request.items)} items at {timestamp_start.isoformat()}")
+    
+    try:
+        response = await service.handle_batch_request(
+            items=[item.model_dump() for item in request.items],
+            graph=graph,
+            concurrency=request.concurrency
+        )
+        
+        await logger.info(
+            f"Completed batch request | Succeeded: {response['succeeded']} | "
+            f"Failed: {response['failed']} | Duration: {response['duration_ms'] / 1000} s"
+        )
+        
+        return response
+    
+    except Exception as e:
+        error_details = traceback.format_exc()
+        await logger.error(f"Batch request | Exception: {e}\nDetail: {error_details}")
+        
+        raise HTTPException(
+            status_code=500, 
+            detail=f"Internal Server Error: {str(e)}"
+        )
+        
 @router.post("/chat/webhook", response_model=ChatResponse)
 async def chat(
     request: WebhookChatRequest,
-    service: ChatbotService = Depends(get_chatbot_service)
+    service: ChatbotService = Depends(get_chatbot_service),
+    graph: CompiledStateGraph = Depends(get_graph)
 ) -> ChatResponse | HTTPException:
     """
     Handle chat requests coming from external webhook integrations
@@ -95,6 +199,22 @@ async def chat(
         )
         
         return response
+    
+    except PoolSaturatedError as e:
+        await logger.warning(f"Chat ID: {chat_id} | Rejected webhook request: {e}")
+        raise HTTPException(
+            status_code=429,
+            detail=f"Too Many Requests: {str(e)}",
+            headers={"Retry-After": "1"}
+        )
+        
+    except PoolClosedError as e:
+        await logger.warning(f"Chat ID: {chat_id} | Rejected webhook request: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail=f"Service Unavailable: {str(e)}",
+            headers={"Retry-After": "5"}
+        )
             
     except Exception as e:
         error_details = traceback.format_exc()
@@ -105,4 +225,25 @@ async def chat(
         raise HTTPException(
             status_code=500, 
             detail=f"Internal Server Error: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+@router.get("/chat/webhook/stats")
+async def webhook_stats() -> dict:
+    """
+    Expose the metrics of the webhook pipeline:
+
+    - queue depth and wait times of the per-chat mailbox;
+    - utilization of the worker pool;
+    - duplicate deliveries skipped;
+    - backlog of queued bookkeeping writes;
+    - customer cache hit rate;
+    - pending, in-flight and dead-lettered callback deliveries.
+    """
+    return {
+        "mailbox": chat_mailbox.stats(),
+        "worker_pool": worker_pool.stats(),
+        "idempotency": idempotency_store.stats(),
+        "write_behind": write_behind.stats(),
+        "customer_cache": customer_cache.stats(),
+        "callback_outbox": callback_outbox.stats()
+    }
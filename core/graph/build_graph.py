@@ -3,12 +3,14 @@ from langgraph.types import RetryPolicy
 
 from langgraph.graph import StateGraph
 from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.base import BaseCheckpointSaver
 
 from core.graph.state import AgentState
 from core.graph.supervisor import Supervisor
 from core.graph.order_agent import OrderAgent
 from core.graph.product_agent import ProductAgent
 from core.graph.modify_order_agent import ModifyOrderAgent
+from services.metrics import metrics_callback
 
 load_dotenv()
 
@@ -19,10 +21,14 @@ retry_policy = RetryPolicy(
     retry_on=(Exception,)
 )
 
-def create_main_graph() -> StateGraph:
+def create_main_graph(checkpointer: BaseCheckpointSaver | None = None) -> StateGraph:
     """
     Create and compile the main LangGraph workflow
     that orchestrates multiple agents via a supervisor.
+
+    Args:
+        checkpointer (BaseCheckpointSaver | None): Checkpointer opened by
+            `core.graph.checkpointer.open_checkpointer`, defaults to an in-memory one.
     """
     # Initialize agents
     product_agent = ProductAgent()
@@ -56,8 +62,10 @@ def create_main_graph() -> StateGraph:
     # Define the supervisor as the entry point of the workflow
     workflow.set_entry_point("supervisor")
 
-    # Use in-memory checkpointing to persist conversation state
-    memory = MemorySaver()
-    graph = workflow.compile(checkpointer=memory)
+    # Fall back to in-memory checkpointing when no shared checkpointer is given.
+    # The metrics callback is inherited by every run of the graph, agents' subgraphs included
+    graph = workflow.compile(
+        checkpointer=checkpointer or MemorySaver()
+    ).with_config(callbacks=[metrics_callback])
 
     return graph
@@ -0,0 +1,132 @@
+import os
+import aiosqlite
+from pathlib import Path
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from typing import AsyncIterator
+from contextlib import asynccontextmanager
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import BaseCheckpointSaver, ChannelVersions, Checkpoint, CheckpointMetadata
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+load_dotenv()
+
+# "memory": per-process MemorySaver, "sqlite": file shared by every worker process on the node
+CHECKPOINT_BACKEND = os.getenv("CHECKPOINT_BACKEND", "memory")
+CHECKPOINT_SQLITE_PATH = os.getenv("CHECKPOINT_SQLITE_PATH", "data/checkpoints.sqlite")
+# How long a writer waits for another process holding the SQLite write lock
+CHECKPOINT_SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("CHECKPOINT_SQLITE_BUSY_TIMEOUT_MS", 5000))
+# Keep each session's graph state in the checkpointer across turns, the graph resumes the session's
+# thread instead of being rebuilt from `sessions.state_base64`; needs a durable backend
+CHECKPOINT_DURABLE = os.getenv("CHECKPOINT_DURABLE", "false").lower() == "true"
+
+
+class DurableSqliteSaver(AsyncSqliteSaver):
+    """
+    SQLite checkpointer that can hold the state of every open session.
+
+    A turn only needs the latest checkpoint of its thread to resume from: `aprune`
+    drops the older ones (and those of the agents' subgraphs) once the turn is done.
+    The time of each thread's last checkpoint is kept aside, so that idle threads
+    can be found without reading their checkpoints.
+    """
+
+    async def setup(self) -> None:
+        if self.is_setup:
+            return
+        await super().setup()
+        async with self.lock:
+            await self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS thread_activity (thread_id TEXT PRIMARY KEY, updated_at TEXT NOT NULL)"
+            )
+            await self.conn.commit()
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions
+    ) -> RunnableConfig:
+        next_config = await super().aput(config, checkpoint, metadata, new_versions)
+        if not config["configurable"].get("checkpoint_ns"):
+            async with self.lock:
+                await self.conn.execute(
+                    "INSERT INTO thread_activity (thread_id, updated_at) VALUES (?, ?) "
+                    "ON CONFLICT (thread_id) DO UPDATE SET updated_at = excluded.updated_at",
+                    (str(config["configurable"]["thread_id"]), datetime.now(timezone.utc).isoformat())
+                )
+                await self.conn.commit()
+        return next_config
+
+    async def aprune(self, thread_id: str) -> None:
+        """
+        Keep only the latest top-level checkpoint of a thread.
+        """
+        await self.setup()
+        thread_id = str(thread_id)
+        async with self.lock, self.conn.cursor() as cur:
+            await cur.execute(
+                "SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ''",
+                (thread_id,)
+            )
+            row = await cur.fetchone()
+            if not row or not row[0]:
+                return
+            for table in ("checkpoints", "writes"):
+                await cur.execute(
+                    f"DELETE FROM {table} WHERE thread_id = ? AND NOT (checkpoint_ns = '' AND checkpoint_id = ?)",
+                    (thread_id, row[0])
+                )
+            await self.conn.commit()
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await super().adelete_thread(thread_id)
+        async with self.lock:
+            await self.conn.execute("DELETE FROM thread_activity WHERE thread_id = ?", (str(thread_id),))
+            await self.conn.commit()
+
+    async def aidle_threads(self, before: datetime) -> list[str]:
+        """
+        Threads whose last turn is older than `before`.
+        """
+        await self.setup()
+        async with self.lock, self.conn.execute(
+            "SELECT thread_id FROM thread_activity WHERE updated_at < ?",
+            (before.astimezone(timezone.utc).isoformat(),)
+        ) as cur:
+            return [row[0] for row in await cur.fetchall()]
+
+
+@asynccontextmanager
+async def open_checkpointer(
+    backend: str = CHECKPOINT_BACKEND,
+    sqlite_path: str = CHECKPOINT_SQLITE_PATH
+) -> AsyncIterator[BaseCheckpointSaver]:
+    """
+    Open the graph checkpointer selected by `CHECKPOINT_BACKEND`.
+
+    The SQLite backend runs in WAL mode so several uvicorn workers on the same
+    node can read and write checkpoints of the same threads concurrently.
+    It must be opened inside the running event loop (e.g. in the FastAPI lifespan).
+    """
+    if backend == "memory":
+        if CHECKPOINT_DURABLE:
+            raise ValueError("CHECKPOINT_DURABLE needs a durable CHECKPOINT_BACKEND: 'sqlite'")
+        yield MemorySaver()
+        return
+
+    if backend != "sqlite":
+        raise ValueError(f"Invalid CHECKPOINT_BACKEND: {backend}. Must be one of {{'memory', 'sqlite'}}")
+
+    Path(sqlite_path).parent.mkdir(parents=True, exist_ok=True)
+    async with aiosqlite.connect(sqlite_path) as conn:
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute(f"PRAGMA busy_timeout={CHECKPOINT_SQLITE_BUSY_TIMEOUT_MS}")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+
+        checkpointer = DurableSqliteSaver(conn)
+        await checkpointer.setup()
+        yield checkpointer
@@ -0,0 +1,195 @@
+import os
+import traceback
+from dotenv import load_dotenv
+
+from langchain_core.runnables import Runnable
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+
+from core.graph.state import AgentState
+from database.connection import orchestrator_llm
+from log.logger_config import setup_logging
+from services.metrics import CONTEXT_SUMMARY_REFRESHES, CONTEXT_WINDOW_TOKENS
+
+load_dotenv()
+
+logger = setup_logging(__name__)
+
+# Tokens of conversation history (rolling summary included) sent with each LLM call, 0 sends it all
+CONTEXT_TOKEN_BUDGETS = {
+    "supervisor": int(os.getenv("CONTEXT_TOKENS_SUPERVISOR", 1500)),
+    "product_agent": int(os.getenv("CONTEXT_TOKENS_PRODUCT_AGENT", 4000)),
+    "order_agent": int(os.getenv("CONTEXT_TOKENS_ORDER_AGENT", 4000)),
+    "modify_order_agent": int(os.getenv("CONTEXT_TOKENS_MODIFY_ORDER_AGENT", 4000))
+}
+# The rolling summary is shared by every agent, so it only folds what the largest budget
+# no longer fits: each agent then windows its own budget from the raw history
+SUMMARY_TOKEN_BUDGET = 0 if 0 in CONTEXT_TOKEN_BUDGETS.values() else max(CONTEXT_TOKEN_BUDGETS.values())
+# Fold the turns that no longer fit into a rolling summary, "false" only drops them
+CONTEXT_SUMMARY_ENABLED = os.getenv("CONTEXT_SUMMARY_ENABLED", "true").lower() == "true"
+# Share of `SUMMARY_TOKEN_BUDGET` left to recent turns after a summary refresh: lower folds more turns at once,
+# so the summary is refreshed less often
+CONTEXT_KEEP_RATIO = float(os.getenv("CONTEXT_KEEP_RATIO", 0.5))
+# Characters kept of a tool output from an earlier turn or folded into the summary
+CONTEXT_TOOL_OUTPUT_CHARS = int(os.getenv("CONTEXT_TOOL_OUTPUT_CHARS", 600))
+
+# Approximate count, on the safe side for Vietnamese text
+CHARS_PER_TOKEN = 3.0
+
+
+def count_tokens(messages: list[BaseMessage]) -> int:
+    return count_tokens_approximately(messages, chars_per_token=CHARS_PER_TOKEN)
+
+
+def _truncate(content, limit: int) -> str:
+    content = content if isinstance(content, str) else str(content)
+    return content if len(content) <= limit else content[:limit] + " …"
+
+
+def _compact(message: BaseMessage) -> BaseMessage:
+    # Tool outputs of earlier turns (product dumps mostly) were already answered from
+    if isinstance(message, ToolMessage) and len(str(message.content)) > CONTEXT_TOOL_OUTPUT_CHARS:
+        return message.model_copy(update={"content": _truncate(message.content, CONTEXT_TOOL_OUTPUT_CHARS)})
+    return message
+
+
+def _recent_start(messages: list[BaseMessage], start: int, max_tokens: int) -> int:
+    """
+    Index of the oldest turn from which `messages[index:]` fits `max_tokens`, at or after
+    `start`. A turn starts at a customer message, so that a tool call is never separated
+    from its result; the last turn is always kept, whatever its size.
+    """
+    turn_starts = [index for index in range(start, len(messages)) if isinstance(messages[index], HumanMessage)]
+    if not turn_starts:
+        return start
+
+    keep = turn_starts[-1]
+    tokens = count_tokens(messages[keep:])
+    for index, end in zip(reversed(turn_starts[:-1]), reversed(turn_starts[1:])):
+        tokens += count_tokens(messages[index:end])
+        if tokens > max_tokens:
+            break
+        keep = index
+    return keep
+
+
+def _render(messages: list[BaseMessage]) -> str:
+    lines = []
+    for message in messages:
+        if isinstance(message, HumanMessage):
+            lines.append(f"Customer: {message.content}")
+        elif isinstance(message, ToolMessage):
+            lines.append(f"Tool {message.name}: {_truncate(message.content, CONTEXT_TOOL_OUTPUT_CHARS)}")
+        elif isinstance(message, AIMessage) and message.content:
+            lines.append(f"Assistant: {message.content}")
+        elif isinstance(message, AIMessage) and message.tool_calls:
+            lines.append(f"Assistant called: {', '.join(call['name'] for call in message.tool_calls)}")
+    return "\n".join(lines)
+
+
+def build_summarizer() -> Runnable:
+    """
+    Chain rewriting the rolling summary with the turns folded into it:
+    `{"summary", "conversation"}` -> new summary text.
+    """
+    with open("core/prompts/summary_prompt.md", "r", encoding="utf-8") as f:
+        system_prompt = f.read()
+
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", system_prompt),
+        ("human", "Current summary:\n{summary}\n\nTurns to add:\n{conversation}")
+    ])
+    return prompt | orchestrator_llm | StrOutputParser()
+
+
+class ContextWindow:
+    """
+    Token-budgeted view of the conversation history for one agent.
+
+    The history in the state is left whole; the LLM gets the rolling summary of the
+    older turns as a system message, followed by the most recent turns that fit the
+    agent's budget. The summary covers `messages[:summarized_messages]`, is shared by
+    every agent and only ever extended: once the history outgrows `summary_tokens`
+    (the largest agent budget), its oldest turns are folded in until `CONTEXT_KEEP_RATIO`
+    of it is left, so that one summarization call covers several turns. Agents with a
+    smaller budget drop the turns between the summary and their window.
+    """
+
+    def __init__(
+        self,
+        agent: str,
+        max_tokens: int | None = None,
+        summarizer: Runnable | None = None,
+        summary_tokens: int | None = None
+    ):
+        self.agent = agent
+        self.max_tokens = CONTEXT_TOKEN_BUDGETS[agent] if max_tokens is None else max_tokens
+        self.summary_tokens = SUMMARY_TOKEN_BUDGET if summary_tokens is None else summary_tokens
+        self.summarizer = summarizer or build_summarizer()
+
+    @staticmethod
+    def _summary_message(state: AgentState) -> list[BaseMessage]:
+        summary = state.get("summary")
+        if not summary or not state.get("summarized_messages"):
+            return []
+        return [SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")]
+
+    async def refresh(self, state: AgentState) -> dict:
+        """
+        Fold the turns that no longer fit `summary_tokens` into the rolling summary.
+
+        Returns:
+            dict: State update with the new `summary` and `summarized_messages`, empty
+                when the history still fits, the summary is disabled or it failed.
+        """
+        if not self.summary_tokens or not CONTEXT_SUMMARY_ENABLED:
+            return {}
+
+        messages = state["messages"]
+        summarized = min(state.get("summarized_messages") or 0, len(messages))
+        if count_tokens(self._summary_message(state) + messages[summarized:]) <= self.summary_tokens:
+            return {}
+
+        cut = _recent_start(messages, summarized, int(self.summary_tokens * CONTEXT_KEEP_RATIO))
+        if cut <= summarized:
+            return {}
+
+        try:
+            summary = await self.summarizer.ainvoke({
+                "summary": state.get("summary") or "(empty)",
+                "conversation": _render(messages[summarized:cut])
+            })
+        except Exception as e:
+            CONTEXT_SUMMARY_REFRESHES.inc(agent=self.agent, status="error")
+            error_detail = traceback.format_exc()
+            await logger.warning(f"Cannot refresh the conversation summary, older turns are dropped: {e}\n{error_detail}")
+            return {}
+
+        CONTEXT_SUMMARY_REFRESHES.inc(agent=self.agent, status="ok")
+        return {"summary": summary.strip(), "summarized_messages": cut}
+
+    def messages(self, state: AgentState) -> list[BaseMessage]:
+        """
+        History to send to the LLM: the rolling summary and the recent turns within the
+        budget, tool outputs of earlier turns shortened. The current turn is sent whole.
+        """
+        messages = state["messages"]
+        if not self.max_tokens:
+            return messages
+
+        head = self._summary_message(state)
+        summarized = min(state.get("summarized_messages") or 0, len(messages)) if head else 0
+        start = _recent_start(messages, summarized, self.max_tokens - count_tokens(head))
+        current = _recent_start(messages, start, 0)
+
+        window = head + [_compact(message) for message in messages[start:current]] + messages[current:]
+        CONTEXT_WINDOW_TOKENS.observe(count_tokens(window), agent=self.agent)
+        return window
+
+    def pre_model_hook(self, state: AgentState) -> dict:
+        """
+        `create_react_agent` hook run before every LLM call of the agent, tool steps included.
+        """
+        return {"llm_input_messages": self.messages(state)}
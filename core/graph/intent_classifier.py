@@ -0,0 +1,331 @@
+import os
+import json
+import math
+import time
+import zlib
+import logging
+import warnings
+from pathlib import Path
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+import numpy as np
+
+from core.graph.state import AgentState
+from log.logger_config import setup_record_writer
+from core.graph.routing_rules import AGENTS, last_agent, normalize_text
+
+load_dotenv()
+
+# Route with the local classifier when it is confident enough, before asking the orchestrator LLM
+INTENT_CLASSIFIER_ENABLED = os.getenv("INTENT_CLASSIFIER_ENABLED", "false").lower() == "true"
+# Model written by `scripts.train_intent_classifier`, replaced in place to hot-swap it
+INTENT_MODEL_PATH = os.getenv("INTENT_MODEL_PATH", "data/intent_classifier.npz")
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", 0.9))
+# How often the model file is checked for a new version
+INTENT_MODEL_CHECK_SECONDS = float(os.getenv("INTENT_MODEL_CHECK_SECONDS", 30))
+# JSONL log of the supervisor decisions, the training data of the classifier ("" disables it);
+# each worker process writes its own file, named after its pid (`decisions.jsonl` -> `decisions.<pid>.jsonl`)
+SUPERVISOR_DECISION_LOG = os.getenv("SUPERVISOR_DECISION_LOG", "")
+
+NGRAM_RANGE = (2, 4)
+HASH_DIM = 2 ** 16
+
+
+def extract_features(
+    text: str,
+    has_cart: bool,
+    has_order: bool,
+    last_agent_name: str | None
+) -> list[str]:
+    """
+    Character n-grams of the normalized message, plus the routing context the
+    supervisor prompt relies on: cart, order and the agent that replied last.
+    """
+    padded = f" {normalize_text(text)} "
+    grams = [
+        padded[i:i + n]
+        for n in range(NGRAM_RANGE[0], NGRAM_RANGE[1] + 1)
+        for i in range(len(padded) - n + 1)
+    ]
+    state = f"cart={int(has_cart)},order={int(has_order)}"
+    return grams + ["__bias__", f"__{state}", f"__last={last_agent_name}", f"__{state},last={last_agent_name}"]
+
+
+def record_features(record: dict) -> list[str]:
+    return extract_features(record["text"], record["cart"], record["order"], record["last_agent"])
+
+
+def state_features(state: AgentState) -> list[str]:
+    return extract_features(
+        state.get("user_input") or "",
+        bool(state.get("cart")),
+        bool(state.get("order")),
+        last_agent(state)
+    )
+
+
+def vectorize(features: list[str], dim: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Hashed bag of features as (indices, values). N-grams share a unit norm, so that
+    long messages do not outweigh the context features.
+    """
+    grams: dict[int, float] = {}
+    context: dict[int, float] = {}
+    for feature in features:
+        counts = context if feature.startswith("__") else grams
+        index = zlib.crc32(feature.encode("utf-8")) % dim
+        counts[index] = counts.get(index, 0.0) + 1.0
+
+    norm = math.sqrt(sum(count * count for count in grams.values())) or 1.0
+    merged = {index: count / norm for index, count in grams.items()}
+    for index, count in context.items():
+        merged[index] = merged.get(index, 0.0) + count
+    indices = np.fromiter(merged.keys(), dtype=np.int64, count=len(merged))
+    values = np.fromiter(merged.values(), dtype=np.float32, count=len(merged))
+    return indices, values
+
+
+class IntentModel:
+    """
+    Multinomial logistic regression over hashed features, stored as one `.npz` file.
+    """
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, labels: tuple[str, ...], dim: int = HASH_DIM):
+        self.weights = weights
+        self.bias = bias
+        self.labels = labels
+        self.dim = dim
+
+    def predict_proba(self, features: list[str]) -> np.ndarray:
+        indices, values = vectorize(features, self.dim)
+        logits = values @ self.weights[indices] + self.bias
+        logits = np.exp(logits - logits.max())
+        return logits / logits.sum()
+
+    def save(self, path: str) -> None:
+        """
+        Write the model next to `path` then move it in place, so that a router
+        polling the file never reads a half-written model.
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            weights=self.weights,
+            bias=self.bias,
+            meta=np.array(json.dumps({"labels": list(self.labels), "dim": self.dim, "ngram_range": NGRAM_RANGE}))
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "IntentModel":
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            if tuple(meta["ngram_range"]) != NGRAM_RANGE:
+                raise ValueError(f"Model trained with n-grams {meta['ngram_range']}, expected {NGRAM_RANGE}")
+            if len(meta["labels"]) < 2:
+                raise ValueError(f"Model trained on a single agent {meta['labels']}, it would route every message there")
+            return cls(data["weights"], data["bias"], tuple(meta["labels"]), meta["dim"])
+
+
+def train(
+    records: list[dict],
+    dim: int = HASH_DIM,
+    epochs: int = 20,
+    learning_rate: float = 0.5,
+    l2: float = 1e-6,
+    batch_size: int = 128,
+    seed: int = 0
+) -> IntentModel:
+    """
+    Fit the classifier on logged decisions (`text`, `cart`, `order`, `last_agent`, `next`)
+    with mini-batch AdaGrad on the cross-entropy.
+
+    Raises:
+        ValueError: The decisions cover fewer than two agents, the model would route
+            every message to the same agent with probability 1.0.
+    """
+    labels = tuple(agent for agent in AGENTS if any(record["next"] == agent for record in records))
+    if len(labels) < 2:
+        raise ValueError(f"Decisions of at least two agents are needed to train, got {list(labels)}")
+    missing = [agent for agent in AGENTS if agent not in labels]
+    if missing:
+        warnings.warn(f"No decisions for {missing}, the classifier never routes to them", stacklevel=2)
+    label_index = {label: i for i, label in enumerate(labels)}
+    rows = [vectorize(record_features(record), dim) for record in records]
+    targets = np.array([label_index[record["next"]] for record in records])
+
+    rng = np.random.default_rng(seed)
+    weights = np.zeros((dim, len(labels)), dtype=np.float32)
+    bias = np.zeros(len(labels), dtype=np.float32)
+    weights_g2 = np.full_like(weights, 1e-8)
+    bias_g2 = np.full_like(bias, 1e-8)
+
+    for _ in range(epochs):
+        order = rng.permutation(len(rows))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            lengths = np.array([len(rows[i][0]) for i in batch])
+            indices = np.concatenate([rows[i][0] for i in batch])
+            values = np.concatenate([rows[i][1] for i in batch])
+            row_of = np.repeat(np.arange(len(batch)), lengths)
+
+            logits = np.zeros((len(batch), len(labels)), dtype=np.float32)
+            np.add.at(logits, row_of, values[:, None] * weights[indices])
+            logits += bias
+            proba = np.exp(logits - logits.max(axis=1, keepdims=True))
+            proba /= proba.sum(axis=1, keepdims=True)
+            proba[np.arange(len(batch)), targets[batch]] -= 1
+            proba /= len(batch)
+
+            # Only the rows of the features present in the batch change
+            touched, inverse = np.unique(indices, return_inverse=True)
+            grad = np.zeros((len(touched), len(labels)), dtype=np.float32)
+            np.add.at(grad, inverse, values[:, None] * proba[row_of])
+            grad += l2 * weights[touched]
+            weights_g2[touched] += grad ** 2
+            weights[touched] -= learning_rate * grad / np.sqrt(weights_g2[touched])
+
+            bias_grad = proba.sum(axis=0)
+            bias_g2 += bias_grad ** 2
+            bias -= learning_rate * bias_grad / np.sqrt(bias_g2)
+
+    return IntentModel(weights, bias, labels, dim)
+
+
+def load_records(paths: list[str], sources: set[str] | None = None) -> list[dict]:
+    """
+    Decisions of the JSONL logs, those of the given sources only (e.g. "llm").
+    """
+    records = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get("next") in AGENTS and (sources is None or record.get("source") in sources):
+                    records.append(record)
+    return records
+
+
+class IntentRouter:
+    """
+    First-stage router: the classifier's agent when its probability reaches the
+    threshold, None otherwise (the supervisor then asks the LLM).
+
+    The model file is checked every `INTENT_MODEL_CHECK_SECONDS` and reloaded when
+    it changed, so retraining does not need a restart; a file that fails to load
+    leaves the previous model in use.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = INTENT_CLASSIFIER_ENABLED,
+        path: str = INTENT_MODEL_PATH,
+        threshold: float = INTENT_CONFIDENCE_THRESHOLD,
+        check_interval: float = INTENT_MODEL_CHECK_SECONDS
+    ):
+        self.enabled = enabled
+        self.path = path
+        self.threshold = threshold
+        self.check_interval = check_interval
+
+        self._model: IntentModel | None = None
+        self._mtime_ns: int | None = None
+        self._checked_at = float("-inf")
+
+        self._loads = 0
+        self._load_errors = 0
+        self._confident = 0
+        self._unsure = 0
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self._model, self._mtime_ns = None, None
+            return
+        if mtime_ns == self._mtime_ns:
+            return
+        try:
+            self._model = IntentModel.load(self.path)
+            self._loads += 1
+        except Exception:
+            self._load_errors += 1
+        self._mtime_ns = mtime_ns
+
+    def route(self, state: AgentState) -> tuple[str, float] | None:
+        """
+        Returns:
+            tuple[str, float] | None: (next agent, probability), or None when the
+                classifier is disabled, has no model or is not confident enough.
+        """
+        if not self.enabled:
+            return None
+        self._refresh()
+        model = self._model
+        if model is None:
+            return None
+
+        proba = model.predict_proba(state_features(state))
+        best = int(proba.argmax())
+        if proba[best] < self.threshold:
+            self._unsure += 1
+            return None
+        self._confident += 1
+        return model.labels[best], float(proba[best])
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "model_loaded": self._model is not None,
+            "loads": self._loads,
+            "load_errors": self._load_errors,
+            "confident": self._confident,
+            "unsure": self._unsure
+        }
+
+
+def decision_log_path(path: str) -> str:
+    """
+    Decision log of the current worker process, so that workers never append to the same file.
+    """
+    log_path = Path(path)
+    return str(log_path.with_name(f"{log_path.stem}.{os.getpid()}{log_path.suffix}"))
+
+
+_decision_writers: dict[int, logging.Logger] = {}
+
+
+def log_decision(state: AgentState, next_node: str, source: str) -> None:
+    """
+    Append the supervisor's decision to the process's `SUPERVISOR_DECISION_LOG`, one
+    JSON line per turn. The line is queued, the file is written off the event loop.
+    """
+    if not SUPERVISOR_DECISION_LOG:
+        return
+    record = {
+        "ts": datetime.now(timezone.utc).isoformat(),
+        "text": state.get("user_input") or "",
+        "cart": bool(state.get("cart")),
+        "order": bool(state.get("order")),
+        "last_agent": last_agent(state),
+        "next": next_node,
+        "source": source
+    }
+    writer = _decision_writers.get(os.getpid())
+    if writer is None:
+        # Opened in the worker process itself, after the fork
+        writer = setup_record_writer(f"supervisor_decisions.{os.getpid()}", decision_log_path(SUPERVISOR_DECISION_LOG))
+        _decision_writers[os.getpid()] = writer
+    writer.info(json.dumps(record, ensure_ascii=False))
+
+
+intent_router = IntentRouter()
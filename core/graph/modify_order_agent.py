@@ -5,6 +5,7 @@ from langgraph.prebuilt import create_react_agent
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
 from core.graph.state import AgentState
+from core.graph.context_window import ContextWindow
 from core.tools import modify_order_toolbox
 from database.connection import specialist_llm
 
@@ -33,12 +34,16 @@ class ModifyOrderAgent:
             MessagesPlaceholder(variable_name="messages")
         ])
         
+        self.window = ContextWindow("modify_order_agent")
+        
         # Create a ReAct-style agent specialized in order modification
         self.agent = create_react_agent(
             model=specialist_llm,
             tools=modify_order_toolbox,
             prompt=self.prompt,
-            state_schema=AgentState
+            state_schema=AgentState,
+            # Trims the history sent with every LLM call of the ReAct loop
+            pre_model_hook=self.window.pre_model_hook
         )
     
     async def modify_order_agent_node(self, state: AgentState) -> Command:
@@ -55,11 +60,12 @@ class ModifyOrderAgent:
                      and routes the flow to the end state.
         """
         try:
-            result = await self.agent.ainvoke(state)
+            # The new summary, if any, is returned with the agent's other state fields
+            result = await self.agent.ainvoke({**state, **await self.window.refresh(state)})
             content = result["messages"][-1].content
             
             update = {
-                "messages": [AIMessage(content=content, name="product_agent")],
+                "messages": [AIMessage(content=content, name="modify_order_agent")],
                 "next": "__end__"
             }
             
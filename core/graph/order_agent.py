@@ -6,6 +6,7 @@ from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
 from core.tools import order_toolbox
 from core.graph.state import AgentState
+from core.graph.context_window import ContextWindow
 from database.connection import specialist_llm
 
 from log.logger_config import setup_logging
@@ -34,12 +35,16 @@ class OrderAgent:
             MessagesPlaceholder(variable_name="messages")
         ])
         
+        self.window = ContextWindow("order_agent")
+        
         # Create a ReAct-style agent for order-related operations
         self.agent = create_react_agent(
             model=specialist_llm,
             tools=order_toolbox,
             prompt=self.prompt,
-            state_schema=AgentState
+            state_schema=AgentState,
+            # Trims the history sent with every LLM call of the ReAct loop
+            pre_model_hook=self.window.pre_model_hook
         )
     
     async def order_agent_node(self, state: AgentState) -> Command:
@@ -55,7 +60,8 @@ class OrderAgent:
                      (`order`, `cart`, etc. if present), and ends the workflow.
         """
         try:
-            result = await self.agent.ainvoke(state)
+            # The new summary, if any, is returned with the agent's other state fields
+            result = await self.agent.ainvoke({**state, **await self.window.refresh(state)})
             content = result["messages"][-1].content
             
             update = {
@@ -1,6 +1,7 @@
 import traceback
 from langgraph.types import Command
 from core.graph.state import AgentState
+from core.graph.context_window import ContextWindow
 from langchain_core.messages import AIMessage
 from langgraph.prebuilt import create_react_agent
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
@@ -28,11 +29,15 @@ class ProductAgent:
             MessagesPlaceholder(variable_name="messages")
         ])
         
+        self.window = ContextWindow("product_agent")
+        
         self.agent = create_react_agent(
             model=specialist_llm,
             tools=product_toolbox,
             prompt=self.prompt,
-            state_schema=AgentState
+            state_schema=AgentState,
+            # Trims the history sent with every LLM call of the ReAct loop
+            pre_model_hook=self.window.pre_model_hook
         )
 
     async def product_agent_node(self, state: AgentState) -> Command:
@@ -46,7 +51,8 @@ class ProductAgent:
             Command: Lệnh cập nhật `messages`, `seen_products` (nếu có) và kết thúc luồng.
         """
         try:
-            result = await self.agent.ainvoke(state)
+            # The new summary, if any, is returned with the agent's other state fields
+            result = await self.agent.ainvoke({**state, **await self.window.refresh(state)})
             content = result["messages"][-1].content
             
             update = {
@@ -0,0 +1,125 @@
+import os
+import re
+import unicodedata
+from typing import Callable
+from dotenv import load_dotenv
+from langchain_core.messages import AIMessage
+
+from core.graph.state import AgentState
+
+load_dotenv()
+
+# Route obvious turns with the rules below before asking the orchestrator LLM
+SUPERVISOR_RULES_ENABLED = os.getenv("SUPERVISOR_RULES_ENABLED", "true").lower() == "true"
+
+AGENTS = ("product_agent", "order_agent", "modify_order_agent")
+
+# Patterns run on the normalized text: lowercase, without Vietnamese diacritics
+# An order id: "ODR-..." or a number after "#", "order id/number/no" or "don (hang) so"
+ORDER_REFERENCE = re.compile(
+    r"\b(odr[-\d]+|order\s*(#|(id|number|no)\s*[:#]?)\s*\d+|ma\s*don\b|don\s*(hang\s*)?(so\s*|#\s*)\d+)"
+)
+CANCEL_ORDER = re.compile(r"\b(huy|cancel)\s*(cai\s*|my\s*|the\s*)?(don|order)\b")
+BUY_MORE = re.compile(
+    r"\b(mua|lay|dat|them|add|buy|order)\s*(them|more|another|one more)\b|\bthem\s*\d+\s*(chai|lo|hop|cai)\b"
+)
+CONTACT_DETAILS = re.compile(
+    r"((sdt|so dien thoai|phone|email|mail)\s*(cua\s*(em|anh|chi|minh)\s*)?(la\s*)?)?"
+    r"((\+?84|0)(\d[\s.-]?){8,9}\d|[\w.+-]+@[\w-]+\.[\w.]+)"
+)
+_CONFIRM_WORDS = (
+    r"ok(e|ay)?|oki|yes|yep|co|u|uh|um|vang|da|dung( roi)?|chot( don)?|xac nhan|dong y|confirm(ed)?"
+    r"|len don|dat hang|dat luon"
+)
+_FILLER_WORDS = r"a|nha|nhe|em|shop|luon|di|roi|vay|nhe em|a em|gium|giup em"
+CONFIRMATION = re.compile(rf"^({_CONFIRM_WORDS})(\s+({_CONFIRM_WORDS}|{_FILLER_WORDS}))*$")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Lowercase text without diacritics, punctuation or repeated spaces, so that
+    "Xác nhận!!" and "xac nhan" match the same pattern.
+    """
+    text = unicodedata.normalize("NFD", text.lower().replace("đ", "d"))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r"[^\w@+#.\s-]", " ", text)
+    return re.sub(r"\s+", " ", text).strip(" .-")
+
+
+def last_agent(state: AgentState) -> str | None:
+    """
+    Agent that wrote the last reply of the conversation, if any.
+    """
+    for message in reversed(state.get("messages") or []):
+        if isinstance(message, AIMessage) and message.name in AGENTS:
+            return message.name
+    return None
+
+
+def _order_reference(state: AgentState, text: str) -> str | None:
+    # Explicit reference to the placed order, whatever the cart holds
+    if state.get("order") and (ORDER_REFERENCE.search(text) or CANCEL_ORDER.search(text)):
+        return "modify_order_agent"
+    return None
+
+
+def _buy_more_after_order(state: AgentState, text: str) -> str | None:
+    # Absolute rule of the supervisor prompt: buying more with an empty cart changes the placed order
+    if state.get("order") and not state.get("cart") and BUY_MORE.search(text):
+        return "modify_order_agent"
+    return None
+
+
+def _contact_details(state: AgentState, text: str) -> str | None:
+    # Phone number or email alone, answering the agent that asked for the recipient's details
+    if not CONTACT_DETAILS.fullmatch(text):
+        return None
+    agent = last_agent(state)
+    if agent == "order_agent" and state.get("cart"):
+        return "order_agent"
+    if agent == "modify_order_agent" and state.get("order"):
+        return "modify_order_agent"
+    return None
+
+
+def _confirmation(state: AgentState, text: str) -> str | None:
+    # "Yes / confirm" right after a draft order or a change summary goes back to its agent
+    if not CONFIRMATION.fullmatch(text):
+        return None
+    agent = last_agent(state)
+    if agent == "order_agent" and state.get("cart"):
+        return "order_agent"
+    if agent == "modify_order_agent" and state.get("order"):
+        return "modify_order_agent"
+    return None
+
+
+# First match wins
+RULES: tuple[tuple[str, Callable[[AgentState, str], str | None]], ...] = (
+    ("order_reference", _order_reference),
+    ("buy_more_after_order", _buy_more_after_order),
+    ("contact_details", _contact_details),
+    ("confirmation", _confirmation)
+)
+
+
+def route_by_rules(state: AgentState) -> tuple[str, str] | None:
+    """
+    Route the turn without the orchestrator LLM when the state and the customer's
+    message leave no doubt.
+
+    Returns:
+        tuple[str, str] | None: (next agent, rule name), or None to ask the LLM.
+    """
+    if not SUPERVISOR_RULES_ENABLED:
+        return None
+
+    text = normalize_text(state.get("user_input") or "")
+    if not text:
+        return None
+
+    for name, rule in RULES:
+        agent = rule(state, text)
+        if agent is not None:
+            return agent, name
+    return None
@@ -97,6 +97,10 @@ class AgentState(Origin_AgentState):
     
     order: Annotated[Optional[dict[int, Order]], _remain_dict]
     
+    # Rolling summary of `messages[:summarized_messages]`, see core.graph.context_window
+    summary: Annotated[Optional[str], _remain_value]
+    summarized_messages: Annotated[Optional[int], _remain_value]
+    
     
 def init_state() -> AgentState:
     """
@@ -118,5 +122,8 @@ def init_state() -> AgentState:
         seen_products=None,
         cart=None,
         
-        order=None
+        order=None,
+        
+        summary=None,
+        summarized_messages=None
     )
@@ -6,6 +6,10 @@ from langchain_core.messages import HumanMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
 from core.graph.state import AgentState 
+from core.graph.context_window import ContextWindow
+from core.graph.routing_rules import route_by_rules
+from core.graph.intent_classifier import intent_router, log_decision
+from services.metrics import SUPERVISOR_ROUTES
 from log.logger_config import setup_logging
 from database.connection import orchestrator_llm
 
@@ -40,6 +44,7 @@ class Supervisor:
         ])
         
         self.chain = self.prompt | orchestrator_llm.with_structured_output(Route)
+        self.window = ContextWindow("supervisor")
         
     async def supervisor_node(self, state: AgentState) -> Command:
         """
@@ -56,15 +61,29 @@ class Supervisor:
         try:
             await logger.info(f"Customer request: {state['user_input']}")
             
-            result = await self.chain.ainvoke(state)
+            # Obvious turns are routed from the state alone, without the LLM round trip
+            routed = route_by_rules(state)
+            classified = None if routed else intent_router.route(state)
+            if routed:
+                next_node, source = routed
+            elif classified:
+                # Confident local classifier, sub-millisecond
+                next_node, source = classified[0], "classifier"
+            else:
+                # The agents refresh the shared summary, routing never waits on it
+                result = await self.chain.ainvoke({**state, "messages": self.window.messages(state)})
+                next_node, source = result.next, "llm"
+            SUPERVISOR_ROUTES.inc(source=source, next=next_node)
+            # Training data of the intent classifier
+            log_decision(state, next_node=next_node, source=source)
             
-            next_node = result.next
             update["next"] = next_node
             update["messages"] = [HumanMessage(
                 content=state["user_input"]
             )]
             
-            await logger.info(f"Next agent: {next_node}")
+            confidence = f" ({classified[1]:.2f})" if classified else ""
+            await logger.info(f"Next agent: {next_node} | Routed by: {source}{confidence}")
     
             return Command(
                 update=update,
@@ -1,5 +1,6 @@
 from fastapi import Depends
 from supabase import AsyncClient
+from langgraph.graph.state import CompiledStateGraph
 from services.v5.process_chat import ChatbotService
 from repository.async_repo import (
     AsyncCustomerRepo, 
@@ -14,6 +15,9 @@ from repository.async_repo import (
 # Global Supabase client instance
 global_supabase_client: AsyncClient | None = None
 
+# Global compiled conversation graph, built in the app lifespan with its checkpointer
+global_graph: CompiledStateGraph | None = None
+
 
 def get_supabase_client() -> AsyncClient:
     """
@@ -32,6 +36,23 @@ def set_supabase_client(client: AsyncClient) -> None:
     global_supabase_client = client
     
 
+def get_graph() -> CompiledStateGraph:
+    """
+    Retrieve the global compiled conversation graph.
+    """
+    if global_graph is None:
+        raise RuntimeError("Conversation graph has not been initialized")
+    return global_graph
+
+
+def set_graph(graph: CompiledStateGraph) -> None:
+    """
+    Set the global compiled conversation graph.
+    """
+    global global_graph
+    global_graph = graph
+    
+
 def get_product_repo(
     client: AsyncClient = Depends(get_supabase_client)
 ) -> AsyncProductRepo:
@@ -147,6 +168,19 @@ class RepositoryManager:
     def get_order_log_repo(self) -> AsyncOrderLogRepo:
         self._ensure_initialized()
         return AsyncOrderLogRepo(client=self._client)
+    
+    def get_chatbot_service(self) -> ChatbotService:
+        """
+        ChatbotService for work done outside a request, e.g. by background dispatchers.
+        """
+        self._ensure_initialized()
+        return ChatbotService(
+            product_repo=self.get_product_repo(),
+            customer_repo=self.get_customer_repo(),
+            session_repo=self.get_session_repo(),
+            event_repo=self.get_event_repo(),
+            message_repo=self.get_message_repo()
+        )
 
 
 repo_manager = RepositoryManager()
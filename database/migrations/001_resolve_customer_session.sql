@@ -0,0 +1,91 @@
+-- Resolve the customer and active session of a chat in one round trip.
+--
+-- Replaces the find_customer -> (create_customer) -> create_session -> create_event
+-- -> update_end_session -> find_customer sequence done by ChatbotService._handle_customer:
+--   * the customer is created on first contact,
+--   * a chat without an active session gets one with a `new_customer` event,
+--   * a session idle for more than p_n_days is closed and replaced, with a
+--     `returning_customer` event,
+--   * otherwise the session's last_active_at is refreshed.
+-- Everything runs in one transaction; the row locks serialize concurrent turns of
+-- the same chat so a session is never rotated twice.
+--
+-- Returns the customer row with its active session in `sessions`, the same shape
+-- as `customers?select=*,sessions(*)&sessions.status=eq.active`, plus
+-- `is_new_customer`.
+
+create or replace function public.resolve_customer_session(
+    p_chat_id text,
+    p_thread_id text,
+    p_n_days integer
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_customer public.customers%rowtype;
+    v_session public.sessions%rowtype;
+    v_is_new_customer boolean := false;
+    v_event_type text := null;
+begin
+    select * into v_customer
+    from public.customers
+    where chat_id = p_chat_id
+    for update;
+
+    if not found then
+        insert into public.customers (chat_id)
+        values (p_chat_id)
+        on conflict (chat_id) do nothing
+        returning * into v_customer;
+
+        if found then
+            v_is_new_customer := true;
+        else
+            -- Created by a concurrent call between the select and the insert
+            select * into v_customer
+            from public.customers
+            where chat_id = p_chat_id
+            for update;
+        end if;
+    end if;
+
+    select * into v_session
+    from public.sessions
+    where customer_id = v_customer.id
+      and status = 'active'
+    order by started_at desc
+    limit 1
+    for update;
+
+    if not found then
+        v_event_type := 'new_customer';
+    elsif v_session.last_active_at < now() - make_interval(days => p_n_days) then
+        update public.sessions
+        set status = 'inactive',
+            ended_at = now()
+        where id = v_session.id;
+
+        v_event_type := 'returning_customer';
+    else
+        update public.sessions
+        set last_active_at = now()
+        where id = v_session.id
+        returning * into v_session;
+    end if;
+
+    if v_event_type is not null then
+        insert into public.sessions (customer_id, thread_id, started_at, last_active_at, status)
+        values (v_customer.id, p_thread_id, now(), now(), 'active')
+        returning * into v_session;
+
+        insert into public.events (customer_id, session_id, event_type, "timestamp")
+        values (v_customer.id, v_session.id, v_event_type, now());
+    end if;
+
+    return to_jsonb(v_customer) || jsonb_build_object(
+        'sessions', jsonb_build_array(to_jsonb(v_session)),
+        'is_new_customer', v_is_new_customer
+    );
+end;
+$$;
@@ -0,0 +1,94 @@
+-- Let resolve_customer_session leave idle sessions to the background session
+-- sweeper (services/session_sweeper.py).
+--
+-- With p_n_days null, the active session is never rotated on the customer's
+-- message, only refreshed. An existing customer without an active session had
+-- it closed by the sweeper, so the new session gets a `returning_customer`
+-- event instead of `new_customer`. With p_n_days set, the behaviour of
+-- 001_resolve_customer_session.sql is unchanged.
+
+create or replace function public.resolve_customer_session(
+    p_chat_id text,
+    p_thread_id text,
+    p_n_days integer
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_customer public.customers%rowtype;
+    v_session public.sessions%rowtype;
+    v_is_new_customer boolean := false;
+    v_event_type text := null;
+begin
+    select * into v_customer
+    from public.customers
+    where chat_id = p_chat_id
+    for update;
+
+    if not found then
+        insert into public.customers (chat_id)
+        values (p_chat_id)
+        on conflict (chat_id) do nothing
+        returning * into v_customer;
+
+        if found then
+            v_is_new_customer := true;
+        else
+            -- Created by a concurrent call between the select and the insert
+            select * into v_customer
+            from public.customers
+            where chat_id = p_chat_id
+            for update;
+        end if;
+    end if;
+
+    select * into v_session
+    from public.sessions
+    where customer_id = v_customer.id
+      and status = 'active'
+    order by started_at desc
+    limit 1
+    for update;
+
+    if not found then
+        if v_is_new_customer or p_n_days is not null then
+            v_event_type := 'new_customer';
+        else
+            v_event_type := 'returning_customer';
+        end if;
+    elsif p_n_days is not null
+      and v_session.last_active_at < now() - make_interval(days => p_n_days) then
+        update public.sessions
+        set status = 'inactive',
+            ended_at = now()
+        where id = v_session.id;
+
+        v_event_type := 'returning_customer';
+    else
+        update public.sessions
+        set last_active_at = now()
+        where id = v_session.id
+        returning * into v_session;
+    end if;
+
+    if v_event_type is not null then
+        insert into public.sessions (customer_id, thread_id, started_at, last_active_at, status)
+        values (v_customer.id, p_thread_id, now(), now(), 'active')
+        returning * into v_session;
+
+        insert into public.events (customer_id, session_id, event_type, "timestamp")
+        values (v_customer.id, v_session.id, v_event_type, now());
+    end if;
+
+    return to_jsonb(v_customer) || jsonb_build_object(
+        'sessions', jsonb_build_array(to_jsonb(v_session)),
+        'is_new_customer', v_is_new_customer
+    );
+end;
+$$;
+
+-- Supports the sweeper's "active sessions idle since" scan
+create index if not exists idx_sessions_active_last_active_at
+    on public.sessions (last_active_at)
+    where status = 'active';
@@ -0,0 +1,124 @@
+-- Incremental session state (repository/state_delta.py).
+--
+-- sessions.state_base64 keeps a snapshot of the state; each turn appends the
+-- difference to session_state_deltas instead of rewriting the whole state, and
+-- every STATE_COMPACT_EVERY turns a new snapshot is written. Writing a snapshot
+-- drops the deltas it includes (trigger below), so readers always load the
+-- snapshot plus the deltas of the session.
+--
+-- resolve_customer_session now also returns the deltas of the active session,
+-- the same shape as `sessions(*,session_state_deltas(id,delta))`; otherwise it
+-- is unchanged from 002_resolve_customer_session_sweeper.sql.
+
+create table if not exists public.session_state_deltas (
+    id bigint generated always as identity primary key,
+    session_id bigint not null references public.sessions (id) on delete cascade,
+    delta text not null,
+    created_at timestamptz not null default now()
+);
+
+create index if not exists idx_session_state_deltas_session_id
+    on public.session_state_deltas (session_id, id);
+
+create or replace function public.drop_session_state_deltas()
+returns trigger
+language plpgsql
+as $$
+begin
+    delete from public.session_state_deltas where session_id = new.id;
+    return new;
+end;
+$$;
+
+drop trigger if exists trg_sessions_state_snapshot on public.sessions;
+create trigger trg_sessions_state_snapshot
+    after update of state_base64 on public.sessions
+    for each row
+    execute function public.drop_session_state_deltas();
+
+create or replace function public.resolve_customer_session(
+    p_chat_id text,
+    p_thread_id text,
+    p_n_days integer
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_customer public.customers%rowtype;
+    v_session public.sessions%rowtype;
+    v_is_new_customer boolean := false;
+    v_event_type text := null;
+begin
+    select * into v_customer
+    from public.customers
+    where chat_id = p_chat_id
+    for update;
+
+    if not found then
+        insert into public.customers (chat_id)
+        values (p_chat_id)
+        on conflict (chat_id) do nothing
+        returning * into v_customer;
+
+        if found then
+            v_is_new_customer := true;
+        else
+            -- Created by a concurrent call between the select and the insert
+            select * into v_customer
+            from public.customers
+            where chat_id = p_chat_id
+            for update;
+        end if;
+    end if;
+
+    select * into v_session
+    from public.sessions
+    where customer_id = v_customer.id
+      and status = 'active'
+    order by started_at desc
+    limit 1
+    for update;
+
+    if not found then
+        if v_is_new_customer or p_n_days is not null then
+            v_event_type := 'new_customer';
+        else
+            v_event_type := 'returning_customer';
+        end if;
+    elsif p_n_days is not null
+      and v_session.last_active_at < now() - make_interval(days => p_n_days) then
+        update public.sessions
+        set status = 'inactive',
+            ended_at = now()
+        where id = v_session.id;
+
+        v_event_type := 'returning_customer';
+    else
+        update public.sessions
+        set last_active_at = now()
+        where id = v_session.id
+        returning * into v_session;
+    end if;
+
+    if v_event_type is not null then
+        insert into public.sessions (customer_id, thread_id, started_at, last_active_at, status)
+        values (v_customer.id, p_thread_id, now(), now(), 'active')
+        returning * into v_session;
+
+        insert into public.events (customer_id, session_id, event_type, "timestamp")
+        values (v_customer.id, v_session.id, v_event_type, now());
+    end if;
+
+    return to_jsonb(v_customer) || jsonb_build_object(
+        'sessions', jsonb_build_array(to_jsonb(v_session) || jsonb_build_object(
+            'session_state_deltas', coalesce((
+                select jsonb_agg(jsonb_build_object('id', d.id, 'delta', d.delta) order by d.id)
+                from public.session_state_deltas d
+                where d.session_id = v_session.id
+            ), '[]'::jsonb)
+        )),
+        'is_new_customer', v_is_new_customer
+    );
+end;
+$$;
@@ -0,0 +1,96 @@
+-- Report the thread of the session closed by resolve_customer_session.
+--
+-- With CHECKPOINT_DURABLE the graph state of a session lives in its checkpointer
+-- thread; when the function rotates an idle session, the caller deletes the
+-- closed session's thread. `closed_thread_id` holds it, null when no session was
+-- rotated; otherwise the function is unchanged from 003_session_state_deltas.sql.
+
+create or replace function public.resolve_customer_session(
+    p_chat_id text,
+    p_thread_id text,
+    p_n_days integer
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_customer public.customers%rowtype;
+    v_session public.sessions%rowtype;
+    v_is_new_customer boolean := false;
+    v_event_type text := null;
+    v_closed_thread_id text := null;
+begin
+    select * into v_customer
+    from public.customers
+    where chat_id = p_chat_id
+    for update;
+
+    if not found then
+        insert into public.customers (chat_id)
+        values (p_chat_id)
+        on conflict (chat_id) do nothing
+        returning * into v_customer;
+
+        if found then
+            v_is_new_customer := true;
+        else
+            -- Created by a concurrent call between the select and the insert
+            select * into v_customer
+            from public.customers
+            where chat_id = p_chat_id
+            for update;
+        end if;
+    end if;
+
+    select * into v_session
+    from public.sessions
+    where customer_id = v_customer.id
+      and status = 'active'
+    order by started_at desc
+    limit 1
+    for update;
+
+    if not found then
+        if v_is_new_customer or p_n_days is not null then
+            v_event_type := 'new_customer';
+        else
+            v_event_type := 'returning_customer';
+        end if;
+    elsif p_n_days is not null
+      and v_session.last_active_at < now() - make_interval(days => p_n_days) then
+        update public.sessions
+        set status = 'inactive',
+            ended_at = now()
+        where id = v_session.id;
+
+        v_closed_thread_id := v_session.thread_id;
+        v_event_type := 'returning_customer';
+    else
+        update public.sessions
+        set last_active_at = now()
+        where id = v_session.id
+        returning * into v_session;
+    end if;
+
+    if v_event_type is not null then
+        insert into public.sessions (customer_id, thread_id, started_at, last_active_at, status)
+        values (v_customer.id, p_thread_id, now(), now(), 'active')
+        returning * into v_session;
+
+        insert into public.events (customer_id, session_id, event_type, "timestamp")
+        values (v_customer.id, v_session.id, v_event_type, now());
+    end if;
+
+    return to_jsonb(v_customer) || jsonb_build_object(
+        'sessions', jsonb_build_array(to_jsonb(v_session) || jsonb_build_object(
+            'session_state_deltas', coalesce((
+                select jsonb_agg(jsonb_build_object('id', d.id, 'delta', d.delta) order by d.id)
+                from public.session_state_deltas d
+                where d.session_id = v_session.id
+            ), '[]'::jsonb)
+        )),
+        'is_new_customer', v_is_new_customer,
+        'closed_thread_id', v_closed_thread_id
+    );
+end;
+$$;
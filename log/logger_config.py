@@ -12,6 +12,9 @@ from rich.console import Console
 
 console = Console(force_terminal=True, width=120)
 
+# Every QueueListener started by setup_logging, stopped together on shutdown
+_queue_listeners: list[QueueListener] = []
+
 
 class AsyncColoredLogger:
     """Async wrapper class cung cấp các method với màu cố định cho console"""
@@ -213,10 +216,47 @@ def setup_logging(
         respect_handler_level=True
     )
     listener.start()
+    _queue_listeners.append(listener)
 
     return AsyncColoredLogger(logger, listener)
 
 
+def setup_record_writer(name: str, log_filename: str) -> logging.Logger:
+    """
+    Logger ghi nguyên văn mỗi message thành một dòng của `log_filename`, dùng cho
+    các file dữ liệu (JSONL). Ghi file chạy trên thread của QueueListener như `setup_logging`.
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.handlers.clear()
+
+    log_queue = Queue(-1)
+    logger.addHandler(QueueHandler(log_queue))
+
+    Path(log_filename).parent.mkdir(parents=True, exist_ok=True)
+    file_handler = logging.FileHandler(log_filename, encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter("%(message)s"))
+
+    listener = QueueListener(log_queue, file_handler)
+    listener.start()
+    _queue_listeners.append(listener)
+
+    return logger
+
+
+def shutdown_logging() -> None:
+    """
+    Flush and stop every QueueListener created by `setup_logging`.
+    Gọi một lần khi ứng dụng tắt, sau khi không còn log nào được ghi.
+    """
+    while _queue_listeners:
+        listener = _queue_listeners.pop()
+        # QueueListener.stop() flushes the queue before joining the thread
+        if listener._thread is not None:
+            listener.stop()
+
+
 # ============= Test Code =============
 async def test_async_logging():
     """Test async logging với concurrent tasks"""
@@ -1,5 +1,9 @@
+import os
+import time
+from datetime import datetime
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from supabase import AsyncClient
 from typing import AsyncGenerator
 from contextlib import asynccontextmanager
@@ -9,10 +13,51 @@ from database.dependencies import repo_manager
 from api.chatbot.v5.routes import router as api_chatbot_router_v5
 from api.admin.v1.routes import router as api_admin_router_v1
 from database.connection import get_async_supabase_client
-from database.dependencies import set_supabase_client
+from database.dependencies import set_graph, set_supabase_client
+from core.graph.build_graph import create_main_graph
+from core.graph.checkpointer import open_checkpointer
+from core.graph.intent_classifier import intent_router
+from services.mailbox import chat_mailbox
+from services.worker_pool import worker_pool
+from services.idempotency import idempotency_store
+from services.write_behind import write_behind
+from services.callback_client import callback_client
+from services.callback_outbox import OutboxEntry, callback_outbox
+from services.session_sweeper import session_sweeper
+from services.turn_trace import build_stage_span
+from services.utils import now_vietnam_time
+from repository.cache import control_mode_cache, customer_cache
+from repository.span_index import span_index
+from services.metrics import CONTENT_TYPE, HTTP_REQUEST_SECONDS, registry
+from log.logger_config import setup_logging, shutdown_logging
+
+logger = setup_logging(__name__)
+
+# Time budget for draining in-flight work when the process is asked to stop
+SHUTDOWN_DEADLINE_SECONDS = float(os.getenv("SHUTDOWN_DEADLINE_SECONDS", 25))
 
 global_supabase_client: AsyncClient | None = None
 
+async def record_reply_spans(entry: OutboxEntry, response_data: dict | None) -> None:
+    """
+    Create the spans of a turn once the callback outbox delivered (or dead-lettered) its reply.
+    """
+    message_spans = entry.context["message_spans"]
+    # The callback stage of an outbox turn lasts from enqueue to delivery
+    callback_span = build_stage_span(
+        step_name="callback",
+        timestamp_start=datetime.fromtimestamp(entry.created_at, tz=now_vietnam_time().tzinfo),
+        timestamp_end=now_vietnam_time(),
+        status="ok" if response_data else "error",
+        parent_span_id=message_spans[0]["id"]
+    )
+    await repo_manager.get_chatbot_service().record_callback_spans(
+        session_id=entry.context["session_id"],
+        customer_id=entry.context["customer_id"],
+        message_spans=message_spans + [callback_span],
+        response_data=response_data
+    )
+
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     global global_supabase_client
@@ -21,7 +66,38 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     set_supabase_client(client=global_supabase_client)
     repo_manager.initialize(client=global_supabase_client)
     
-    yield 
+    # The checkpointer lives as long as the app, so the graph is built here
+    async with open_checkpointer() as checkpointer:
+        set_graph(graph=create_main_graph(checkpointer=checkpointer))
+        await logger.info(f"Conversation graph ready | Checkpointer: {type(checkpointer).__name__}")
+        
+        await callback_client.start()
+        await worker_pool.start()
+        await write_behind.start(client=global_supabase_client)
+        await callback_outbox.start(on_settled=record_reply_spans)
+        await session_sweeper.start(client=global_supabase_client, checkpointer=checkpointer)
+        
+        yield 
+        
+        # Shutdown: stop accepting work, then drain in-flight webhook turns so their
+        # callbacks, spans and session state are written before the process exits
+        deadline = time.monotonic() + SHUTDOWN_DEADLINE_SECONDS
+        await logger.info(f"Shutting down | Deadline: {SHUTDOWN_DEADLINE_SECONDS} s")
+        
+        chat_mailbox.close()
+        await session_sweeper.stop()
+        drained = await worker_pool.shutdown(timeout=deadline - time.monotonic())
+        # Deliver the replies of the drained turns, undelivered ones stay in the outbox
+        delivered = await callback_outbox.stop(timeout=deadline - time.monotonic())
+        # Last, the drained turns and delivered replies queued their bookkeeping writes
+        flushed = await write_behind.stop(timeout=deadline - time.monotonic())
+        await callback_client.stop()
+        
+        await logger.info(
+            f"Shutdown complete | Drained: {drained} | Replies delivered: {delivered} | Writes flushed: {flushed} | Mailbox: {chat_mailbox.stats()}"
+        )
+    
+    shutdown_logging()
 
 # Create a FastAPI app instance
 app = FastAPI(
@@ -41,6 +117,159 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    started_at = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, not raw path, to keep the number of series bounded
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started_at,
+            method=request.method,
+            route=route.path if route else "unmatched",
+            status=status
+        )
+
+# Queue depths and counters already kept by the components, read at scrape time
+registry.callback(
+    "chatbot_mailbox_queued_messages",
+    "Webhook messages waiting in per-chat mailboxes.",
+    lambda: [({}, chat_mailbox.stats()["queued_messages"])]
+)
+registry.callback(
+    "chatbot_mailbox_active_chats",
+    "Chats with queued or running webhook messages.",
+    lambda: [({}, chat_mailbox.stats()["active_chats"])]
+)
+registry.callback(
+    "chatbot_worker_pool_busy_workers",
+    "Workers currently running a job.",
+    lambda: [({}, worker_pool.stats()["busy"])]
+)
+registry.callback(
+    "chatbot_worker_pool_queued_jobs",
+    "Jobs waiting for a free worker.",
+    lambda: [({}, worker_pool.stats()["queued"])]
+)
+registry.callback(
+    "chatbot_worker_pool_jobs_total",
+    "Worker pool jobs by outcome.",
+    lambda: [
+        ({"outcome": outcome}, value)
+        for outcome, value in worker_pool.stats().items()
+        if outcome in ("accepted", "rejected", "completed", "failed")
+    ],
+    type="counter"
+)
+registry.callback(
+    "chatbot_write_behind_pending_writes",
+    "Bookkeeping writes queued by the write-behind and not yet flushed.",
+    lambda: [({}, write_behind.stats()["pending"])]
+)
+registry.callback(
+    "chatbot_write_behind_writes_total",
+    "Write-behind operations by outcome.",
+    lambda: [
+        ({"outcome": outcome}, value)
+        for outcome, value in write_behind.stats().items()
+        if outcome in ("flushed", "failed", "dead_lettered")
+    ],
+    type="counter"
+)
+registry.callback(
+    "chatbot_callback_outbox_pending_replies",
+    "Replies waiting in the callback outbox, as seen by this process.",
+    lambda: [({}, callback_outbox.stats()["pending"])]
+)
+registry.callback(
+    "chatbot_callback_outbox_replies_total",
+    "Callback outbox replies by outcome.",
+    lambda: [
+        ({"outcome": outcome}, value)
+        for outcome, value in callback_outbox.stats().items()
+        if outcome in ("enqueued", "delivered", "retried", "dead_lettered")
+    ],
+    type="counter"
+)
+registry.callback(
+    "chatbot_session_sweeper_evictions_total",
+    "Items cleaned up by the session sweeper, by kind.",
+    lambda: [
+        ({"kind": "sessions_closed"}, session_sweeper.stats()["sessions_closed"]),
+        ({"kind": "checkpoints_evicted"}, session_sweeper.stats()["checkpoints_evicted"]),
+        ({"kind": "cache_entries_evicted"}, session_sweeper.stats()["cache_entries_evicted"])
+    ],
+    type="counter"
+)
+registry.callback(
+    "chatbot_session_sweeper_last_sweep_seconds",
+    "Duration of the last session sweep.",
+    lambda: [({}, session_sweeper.stats()["last_sweep_ms"] / 1000)]
+)
+registry.callback(
+    "chatbot_webhook_duplicates_total",
+    "Redelivered webhook messages skipped by the idempotency store.",
+    lambda: [({}, idempotency_store.stats()["duplicates"])],
+    type="counter"
+)
+registry.callback(
+    "chatbot_control_mode_cache_lookups_total",
+    "Control mode cache lookups by result.",
+    lambda: [
+        ({"result": "hit"}, control_mode_cache.stats()["hits"]),
+        ({"result": "miss"}, control_mode_cache.stats()["misses"])
+    ],
+    type="counter"
+)
+registry.callback(
+    "chatbot_span_index_lookups_total",
+    "Last-outbound-span index lookups by result, a miss costs two DB queries.",
+    lambda: [
+        ({"result": "hit"}, span_index.stats()["hits"]),
+        ({"result": "miss"}, span_index.stats()["misses"])
+    ],
+    type="counter"
+)
+registry.callback(
+    "chatbot_customer_cache_lookups_total",
+    "Customer/session cache lookups by result, a miss costs one DB query.",
+    lambda: [
+        ({"result": "hit"}, customer_cache.stats()["hits"]),
+        ({"result": "miss"}, customer_cache.stats()["misses"])
+    ],
+    type="counter"
+)
+registry.callback(
+    "chatbot_intent_model_loads_total",
+    "Intent classifier model files loaded by result, a failed load keeps the previous model.",
+    lambda: [
+        ({"result": "ok"}, intent_router.stats()["loads"]),
+        ({"result": "error"}, intent_router.stats()["load_errors"])
+    ],
+    type="counter"
+)
+registry.callback(
+    "chatbot_customer_cache_entries",
+    "Chats held in the customer/session cache.",
+    lambda: [({}, customer_cache.stats()["entries"])]
+)
+registry.callback(
+    "chatbot_customer_cache_bytes",
+    "Approximate memory held by the customer/session cache.",
+    lambda: [({}, customer_cache.stats()["bytes"])]
+)
+registry.callback(
+    "chatbot_customer_cache_evictions_total",
+    "Customer/session cache entries evicted by the entry or memory cap.",
+    lambda: [({}, customer_cache.stats()["evictions"])],
+    type="counter"
+)
+
 # Include the API router with a prefix
 app.include_router(api_chatbot_router_v5, prefix="/api/chatbot/v5") # web
 
@@ -61,6 +290,14 @@ async def health():
     """
     return {"status": "healthy"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Prometheus scrape endpoint: latency histograms of requests, graph nodes, tools,
+    LLM and Supabase calls, token counters, queue depths and error counts.
+    """
+    return PlainTextResponse(content=registry.render(), media_type=CONTENT_TYPE)
+
 
 if __name__ == "__main__":
     # This will only run if you execute the file directly
@@ -1,13 +1,15 @@
 import httpx
-import pickle
-import base64
 from typing import Optional
 from zoneinfo import ZoneInfo
 from supabase import AsyncClient
+from postgrest import ReturnMethod
 from datetime import datetime, timezone
 from tenacity import stop_after_attempt, wait_exponential, retry_if_exception_type
 
+from repository.cache import control_mode_cache, customer_cache
 from repository.retry_handling import retry_all_async_methods
+from repository.state_codec import decode_state, encode_state
+from repository.state_delta import STATE_DELTAS_ENABLED, apply_state_deltas, build_state_delta
 
 VALID_EVENT_TYPES = {
     "new_customer", 
@@ -40,20 +42,60 @@ def _to_vn(dt_str_or_dt) -> str:
     
     return dt_vn
 
-def _encode_state(state: dict) -> str:
-    dumps = pickle.dumps(state)
-    encoded = base64.b64encode(dumps).decode("utf-8")
-    
-    return encoded
-
-def _decode_state(data: str) -> dict:
-    if not data:
-        return {}
-    
-    dumps = base64.b64decode(data.encode("utf-8"))
-    state = pickle.loads(dumps)
-    
-    return state
+def build_event(customer_id: int, session_id: int, event_type: str) -> dict:
+    if event_type not in VALID_EVENT_TYPES:
+        raise ValueError(f"Invalid event_type: {event_type}. Must be one of {VALID_EVENT_TYPES}")
+    
+    return {
+        "customer_id": customer_id,
+        "session_id": session_id,
+        "event_type": event_type,
+        "timestamp": _get_time_vn()
+    }
+
+def build_state_payload(state: dict) -> dict:
+    return {"state_base64": encode_state(state=state)}
+
+def build_state_delta_row(session_id: int, delta: dict) -> dict:
+    return {"session_id": session_id, "delta": encode_state(state=delta)}
+
+def _encoded_state_size(customer: dict) -> int:
+    return sum(
+        len(session.get("state_base64") or "")
+        + sum(len(row["delta"]) for row in session.get("session_state_deltas") or [])
+        for session in customer["sessions"]
+    )
+
+def _hydrate_customer(customer: dict) -> dict:
+    # Cache the control mode and decode the active session like every customer read
+    control_mode_cache.set(customer.get("chat_id"), customer.get("control_mode"))
+    
+    if customer["sessions"]:
+        session = customer["sessions"][0]
+        session["started_at"] = _to_vn(session["started_at"]) 
+        session["last_active_at"] = _to_vn(session["last_active_at"]) 
+        # Snapshot plus the deltas appended since (database/migrations/003_session_state_deltas.sql)
+        deltas = sorted(session.pop("session_state_deltas", None) or [], key=lambda row: row["id"])
+        session["state_base64"], session["state_delta_count"] = apply_state_deltas(
+            decode_state(session["state_base64"]),
+            [decode_state(row["delta"]) for row in deltas]
+        )
+    
+    return customer
+
+def _is_current(customer: dict, row: dict | None) -> bool:
+    # Every turn refreshes `last_active_at` or rotates the session, whichever process runs it
+    if row is None or row.get("control_mode") != customer.get("control_mode"):
+        return False
+    
+    sessions = row.get("sessions") or []
+    cached_sessions = customer.get("sessions") or []
+    if len(sessions) != len(cached_sessions):
+        return False
+    return all(
+        session["id"] == cached["id"] and _to_vn(session["last_active_at"]) == cached["last_active_at"]
+        for session, cached in zip(sessions, cached_sessions)
+    )
 
 # --------------------------------------
 # Main class
@@ -92,6 +134,30 @@ class AsyncCustomerRepo:
             .execute()
         )
         
+        if response.data:
+            control_mode_cache.set(response.data[0].get("chat_id"), response.data[0].get("control_mode"))
+            customer_cache.invalidate(response.data[0].get("chat_id"))
+        else:
+            customer_cache.invalidate_customer(customer_id)
+        
+        return response.data[0] if response.data else None
+    
+    async def update_customer_by_chat_id(
+        self, 
+        chat_id: str, 
+        update_payload: dict
+    ) -> dict | None:
+        response = (
+            await self.supabase_client.table('customers')
+            .update(update_payload)
+            .eq('chat_id', chat_id)
+            .execute()
+        )
+        
+        customer_cache.invalidate(chat_id)
+        if response.data:
+            control_mode_cache.set(chat_id, response.data[0].get("control_mode"))
+        
         return response.data[0] if response.data else None
         
     async def get_uuid(self, chat_id: str) -> str | None:
@@ -112,6 +178,7 @@ class AsyncCustomerRepo:
             )
             .execute()
         )
+        customer_cache.invalidate(chat_id)
 
         return response.data[0] if response.data else None
 
@@ -122,6 +189,7 @@ class AsyncCustomerRepo:
             .eq("id", customer_id)
             .execute()
         )
+        customer_cache.invalidate_customer(customer_id)
         return bool(response.data)
     
     async def update_uuid(self, chat_id: str, new_uuid: str) -> str | None:
@@ -131,28 +199,93 @@ class AsyncCustomerRepo:
             .eq("chat_id", chat_id)
             .execute()
         )
+        customer_cache.invalidate(chat_id)
 
         return response.data[0]["uuid"] if response.data else None
     
-    async def find_customer(self, chat_id: str) -> dict | None:
+    async def find_customer(self, chat_id: str, revalidate: bool = True) -> dict | None:
+        """
+        Customer with its active session and decoded state, served from `customer_cache` when possible.
+        
+        Another worker process may have run a turn of the chat since the entry was cached,
+        so a hit is first checked against the row (control mode, active session and its
+        last activity), a light read that still saves fetching and decoding the state.
+        `revalidate=False` skips the check, for reads right after this process wrote the row
+        under the chat lock.
+        """
+        customer = customer_cache.get(chat_id)
+        if customer is not None:
+            if not revalidate or _is_current(customer, await self.fetch_customer_version(chat_id=chat_id)):
+                return customer
+            customer_cache.invalidate(chat_id)
+        
+        return await self.fetch_customer(chat_id=chat_id)
+    
+    async def fetch_customer_version(self, chat_id: str) -> dict | None:
         response = (
             await self.supabase_client.table("customers")
-            .select("*, sessions(*)")
+            .select("control_mode, sessions(id, last_active_at)")
             .eq("chat_id", chat_id)
             .eq("sessions.status", "active")
             .execute()
         )
+        
+        return response.data[0] if response.data else None
+    
+    async def fetch_customer(self, chat_id: str) -> dict | None:
+        response = (
+            await self.supabase_client.table("customers")
+            .select("*, sessions(*, session_state_deltas(id, delta))" if STATE_DELTAS_ENABLED else "*, sessions(*)")
+            .eq("chat_id", chat_id)
+            .eq("sessions.status", "active")
+            .execute()
+        )
+
+        if not response.data:
+            return None
+        
+        customer = response.data[0]
+        encoded_size = _encoded_state_size(customer)
+        customer = _hydrate_customer(customer)
+        customer_cache.set(chat_id, customer, encoded_size=encoded_size)
+        
+        return customer
+    
+    async def resolve_customer_session(
+        self, 
+        chat_id: str, 
+        thread_id: str, 
+        n_days: int | None
+    ) -> dict | None:
+        """
+        Create the customer if needed, rotate or refresh its active session and
+        add the session event in one round trip (`database/migrations/001_resolve_customer_session.sql`).
+        With `n_days=None` an idle session is not rotated, the session sweeper closes it
+        (`database/migrations/002_resolve_customer_session_sweeper.sql`).
 
+        Returns:
+            dict | None: Same shape as `find_customer`, plus `is_new_customer` and
+                `closed_thread_id`, the thread of the rotated session if any
+                (`database/migrations/004_resolve_customer_session_closed_thread.sql`).
+        """
+        response = await self.supabase_client.rpc(
+            "resolve_customer_session",
+            {
+                "p_chat_id": chat_id,
+                "p_thread_id": thread_id,
+                "p_n_days": n_days
+            }
+        ).execute()
+        
         if not response.data:
             return None
         
-        if response.data[0]["sessions"]:
-            session = response.data[0]["sessions"][0]
-            session["started_at"] = _to_vn(session["started_at"]) 
-            session["last_active_at"] = _to_vn(session["last_active_at"]) 
-            session["state_base64"] = _decode_state(session["state_base64"])
+        customer = response.data
+        encoded_size = _encoded_state_size(customer)
+        customer = _hydrate_customer(customer)
+        customer_cache.set(chat_id, customer, encoded_size=encoded_size)
         
-        return response.data[0]
+        return customer
     
     async def create_customer(self, chat_id: str) -> dict | None:
         response = (
@@ -160,6 +293,7 @@ class AsyncCustomerRepo:
             .insert({"chat_id": chat_id})
             .execute()
         )
+        customer_cache.invalidate(chat_id)
 
         return response.data[0] if response.data else None
     
@@ -187,6 +321,7 @@ class AsyncSessionRepo:
             )
             .execute()
         )
+        customer_cache.invalidate_customer(customer_id)
 
         return response.data[0] if response.data else None
     
@@ -202,9 +337,48 @@ class AsyncSessionRepo:
             .eq("id", session_id)
             .execute()
         )
+        customer_cache.invalidate_session(session_id)
 
         return response.data[0] if response.data else None
     
+    async def end_idle_sessions(self, idle_before: str, limit: int = 500) -> list[dict]:
+        """
+        Close up to `limit` active sessions whose last activity is older than `idle_before`.
+
+        Returns:
+            list[dict]: `id` and `customer_id` of the sessions picked for closing.
+        """
+        response = (
+            await self.supabase_client.table("sessions")
+            .select("id, customer_id")
+            .eq("status", "active")
+            .lt("last_active_at", idle_before)
+            .limit(limit)
+            .execute()
+        )
+        if not response.data:
+            return []
+        
+        # Re-checked in the update: a session refreshed meanwhile stays open
+        await (
+            self.supabase_client.table("sessions")
+            .update(
+                {
+                    "status": "inactive",
+                    "ended_at": _get_time_vn()
+                },
+                returning=ReturnMethod.minimal
+            )
+            .in_("id", [session["id"] for session in response.data])
+            .eq("status", "active")
+            .lt("last_active_at", idle_before)
+            .execute()
+        )
+        for session in response.data:
+            customer_cache.invalidate_session(session["id"])
+        
+        return response.data
+    
     async def update_last_active_session(self, session_id: int) -> dict | None:
         response = (
             await self.supabase_client.table("sessions")
@@ -216,20 +390,72 @@ class AsyncSessionRepo:
             .eq("id", session_id)
             .execute()
         )
+        if response.data:
+            customer_cache.apply_session_row(
+                {"id": session_id, "last_active_at": _to_vn(response.data[0]["last_active_at"])},
+                fields=("last_active_at",)
+            )
+        else:
+            customer_cache.invalidate_session(session_id)
 
         return response.data[0] if response.data else None
     
     async def update_state_session(self, state: dict, session_id: int) -> dict | None:
+        payload = build_state_payload(state=state)
         response = (
             await self.supabase_client.table("sessions")
-            .update(
-                {
-                    "state_base64": _encode_state(state=state)
-                }
-            )
+            .update(payload)
             .eq("id", session_id)
             .execute()
         )
+        if response.data:
+            # The new snapshot includes every delta, a trigger drops them
+            customer_cache.set_state(session_id, state, encoded_size=len(payload["state_base64"]), delta_count=0)
+        else:
+            customer_cache.invalidate_session(session_id)
+
+        return response.data[0] if response.data else None
+    
+    async def create_state_delta_bulk(self, rows: list[dict]) -> None:
+        # Not echoed back, the delta is the bulk of the request; a failed insert raises
+        await (
+            self.supabase_client.table("session_state_deltas")
+            .insert(rows, returning=ReturnMethod.minimal)
+            .execute()
+        )
+    
+    async def save_state(self, session: dict, state: dict) -> bool:
+        """
+        Persist the state of a session after a turn: as a delta of the state it was
+        loaded with when possible (`repository/state_delta.py`), else as a new snapshot.
+        """
+        delta = build_state_delta(
+            base=session["state_base64"],
+            state=state,
+            delta_count=session.get("state_delta_count", 0)
+        )
+        if delta is None:
+            return await self.update_state_session(state=state, session_id=session["id"]) is not None
+        
+        await self.create_state_delta_bulk(rows=[build_state_delta_row(session_id=session["id"], delta=delta)])
+        customer_cache.set_state(session["id"], state, delta_count=delta["seq"])
+        return True
+    
+    async def update_session(self, session_id: int, update_payload: dict) -> dict | None:
+        response = (
+            await self.supabase_client.table("sessions")
+            .update(update_payload)
+            .eq("id", session_id)
+            .execute()
+        )
+        if response.data:
+            # A state in the payload was already written through by whoever queued it
+            customer_cache.apply_session_row(
+                response.data[0],
+                fields=tuple(field for field in update_payload if field != "state_base64")
+            )
+        else:
+            customer_cache.invalidate_session(session_id)
 
         return response.data[0] if response.data else None
     
@@ -245,7 +471,7 @@ class AsyncSessionRepo:
         if not data:
             return None
 
-        return _decode_state(data=data)
+        return decode_state(data=data)
 
 @retry_all_async_methods(
     stop=stop_after_attempt(2),
@@ -258,23 +484,28 @@ class AsyncEventRepo:
         self.supabase_client = client
         
     async def create_event(self, customer_id: int, session_id: int, event_type: str) -> str | None:
-        if event_type not in VALID_EVENT_TYPES:
-            raise ValueError(f"Invalid event_type: {event_type}. Must be one of {VALID_EVENT_TYPES}")
-
         response = (
             await self.supabase_client.table("events")
             .insert(
-                {
-                    "customer_id": customer_id,
-                    "session_id": session_id,
-                    "event_type": event_type,
-                    "timestamp": _get_time_vn()
-                }
+                build_event(
+                    customer_id=customer_id,
+                    session_id=session_id,
+                    event_type=event_type
+                )
             )
             .execute()
         )
         
         return response.data[0] if response.data else None
+    
+    async def create_event_bulk(self, events: list[dict]) -> list[dict] | None:
+        response = (
+            await self.supabase_client.table("events")
+            .insert(events)
+            .execute()
+        )
+        
+        return response.data if response.data else None
 
 @retry_all_async_methods(
     stop=stop_after_attempt(2),
@@ -309,13 +540,16 @@ class AsyncMessageSpanRepo:
     
     async def create_message_span_bulk(
         self,
-        message_spans: list[dict]
+        message_spans: list[dict],
+        ignore_duplicates: bool = False
     ) -> list[dict] | None:
-        response = (
-            await self.supabase_client.table("message_spans")
-            .insert(message_spans)
-            .execute()
-        )
+        query = self.supabase_client.table("message_spans")
+        if ignore_duplicates:
+            # Spans carry their own id, a replayed insert is then a no-op
+            query = query.upsert(message_spans, on_conflict="id", ignore_duplicates=True)
+        else:
+            query = query.insert(message_spans)
+        response = await query.execute()
 
         return response.data if response.data else None
     
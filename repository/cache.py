@@ -0,0 +1,266 @@
+import os
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+from repository.state_delta import detach_state
+
+load_dotenv()
+
+# The cache is per worker process and only the worker serving an admin takeover/release
+# updates its entry: the others keep the previous mode until it expires, keep it short
+CONTROL_MODE_CACHE_TTL_SECONDS = float(os.getenv("CONTROL_MODE_CACHE_TTL_SECONDS", 2))
+
+CUSTOMER_CACHE_ENABLED = os.getenv("CUSTOMER_CACHE_ENABLED", "false").lower() == "true"
+# Bounds how long an entry is kept, hits are still checked against the row (see `find_customer`)
+CUSTOMER_CACHE_TTL_SECONDS = float(os.getenv("CUSTOMER_CACHE_TTL_SECONDS", 60))
+CUSTOMER_CACHE_MAX_ENTRIES = int(os.getenv("CUSTOMER_CACHE_MAX_ENTRIES", 10_000))
+# Memory cap, estimated from the size of the encoded session state of each entry
+CUSTOMER_CACHE_MAX_BYTES = int(os.getenv("CUSTOMER_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# Rough per-entry overhead of the customer row and the decoded state objects
+_ENTRY_OVERHEAD_BYTES = 2048
+
+
+class ControlModeCache:
+    """
+    In-memory `chat_id -> control_mode` map.
+
+    It is fed by every customer row read through `AsyncCustomerRepo` and pushed
+    directly by the admin takeover/release routes, so messages of chats under
+    ADMIN control can be skipped before any DB or state work.
+
+    Only a fresh ADMIN entry skips a turn. On a miss or a BOT entry the turn goes on
+    and the `control_mode` of the customer row it reads decides, so a takeover made
+    through another worker is honoured right away, and a release within the TTL.
+    """
+
+    def __init__(self, ttl: float = CONTROL_MODE_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self._modes: dict[str, tuple[str, float]] = {}
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, chat_id: str) -> str | None:
+        entry = self._modes.get(chat_id)
+        if entry is None or entry[1] <= time.monotonic():
+            self._modes.pop(chat_id, None)
+            self._misses += 1
+            return None
+
+        self._hits += 1
+        return entry[0]
+
+    def set(self, chat_id: str, control_mode: str | None) -> None:
+        if not chat_id or not control_mode:
+            return
+        self._modes[chat_id] = (control_mode, time.monotonic() + self.ttl)
+
+    def invalidate(self, chat_id: str) -> None:
+        self._modes.pop(chat_id, None)
+
+    def is_admin(self, chat_id: str) -> bool:
+        return self.get(chat_id) == "ADMIN"
+
+    def evict_expired(self) -> int:
+        now = time.monotonic()
+        expired = [chat_id for chat_id, (_, expires_at) in self._modes.items() if expires_at <= now]
+        for chat_id in expired:
+            del self._modes[chat_id]
+        return len(expired)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._modes),
+            "admin_chats": sum(1 for mode, _ in self._modes.values() if mode == "ADMIN"),
+            "hits": self._hits,
+            "misses": self._misses
+        }
+
+
+control_mode_cache = ControlModeCache()
+
+
+class CustomerCache:
+    """
+    Read-through LRU + TTL cache of `find_customer` results keyed by chat_id.
+
+    Entries hold the customer row with its active session and the already decoded
+    state, so a hit costs neither the `*, sessions(*)` query nor decoding the state.
+    Every customer/session write made through the repos invalidates or updates the
+    entry; session state is written through with a detached copy of the state.
+
+    Writes of other worker processes are not seen here, `AsyncCustomerRepo.find_customer`
+    checks a hit against the row before using it.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = CUSTOMER_CACHE_ENABLED,
+        ttl: float = CUSTOMER_CACHE_TTL_SECONDS,
+        max_entries: int = CUSTOMER_CACHE_MAX_ENTRIES,
+        max_bytes: int = CUSTOMER_CACHE_MAX_BYTES
+    ):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        # chat_id -> (customer, size, expires_at)
+        self._entries: OrderedDict[str, tuple[dict, int, float]] = OrderedDict()
+        self._by_customer_id: dict[int, str] = {}
+        self._by_session_id: dict[int, str] = {}
+        self._bytes = 0
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    @staticmethod
+    def _copy(customer: dict) -> dict:
+        # Callers update the customer, session and state dicts in place for the turn, and
+        # tools update cart, order and seen products in place: none of them is shared
+        result = dict(customer)
+        result["sessions"] = [dict(session) for session in customer.get("sessions") or []]
+        for session in result["sessions"]:
+            if isinstance(session.get("state_base64"), dict):
+                session["state_base64"] = detach_state(session["state_base64"])
+        return result
+
+    def _session_id(self, customer: dict) -> int | None:
+        sessions = customer.get("sessions") or []
+        return sessions[0]["id"] if sessions else None
+
+    def _remove(self, chat_id: str) -> None:
+        entry = self._entries.pop(chat_id, None)
+        if entry is None:
+            return
+        customer, size, _ = entry
+        self._bytes -= size
+        if self._by_customer_id.get(customer.get("id")) == chat_id:
+            del self._by_customer_id[customer["id"]]
+        session_id = self._session_id(customer)
+        if session_id is not None and self._by_session_id.get(session_id) == chat_id:
+            del self._by_session_id[session_id]
+
+    def get(self, chat_id: str) -> dict | None:
+        if not self.enabled:
+            return None
+
+        entry = self._entries.get(chat_id)
+        if entry is None or entry[2] <= time.monotonic():
+            self._remove(chat_id)
+            self._misses += 1
+            return None
+
+        self._entries.move_to_end(chat_id)
+        self._hits += 1
+        return self._copy(entry[0])
+
+    def set(self, chat_id: str, customer: dict, encoded_size: int = 0) -> None:
+        """
+        Cache a hydrated customer row.
+
+        Args:
+            chat_id (str): Chat id of the customer.
+            customer (dict): Customer row with `sessions` and the decoded state.
+            encoded_size (int): Length of the encoded state, used to enforce the memory cap.
+        """
+        if not self.enabled or not chat_id:
+            return
+
+        self._remove(chat_id)
+        size = encoded_size + _ENTRY_OVERHEAD_BYTES
+        self._entries[chat_id] = (self._copy(customer), size, time.monotonic() + self.ttl)
+        self._bytes += size
+        if customer.get("id") is not None:
+            self._by_customer_id[customer["id"]] = chat_id
+        session_id = self._session_id(customer)
+        if session_id is not None:
+            self._by_session_id[session_id] = chat_id
+
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self._evictions += 1
+
+    def invalidate(self, chat_id: str | None) -> None:
+        if chat_id in self._entries:
+            self._remove(chat_id)
+            self._invalidations += 1
+
+    def invalidate_customer(self, customer_id: int | None) -> None:
+        self.invalidate(self._by_customer_id.get(customer_id))
+
+    def invalidate_session(self, session_id: int | None) -> None:
+        self.invalidate(self._by_session_id.get(session_id))
+
+    def _cached_session(self, session_id: int) -> dict | None:
+        entry = self._entries.get(self._by_session_id.get(session_id))
+        if entry is None:
+            return None
+        return entry[0]["sessions"][0]
+
+    def set_state(
+        self,
+        session_id: int,
+        state: dict,
+        encoded_size: int | None = None,
+        delta_count: int = 0
+    ) -> None:
+        """
+        Write a new session state through to the cached entry of its chat, with the
+        number of deltas now stored on top of its snapshot.
+        """
+        session = self._cached_session(session_id)
+        if session is None:
+            return
+        session["state_base64"] = detach_state(state)
+        session["state_delta_count"] = delta_count
+
+        if encoded_size is not None:
+            chat_id = self._by_session_id[session_id]
+            customer, size, expires_at = self._entries[chat_id]
+            new_size = encoded_size + _ENTRY_OVERHEAD_BYTES
+            self._entries[chat_id] = (customer, new_size, expires_at)
+            self._bytes += new_size - size
+
+    def apply_session_row(self, row: dict | None, fields: tuple[str, ...]) -> None:
+        """
+        Merge plain fields of a session row returned by an update into the cached entry.
+        The encoded state is never merged, state writes go through `set_state`.
+        """
+        if not row:
+            return
+        session = self._cached_session(row.get("id"))
+        if session is None:
+            return
+        if row.get("status", "active") != "active":
+            self.invalidate_session(row["id"])
+            return
+        for field in fields:
+            if field in row:
+                session[field] = row[field]
+
+    def evict_expired(self) -> int:
+        now = time.monotonic()
+        expired = [chat_id for chat_id, (_, _, expires_at) in self._entries.items() if expires_at <= now]
+        for chat_id in expired:
+            self._remove(chat_id)
+        return len(expired)
+
+    def stats(self) -> dict:
+        lookups = self._hits + self._misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / lookups if lookups else 0.0,
+            "evictions": self._evictions,
+            "invalidations": self._invalidations
+        }
+
+
+customer_cache = CustomerCache()
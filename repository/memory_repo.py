@@ -0,0 +1,267 @@
+import copy
+import asyncio
+from itertools import count
+from datetime import datetime, timedelta
+
+from repository.cache import control_mode_cache
+from repository.state_codec import decode_state
+from repository.state_delta import apply_state_deltas, build_state_delta
+from repository.async_repo import VALID_EVENT_TYPES, _get_time_vn, _to_vn, build_state_delta_row
+
+
+class MemoryDatabase:
+    """
+    In-memory stand-in for the Supabase tables used to resolve a chat's customer
+    and session, for local runs and benchmarks without a database.
+
+    Every repository call sleeps `latency_ms` to model one PostgREST round trip
+    and is counted in `round_trips`.
+    """
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.round_trips = 0
+
+        self.customers: dict[int, dict] = {}
+        self.sessions: dict[int, dict] = {}
+        self.events: dict[int, dict] = {}
+        self.message_spans: dict[str, dict] = {}
+        # session_id -> rows of session_state_deltas
+        self.state_deltas: dict[int, list[dict]] = {}
+        self._ids = count(1)
+
+    async def round_trip(self) -> None:
+        self.round_trips += 1
+        await asyncio.sleep(self.latency_ms / 1000)
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    def customer_by_chat_id(self, chat_id: str) -> dict | None:
+        return next((c for c in self.customers.values() if c["chat_id"] == chat_id), None)
+
+    def active_session(self, customer_id: int) -> dict | None:
+        sessions = [
+            s for s in self.sessions.values()
+            if s["customer_id"] == customer_id and s["status"] == "active"
+        ]
+        return max(sessions, key=lambda s: s["started_at"]) if sessions else None
+
+    def hydrate(self, customer: dict) -> dict:
+        # Same shape and post-processing as AsyncCustomerRepo.find_customer
+        result = copy.deepcopy(customer)
+        session = self.active_session(customer["id"])
+        result["sessions"] = [copy.deepcopy(session)] if session else []
+
+        control_mode_cache.set(result["chat_id"], result.get("control_mode"))
+        if result["sessions"]:
+            session = result["sessions"][0]
+            session["started_at"] = _to_vn(session["started_at"])
+            session["last_active_at"] = _to_vn(session["last_active_at"])
+            session["state_base64"], session["state_delta_count"] = apply_state_deltas(
+                session["state_base64"] or {},
+                [decode_state(row["delta"]) for row in self.state_deltas.get(session["id"], [])]
+            )
+        return result
+
+    def insert_session(self, customer_id: int, thread_id: str) -> dict:
+        now = _get_time_vn()
+        session = {
+            "id": self.next_id(),
+            "customer_id": customer_id,
+            "thread_id": thread_id,
+            "started_at": now,
+            "last_active_at": now,
+            "ended_at": None,
+            "status": "active",
+            "state_base64": None
+        }
+        self.sessions[session["id"]] = session
+        return session
+
+    def insert_event(self, customer_id: int, session_id: int, event_type: str) -> dict:
+        if event_type not in VALID_EVENT_TYPES:
+            raise ValueError(f"Invalid event_type: {event_type}. Must be one of {VALID_EVENT_TYPES}")
+        event = {
+            "id": self.next_id(),
+            "customer_id": customer_id,
+            "session_id": session_id,
+            "event_type": event_type,
+            "timestamp": _get_time_vn()
+        }
+        self.events[event["id"]] = event
+        return event
+
+
+class MemoryCustomerRepo:
+    def __init__(self, db: MemoryDatabase):
+        self.db = db
+
+    async def find_customer(self, chat_id: str, revalidate: bool = True) -> dict | None:
+        await self.db.round_trip()
+        customer = self.db.customer_by_chat_id(chat_id)
+        return self.db.hydrate(customer) if customer else None
+
+    async def create_customer(self, chat_id: str) -> dict | None:
+        await self.db.round_trip()
+        customer = {
+            "id": self.db.next_id(),
+            "chat_id": chat_id,
+            "name": None,
+            "phone_number": None,
+            "address": None,
+            "email": None,
+            "control_mode": "BOT"
+        }
+        self.db.customers[customer["id"]] = customer
+        return copy.deepcopy(customer)
+
+    async def delete_customer(self, customer_id: int) -> bool:
+        await self.db.round_trip()
+        return self.db.customers.pop(customer_id, None) is not None
+
+    async def resolve_customer_session(self, chat_id: str, thread_id: str, n_days: int | None) -> dict | None:
+        """
+        Mirror of the `resolve_customer_session` SQL function.
+        """
+        await self.db.round_trip()
+
+        is_new_customer = False
+        customer = self.db.customer_by_chat_id(chat_id)
+        if customer is None:
+            customer = {
+                "id": self.db.next_id(),
+                "chat_id": chat_id,
+                "name": None,
+                "phone_number": None,
+                "address": None,
+                "email": None,
+                "control_mode": "BOT"
+            }
+            self.db.customers[customer["id"]] = customer
+            is_new_customer = True
+
+        session = self.db.active_session(customer["id"])
+        event_type = None
+        closed_thread_id = None
+        if session is None:
+            # Without rotation, a missing session was closed by the session sweeper
+            event_type = "new_customer" if is_new_customer or n_days is not None else "returning_customer"
+        elif n_days is not None and datetime.fromisoformat(session["last_active_at"]) < datetime.fromisoformat(_get_time_vn()) - timedelta(days=n_days):
+            session.update({"status": "inactive", "ended_at": _get_time_vn()})
+            closed_thread_id = session["thread_id"]
+            event_type = "returning_customer"
+        else:
+            session["last_active_at"] = _get_time_vn()
+
+        if event_type:
+            session = self.db.insert_session(customer_id=customer["id"], thread_id=thread_id)
+            self.db.insert_event(customer_id=customer["id"], session_id=session["id"], event_type=event_type)
+
+        result = self.db.hydrate(customer)
+        result["is_new_customer"] = is_new_customer
+        result["closed_thread_id"] = closed_thread_id
+        return result
+
+
+class MemorySessionRepo:
+    def __init__(self, db: MemoryDatabase):
+        self.db = db
+
+    async def create_session(self, customer_id: int, thread_id: str) -> dict | None:
+        await self.db.round_trip()
+        return copy.deepcopy(self.db.insert_session(customer_id=customer_id, thread_id=thread_id))
+
+    async def update_end_session(self, session_id: int) -> dict | None:
+        await self.db.round_trip()
+        session = self.db.sessions.get(session_id)
+        if not session:
+            return None
+        session.update({"status": "inactive", "ended_at": _get_time_vn()})
+        return copy.deepcopy(session)
+
+    async def update_last_active_session(self, session_id: int) -> dict | None:
+        await self.db.round_trip()
+        session = self.db.sessions.get(session_id)
+        if not session:
+            return None
+        session["last_active_at"] = _get_time_vn()
+        return copy.deepcopy(session)
+
+    async def update_state_session(self, state: dict, session_id: int) -> dict | None:
+        await self.db.round_trip()
+        session = self.db.sessions.get(session_id)
+        if not session:
+            return None
+        # Kept decoded, `hydrate` hands it back like find_customer does
+        session["state_base64"] = copy.deepcopy(state)
+        # Like the trigger of database/migrations/003_session_state_deltas.sql
+        self.db.state_deltas.pop(session_id, None)
+        return copy.deepcopy(session)
+
+    async def create_state_delta_bulk(self, rows: list[dict]) -> None:
+        await self.db.round_trip()
+        for row in rows:
+            self.db.state_deltas.setdefault(row["session_id"], []).append(dict(row, id=self.db.next_id()))
+
+    async def save_state(self, session: dict, state: dict) -> bool:
+        delta = build_state_delta(
+            base=session["state_base64"],
+            state=state,
+            delta_count=session.get("state_delta_count", 0)
+        )
+        if delta is None:
+            return await self.update_state_session(state=state, session_id=session["id"]) is not None
+        await self.create_state_delta_bulk(rows=[build_state_delta_row(session_id=session["id"], delta=delta)])
+        return True
+
+
+class MemoryEventRepo:
+    def __init__(self, db: MemoryDatabase):
+        self.db = db
+
+    async def create_event(self, customer_id: int, session_id: int, event_type: str) -> dict | None:
+        await self.db.round_trip()
+        return copy.deepcopy(self.db.insert_event(customer_id=customer_id, session_id=session_id, event_type=event_type))
+
+    async def create_event_bulk(self, events: list[dict]) -> list[dict] | None:
+        await self.db.round_trip()
+        return [
+            copy.deepcopy(self.db.insert_event(
+                customer_id=event["customer_id"],
+                session_id=event["session_id"],
+                event_type=event["event_type"]
+            ))
+            for event in events
+        ]
+
+
+class MemoryMessageSpanRepo:
+    def __init__(self, db: MemoryDatabase):
+        self.db = db
+
+    async def create_message_span_bulk(self, message_spans: list[dict], ignore_duplicates: bool = False) -> list[dict] | None:
+        await self.db.round_trip()
+        for span in message_spans:
+            self.db.message_spans[span["id"]] = copy.deepcopy(span)
+        return copy.deepcopy(message_spans)
+
+    async def get_latest_event_and_bot_span(self, customer_id: int) -> dict | None:
+        # Two queries, like AsyncMessageSpanRepo
+        await self.db.round_trip()
+        events = [e for e in self.db.events.values() if e["customer_id"] == customer_id]
+        if not events:
+            return None
+        session_id = max(events, key=lambda e: e["timestamp"])["session_id"]
+
+        await self.db.round_trip()
+        spans = [
+            s for s in self.db.message_spans.values()
+            if s["session_id"] == session_id and s.get("direction") == "outbound"
+        ]
+        span = max(spans, key=lambda s: s.get("timestamp_end") or "") if spans else None
+        return {
+            "event_session_id": session_id,
+            "span_id": span["id"] if span else None,
+            "span_end_ts": span.get("timestamp_end") if span else None
+        }
@@ -1,10 +1,14 @@
+import time
 import inspect
 import functools
 from tenacity import AsyncRetrying, stop_after_attempt, wait_exponential, retry_if_exception_type, RetryError
 
+from services.metrics import DB_CALL_SECONDS
+
 def retry_all_async_methods(stop=None, wait=None, retry=None, reraise=True):
     """
     Class decorator: wrap all async methods of a class with retry logic.
+    The latency of every call, retries included, is recorded per repo class and method.
     
     :param stop: tenacity stop strategy
     :param wait: tenacity wait strategy
@@ -23,7 +27,9 @@ def retry_all_async_methods(stop=None, wait=None, retry=None, reraise=True):
             
             # wrap func in retry
             @functools.wraps(func)
-            async def wrapped(self, *args, __func=func, **kwargs):
+            async def wrapped(self, *args, __func=func, __name=name, **kwargs):
+                started_at = time.perf_counter()
+                status = "error"
                 try:
                     async for attempt in AsyncRetrying(
                         stop=stop,
@@ -32,10 +38,19 @@ def retry_all_async_methods(stop=None, wait=None, retry=None, reraise=True):
                         reraise=reraise
                     ):
                         with attempt:
-                            return await __func(self, *args, **kwargs)
+                            result = await __func(self, *args, **kwargs)
+                    status = "ok"
+                    return result
                 except RetryError as e:
                     # if it has retried multiple times and still fails, raise the original error
                     raise e.last_attempt.exception()
+                finally:
+                    DB_CALL_SECONDS.observe(
+                        time.perf_counter() - started_at,
+                        repo=cls.__name__,
+                        operation=__name,
+                        status=status
+                    )
             
             setattr(cls, name, wrapped)
         return cls
@@ -0,0 +1,103 @@
+import os
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SPAN_INDEX_MAX_ENTRIES = int(os.getenv("SPAN_INDEX_MAX_ENTRIES", 50_000))
+# Entries are re-read from the DB after this long, in case another worker process
+# answered the customer meanwhile
+SPAN_INDEX_TTL_SECONDS = float(os.getenv("SPAN_INDEX_TTL_SECONDS", 15 * 60))
+
+
+class LastOutboundSpanIndex:
+    """
+    In-process `customer_id -> last outbound (bot reply) span` index.
+
+    It answers what `AsyncMessageSpanRepo.get_latest_event_and_bot_span` is used for,
+    linking a new message to the reply it responds to. Entries are warmed from the
+    DB on a miss and updated whenever spans are created, so in the steady state
+    span linking costs no query.
+    """
+
+    def __init__(self, max_entries: int = SPAN_INDEX_MAX_ENTRIES, ttl: float = SPAN_INDEX_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # customer_id -> (session_id, span_id, span_end_ts, expires_at)
+        self._entries: OrderedDict[int, tuple[int | None, str | None, str | None, float]] = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def _set(self, customer_id: int, session_id: int | None, span_id: str | None, span_end_ts: str | None) -> None:
+        self._entries[customer_id] = (session_id, span_id, span_end_ts, time.monotonic() + self.ttl)
+        self._entries.move_to_end(customer_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, customer_id: int, session_id: int, message_repo) -> dict:
+        """
+        Last bot reply of the customer's current session.
+
+        Args:
+            customer_id (int): Customer id.
+            session_id (int): Current session, a reply of an older session is not linked.
+            message_repo (AsyncMessageSpanRepo): Used to warm the entry on a miss.
+
+        Returns:
+            dict: `{"span_id", "span_end_ts"}`, both None when there is no reply to link to.
+        """
+        entry = self._entries.get(customer_id)
+        if entry is not None and entry[3] > time.monotonic():
+            self._hits += 1
+            self._entries.move_to_end(customer_id)
+        else:
+            self._misses += 1
+            latest = await message_repo.get_latest_event_and_bot_span(customer_id=customer_id)
+            if latest:
+                self._set(customer_id, latest["event_session_id"], latest["span_id"], latest["span_end_ts"])
+            else:
+                self._set(customer_id, None, None, None)
+            entry = self._entries[customer_id]
+
+        # Like the DB lookup, only replies of the session of the latest event count
+        indexed_session_id, span_id, span_end_ts, _ = entry
+        if indexed_session_id is not None and indexed_session_id != session_id:
+            return {"span_id": None, "span_end_ts": None}
+        return {"span_id": span_id, "span_end_ts": span_end_ts}
+
+    def record(self, customer_id: int, session_id: int, message_spans: list[dict]) -> None:
+        """
+        Update the index with spans being created for the customer.
+        """
+        outbound = [span for span in message_spans if span.get("direction") == "outbound"]
+        if outbound:
+            latest = max(outbound, key=lambda span: span.get("timestamp_end") or "")
+            self._set(customer_id, session_id, latest["id"], latest.get("timestamp_end"))
+        elif customer_id in self._entries:
+            # No reply in this turn: a later message still responds to the previous
+            # reply, if it belongs to this session
+            indexed_session_id, span_id, span_end_ts, _ = self._entries[customer_id]
+            if indexed_session_id != session_id:
+                span_id, span_end_ts = None, None
+            self._set(customer_id, session_id, span_id, span_end_ts)
+
+    def invalidate(self, customer_id: int) -> None:
+        self._entries.pop(customer_id, None)
+
+    def evict_expired(self) -> int:
+        now = time.monotonic()
+        expired = [customer_id for customer_id, entry in self._entries.items() if entry[3] <= now]
+        for customer_id in expired:
+            del self._entries[customer_id]
+        return len(expired)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self._hits,
+            "misses": self._misses
+        }
+
+
+span_index = LastOutboundSpanIndex()
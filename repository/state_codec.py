@@ -0,0 +1,193 @@
+import io
+import os
+import base64
+import pickle
+from zoneinfo import ZoneInfo
+from datetime import date, datetime, time
+from dotenv import load_dotenv
+
+import ormsgpack
+import zstandard
+from langchain_core.messages import (
+    AIMessage,
+    BaseMessage,
+    HumanMessage,
+    SystemMessage,
+    ToolMessage,
+    messages_from_dict
+)
+
+from services.metrics import STATE_CODEC_OPERATIONS
+
+load_dotenv()
+
+# zstd level of the session state, 3 is the zstd default; higher levels only pay off on long sessions
+STATE_ZSTD_LEVEL = int(os.getenv("STATE_ZSTD_LEVEL", 3))
+# Read pickled states written before the versioned codec, "false" once no legacy row is left
+STATE_LEGACY_PICKLE = os.getenv("STATE_LEGACY_PICKLE", "true").lower() == "true"
+
+# First byte of the decoded `state_base64`: a pickle always starts with the PROTO opcode
+STATE_CODEC_V1 = 0x01
+_PICKLE_PROTO = 0x80
+
+_PACK_OPTIONS = (
+    ormsgpack.OPT_NON_STR_KEYS
+    | ormsgpack.OPT_PASSTHROUGH_DATETIME
+    | ormsgpack.OPT_PASSTHROUGH_DATACLASS
+)
+
+_EXT_MESSAGE = 1
+_EXT_DATETIME = 2
+_EXT_DATE = 3
+_EXT_TIME = 4
+
+# type -> (class, {field: (default_factory, default)})
+_MESSAGE_CLASSES = {
+    message_class.model_fields["type"].default: (
+        message_class,
+        {name: (field.default_factory, field.default) for name, field in message_class.model_fields.items()}
+    )
+    for message_class in (HumanMessage, AIMessage, SystemMessage, ToolMessage)
+}
+
+# Classes a legacy state may reference, everything else is refused by the unpickler
+_LEGACY_ALLOWED = {
+    ("datetime", "datetime"),
+    ("datetime", "date"),
+    ("datetime", "time"),
+    ("datetime", "timedelta"),
+    ("datetime", "timezone"),
+    ("zoneinfo", "ZoneInfo"),
+    ("collections", "OrderedDict"),
+    ("decimal", "Decimal")
+}
+
+
+def _default(obj):
+    # Messages are stored as (type, non-default fields), the bulk of the state
+    if isinstance(obj, BaseMessage):
+        return ormsgpack.Ext(_EXT_MESSAGE, _pack([obj.type, _message_fields(obj)]))
+    if isinstance(obj, datetime):
+        return ormsgpack.Ext(_EXT_DATETIME, obj.isoformat().encode())
+    if isinstance(obj, date):
+        return ormsgpack.Ext(_EXT_DATE, obj.isoformat().encode())
+    if isinstance(obj, time):
+        return ormsgpack.Ext(_EXT_TIME, obj.isoformat().encode())
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    raise TypeError(f"Cannot encode {type(obj).__name__} in the session state")
+
+
+def _ext_hook(code: int, data: bytes):
+    if code == _EXT_MESSAGE:
+        message_type, fields = _unpack(data)
+        if message_type not in _MESSAGE_CLASSES:
+            return messages_from_dict([{"type": message_type, "data": fields}])[0]
+        return _restore_message(message_type, fields)
+    if code == _EXT_DATETIME:
+        return datetime.fromisoformat(data.decode())
+    if code == _EXT_DATE:
+        return date.fromisoformat(data.decode())
+    if code == _EXT_TIME:
+        return time.fromisoformat(data.decode())
+    raise ValueError(f"Unknown state extension type: {code}")
+
+
+def _message_fields(message: BaseMessage) -> dict:
+    known = _MESSAGE_CLASSES.get(message.type)
+    if known is None or type(message) is not known[0]:
+        fields = message.model_dump(exclude_defaults=True)
+        fields.pop("type", None)
+        return fields
+
+    defaults = known[1]
+    fields = {
+        name: value for name, value in message.__dict__.items()
+        if name != "type" and value != (defaults[name][0]() if defaults[name][0] else defaults[name][1])
+    }
+    if message.__pydantic_extra__:
+        fields.update(message.__pydantic_extra__)
+    return fields
+
+
+def _restore_message(message_type: str, fields: dict) -> BaseMessage:
+    # The fields were validated when the message was created: restore them the way
+    # pickle does instead of validating them again, by far the slowest part otherwise
+    message_class, defaults = _MESSAGE_CLASSES[message_type]
+    fields_set = set(fields)
+    values = {
+        name: fields.pop(name) if name in fields else (factory() if factory else default)
+        for name, (factory, default) in defaults.items()
+    }
+    message = message_class.__new__(message_class)
+    message.__setstate__({
+        "__dict__": values,
+        # What is left are the extra fields, messages allow them
+        "__pydantic_extra__": fields,
+        "__pydantic_fields_set__": fields_set,
+        "__pydantic_private__": None
+    })
+    return message
+
+
+def _pack(obj) -> bytes:
+    return ormsgpack.packb(obj, default=_default, option=_PACK_OPTIONS)
+
+
+def _unpack(data: bytes):
+    return ormsgpack.unpackb(data, ext_hook=_ext_hook, option=ormsgpack.OPT_NON_STR_KEYS)
+
+
+def _legacy_getattr(obj, name: str):
+    if obj is ZoneInfo and name == "_unpickle":
+        return ZoneInfo._unpickle
+    raise pickle.UnpicklingError(f"Refused to load getattr({obj!r}, {name!r}) from a legacy session state")
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    """
+    Unpickler of the states written before the versioned codec, limited to the
+    message classes and the standard types a state holds.
+    """
+
+    def find_class(self, module: str, name: str):
+        if module.startswith("langchain_core.messages") or (module, name) in _LEGACY_ALLOWED:
+            return super().find_class(module, name)
+        if (module, name) == ("builtins", "getattr"):
+            # Aware datetimes pickle their ZoneInfo as getattr(ZoneInfo, "_unpickle")
+            return _legacy_getattr
+        raise pickle.UnpicklingError(f"Refused to load {module}.{name} from a legacy session state")
+
+
+def encode_state(state: dict) -> str:
+    """
+    Encode a session state for the `sessions.state_base64` column.
+
+    Format v1: base64 of the version byte followed by a zstd frame of the state as
+    msgpack, messages reduced to their type and non-default fields.
+    """
+    blob = bytes([STATE_CODEC_V1]) + zstandard.compress(_pack(state), STATE_ZSTD_LEVEL)
+    STATE_CODEC_OPERATIONS.inc(operation="encode", format="v1")
+    return base64.b64encode(blob).decode("ascii")
+
+
+def decode_state(data: str | None) -> dict:
+    """
+    Decode a `sessions.state_base64` value, either format v1 or a legacy pickle.
+    Legacy rows are rewritten in format v1 the next time their session state is saved.
+    """
+    if not data:
+        return {}
+
+    blob = base64.b64decode(data)
+    if blob[0] == STATE_CODEC_V1:
+        STATE_CODEC_OPERATIONS.inc(operation="decode", format="v1")
+        return _unpack(zstandard.decompress(blob[1:]))
+
+    if blob[0] == _PICKLE_PROTO:
+        if not STATE_LEGACY_PICKLE:
+            raise ValueError("Legacy pickled session state found but STATE_LEGACY_PICKLE is disabled")
+        STATE_CODEC_OPERATIONS.inc(operation="decode", format="legacy_pickle")
+        return _LegacyUnpickler(io.BytesIO(blob)).load()
+
+    raise ValueError(f"Unknown session state format: {blob[0]:#04x}")
@@ -0,0 +1,116 @@
+import os
+import copy
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Persist each turn as a delta of the session state instead of rewriting the whole state,
+# requires database/migrations/003_session_state_deltas.sql
+STATE_DELTAS_ENABLED = os.getenv("STATE_DELTAS_ENABLED", "false").lower() == "true"
+# Deltas kept on top of a snapshot, the next write rewrites the snapshot and drops them
+STATE_COMPACT_EVERY = int(os.getenv("STATE_COMPACT_EVERY", 10))
+
+
+def detach_state(state: dict) -> dict:
+    """
+    Copy of a loaded state for the graph to work on, leaving the loaded one intact
+    as the base of the turn's delta. Tools update seen products, cart and order in
+    place, those are deep-copied; messages are only ever replaced, they are shared.
+    """
+    return {key: value if key == "messages" else copy.deepcopy(value) for key, value in state.items()}
+
+
+def _same_message(a, b) -> bool:
+    if a is b:
+        return True
+    if getattr(a, "id", None) and getattr(b, "id", None):
+        return a.id == b.id and a.content == b.content
+    return a == b
+
+
+def build_state_delta(base: dict, state: dict, delta_count: int) -> dict | None:
+    """
+    Difference between the persisted state of a session and its state after a turn.
+
+    - `messages`: the messages appended after the first `messages_base` ones;
+    - `merge` / `drop`: entries added or changed / removed in dict values
+      (seen products, cart, order), compared entry by entry;
+    - `set` / `unset`: other keys that changed / disappeared.
+
+    Returns:
+        dict | None: The delta, numbered `seq = delta_count + 1`, or None when a full
+            snapshot must be written instead: no snapshot yet, `STATE_COMPACT_EVERY`
+            deltas reached, or earlier messages were rewritten (removed, summarized).
+    """
+    if not STATE_DELTAS_ENABLED or not base or delta_count >= STATE_COMPACT_EVERY:
+        return None
+
+    base_messages = base.get("messages") or []
+    messages = state.get("messages") or []
+    if len(messages) < len(base_messages) or not all(
+        _same_message(old, new) for old, new in zip(base_messages, messages)
+    ):
+        return None
+
+    delta = {
+        "seq": delta_count + 1,
+        "messages_base": len(base_messages),
+        "messages": messages[len(base_messages):],
+        "set": {},
+        "unset": [key for key in base if key not in state],
+        "merge": {},
+        "drop": {}
+    }
+    for key, value in state.items():
+        if key == "messages":
+            continue
+        old = base.get(key)
+        if isinstance(old, dict) and isinstance(value, dict):
+            changed = {k: v for k, v in value.items() if k not in old or old[k] != v}
+            removed = [k for k in old if k not in value]
+            if changed:
+                delta["merge"][key] = changed
+            if removed:
+                delta["drop"][key] = removed
+        elif key not in base or old != value:
+            delta["set"][key] = value
+    return delta
+
+
+def apply_state_deltas(state: dict, deltas: list[dict]) -> tuple[dict, int]:
+    """
+    Rebuild a session state from its snapshot and its deltas, in insertion order.
+
+    A delta written twice (a retried write) keeps its last copy. A missing delta (a
+    lost write) cannot be recovered: the state is rebuilt as well as possible and the
+    returned count is raised to `STATE_COMPACT_EVERY`, so that the next turn rewrites
+    a consistent snapshot.
+
+    Returns:
+        tuple[dict, int]: The state and the number of deltas on top of the snapshot.
+    """
+    latest: dict[int, dict] = {}
+    for delta in deltas:
+        latest[delta["seq"]] = delta
+    if not latest:
+        return state, 0
+
+    state = dict(state)
+    consistent = True
+    for seq in sorted(latest):
+        delta = latest[seq]
+        messages = list(state.get("messages") or [])
+        consistent &= len(messages) == delta["messages_base"]
+        state["messages"] = messages[:delta["messages_base"]] + list(delta["messages"])
+
+        for key in delta["unset"]:
+            state.pop(key, None)
+        state.update(delta["set"])
+        for key, changed in delta["merge"].items():
+            state[key] = {**(state.get(key) or {}), **changed}
+        for key, removed in delta["drop"].items():
+            if state.get(key):
+                state[key] = {k: v for k, v in state[key].items() if k not in removed}
+
+    consistent &= sorted(latest) == list(range(1, len(latest) + 1))
+    return state, len(latest) if consistent else max(len(latest), STATE_COMPACT_EVERY)
@@ -1,6 +1,4 @@
 import httpx
-import pickle
-import base64
 from typing import Optional
 from zoneinfo import ZoneInfo
 from supabase import AsyncClient, Client
@@ -8,6 +6,7 @@ from datetime import datetime, timezone
 from tenacity import stop_after_attempt, wait_exponential, retry_if_exception_type
 
 from repository.retry_handling import retry_all_async_methods
+from repository.state_codec import decode_state, encode_state
 
 VALID_EVENT_TYPES = {
     "new_customer", 
@@ -40,21 +39,6 @@ def _to_vn(dt_str_or_dt) -> str:
     
     return dt_vn
 
-def _encode_state(state: dict) -> str:
-    dumps = pickle.dumps(state)
-    encoded = base64.b64encode(dumps).decode("utf-8")
-    
-    return encoded
-
-def _decode_state(data: str) -> dict:
-    if not data:
-        return {}
-    
-    dumps = base64.b64decode(data.encode("utf-8"))
-    state = pickle.loads(dumps)
-    
-    return state
-
 # --------------------------------------
 # Main class
 # --------------------------------------
@@ -150,7 +134,7 @@ class CustomerRepo:
             session = response.data[0]["sessions"][0]
             session["started_at"] = _to_vn(session["started_at"]) 
             session["last_active_at"] = _to_vn(session["last_active_at"]) 
-            session["state_base64"] = _decode_state(session["state_base64"])
+            session["state_base64"] = decode_state(session["state_base64"])
         
         return response.data[0]
     
@@ -224,7 +208,7 @@ class SessionRepo:
             self.supabase_client.table("sessions")
             .update(
                 {
-                    "state_base64": _encode_state(state=state)
+                    "state_base64": encode_state(state=state)
                 }
             )
             .eq("id", session_id)
@@ -245,7 +229,7 @@ class SessionRepo:
         if not data:
             return None
 
-        return _decode_state(data=data)
+        return decode_state(data=data)
 
 @retry_all_async_methods(
     stop=stop_after_attempt(2),
@@ -5,6 +5,10 @@ class NormalChatRequest(BaseModel):
     user_input: str
     image_url: str | None = None
     
+class BatchChatRequest(BaseModel):
+    items: list[NormalChatRequest]
+    concurrency: int | None = None
+    
 class WebhookChatRequest(BaseModel):
     chat_id: str
     user_input: str
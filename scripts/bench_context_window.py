@@ -0,0 +1,66 @@
+"""
+Benchmark the token-budgeted context window: estimated history tokens sent with
+an agent's LLM call as the conversation grows, whole history vs rolling summary
+plus recent turns, on the synthetic conversations of `scripts.bench_state_codec`
+(product dumps of `get_products_tool` included).
+
+The summarizer is replaced by a stub returning a summary of the usual length,
+so no LLM is called; the summary refreshes are counted instead.
+
+Usage (from the project root, with the usual .env):
+    python -m scripts.bench_context_window --turns 50 --budget 4000
+"""
+import random
+import asyncio
+import argparse
+
+from langchain_core.runnables import RunnableLambda
+
+from core.graph.context_window import ContextWindow, count_tokens
+from scripts.bench_state_codec import add_turn, new_state
+
+REPORT_TURNS = (1, 5, 10, 20, 30, 40, 50)
+# About the 200 words the summary prompt allows
+STUB_SUMMARY = "Khách hỏi áo thun nam cổ tròn size M màu đen, đã thêm 2 cái vào giỏ. " * 12
+
+
+async def _summarize(inputs: dict) -> str:
+    return STUB_SUMMARY
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--budget", type=int, default=4000, help="History tokens of the agent")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    window = ContextWindow(
+        "product_agent",
+        max_tokens=args.budget,
+        summarizer=RunnableLambda(_summarize),
+        summary_tokens=args.budget
+    )
+    state = new_state()
+    refreshes = 0
+
+    print(f"Budget: {args.budget} tokens | Tokens are estimates of the history part of the prompt")
+    print(f"{'turn':>4}{'messages':>10}{'whole history':>15}{'window':>9}{'summarized':>12}{'refreshes':>11}")
+    for turn in range(1, args.turns + 1):
+        # History the agent gets on the next customer message
+        add_turn(state, turn)
+        update = await window.refresh(state)
+        refreshes += bool(update)
+        state.update(update)
+        history, sent = count_tokens(state["messages"]), count_tokens(window.messages(state))
+
+        if turn in REPORT_TURNS or turn == args.turns:
+            print(
+                f"{turn:>4}{len(state['messages']):>10}{history:>15}{sent:>9}"
+                f"{state['summarized_messages'] or 0:>12}{refreshes:>11}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+"""
+Benchmark customer + session resolution: step-by-step PostgREST calls vs the
+`resolve_customer_session` RPC, against the in-memory stand-in with a simulated
+round-trip latency.
+
+Usage (from the project root, with the usual .env):
+    python -m scripts.bench_resolve_session --latency-ms 40 --chats 50
+"""
+import time
+import asyncio
+import argparse
+import statistics
+from zoneinfo import ZoneInfo
+from datetime import datetime, timedelta
+
+from services.v5.process_chat import N_DAYS, ChatbotService
+from repository.memory_repo import MemoryCustomerRepo, MemoryDatabase, MemoryEventRepo, MemorySessionRepo
+
+SCENARIOS = ("new_customer", "returning_active", "returning_expired")
+
+
+def _build_service(db: MemoryDatabase, use_rpc: bool) -> ChatbotService:
+    service = ChatbotService(
+        product_repo=None,
+        customer_repo=MemoryCustomerRepo(db),
+        session_repo=MemorySessionRepo(db),
+        event_repo=MemoryEventRepo(db),
+        message_repo=None
+    )
+    service.resolve_session_rpc = use_rpc
+    return service
+
+
+def _expire_sessions(db: MemoryDatabase) -> None:
+    past = datetime.now(ZoneInfo("Asia/Ho_Chi_Minh")) - timedelta(days=N_DAYS + 1)
+    past = past.strftime("%Y-%m-%d %H:%M:%S+07")
+    for session in db.sessions.values():
+        if session["status"] == "active":
+            session["last_active_at"] = past
+
+
+async def _run(use_rpc: bool, latency_ms: float, chats: int) -> dict[str, dict]:
+    db = MemoryDatabase(latency_ms=0)
+    service = _build_service(db, use_rpc)
+    chat_ids = [f"bench-{index}" for index in range(chats)]
+    results = {}
+
+    for scenario in SCENARIOS:
+        if scenario == "returning_expired":
+            _expire_sessions(db)
+
+        db.latency_ms = latency_ms
+        db.round_trips = 0
+        durations = []
+        for chat_id in chat_ids:
+            started_at = time.perf_counter()
+            customer, thread_id, _ = await service._handle_customer(chat_id=chat_id)
+            durations.append((time.perf_counter() - started_at) * 1000)
+            assert customer and thread_id, f"{scenario}: cannot resolve {chat_id}"
+
+        durations.sort()
+        results[scenario] = {
+            "round_trips": db.round_trips / chats,
+            "p50_ms": statistics.median(durations),
+            "p95_ms": durations[int(len(durations) * 0.95) - 1]
+        }
+    return results
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=40.0, help="Simulated PostgREST round trip")
+    parser.add_argument("--chats", type=int, default=50, help="Chats resolved per scenario")
+    args = parser.parse_args()
+
+    before = await _run(use_rpc=False, latency_ms=args.latency_ms, chats=args.chats)
+    after = await _run(use_rpc=True, latency_ms=args.latency_ms, chats=args.chats)
+
+    print(f"Round trip latency: {args.latency_ms} ms | Chats per scenario: {args.chats}")
+    print(f"{'scenario':<20}{'calls before':>14}{'calls after':>13}{'p50 before':>13}{'p50 after':>12}{'p95 before':>13}{'p95 after':>12}")
+    for scenario in SCENARIOS:
+        b, a = before[scenario], after[scenario]
+        print(
+            f"{scenario:<20}{b['round_trips']:>14.1f}{a['round_trips']:>13.1f}"
+            f"{b['p50_ms']:>11.1f}ms{a['p50_ms']:>10.1f}ms{b['p95_ms']:>11.1f}ms{a['p95_ms']:>10.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
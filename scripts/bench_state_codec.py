@@ -0,0 +1,199 @@
+"""
+Benchmark the session state codec: the legacy pickle + base64 encoding vs the
+versioned zstd/msgpack format (v1), on synthetic conversations shaped like the
+production ones (supervisor routing, agent tool calls with product payloads,
+seen products, cart and order).
+
+Reports the stored `state_base64` size and the encode/decode time per state.
+
+Usage (from the project root, with the usual .env):
+    python -m scripts.bench_state_codec --turns 20 35 50 --rounds 200
+"""
+import json
+import time
+import uuid
+import base64
+import pickle
+import random
+import argparse
+import statistics
+from datetime import timedelta
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from core.graph.state import init_state
+from repository.state_codec import decode_state, encode_state
+from services.utils import now_vietnam_time
+
+QUESTIONS = (
+    "Cho em xem mấy mẫu áo thun nam cổ tròn",
+    "Mẫu này còn size L màu đen không shop",
+    "Giá sau giảm của mẫu thứ hai là bao nhiêu ạ",
+    "Thêm 2 cái size M vào giỏ giúp em",
+    "Em muốn đổi địa chỉ giao hàng sang quận 7",
+    "Đơn hàng của em bao giờ giao tới vậy",
+    "Có mã giảm giá nào cho đơn trên 500k không"
+)
+AGENTS = ("product_agent", "order_agent", "modify_order_agent")
+
+
+def _product(product_id: int) -> dict:
+    return {
+        "product_id": product_id,
+        "name": f"Áo thun cotton {product_id}",
+        "brand": random.choice(("Coolmate", "Routine", "Yody")),
+        "brief_des": {"chất liệu": "100% cotton", "form": "regular", "xuất xứ": "Việt Nam"},
+        "des": "Áo thun cotton co giãn 4 chiều, thấm hút mồ hôi tốt, phù hợp mặc hằng ngày. " * 3,
+        "url": f"https://shop.example.vn/products/{product_id}",
+        "variances": {
+            variance_id: {
+                "variance_id": variance_id,
+                "sku": f"AT{product_id}-{variance_id}",
+                "description": f"Size {size} - màu {color}",
+                "price": 249000,
+                "discount": 20,
+                "price_after_discount": 199200
+            }
+            for variance_id, (size, color) in enumerate(
+                [(size, color) for size in "SML" for color in ("đen", "trắng")],
+                start=product_id * 10
+            )
+        }
+    }
+
+
+def new_state() -> dict:
+    state = init_state()
+    state.update({
+        "chat_id": str(random.randint(10**8, 10**9)),
+        "customer_id": random.randint(1, 10**5),
+        "session_id": random.randint(1, 10**6),
+        "name": "Nguyễn Văn A",
+        "phone_number": "0901234567",
+        "address": "12 Nguyễn Hữu Thọ, Quận 7, TP.HCM",
+        "seen_products": {},
+        "cart": {}
+    })
+    return state
+
+
+def add_turn(state: dict, turn: int) -> None:
+    """
+    One customer message and everything the graph adds to the state for it.
+    """
+    question = random.choice(QUESTIONS)
+    agent = random.choice(AGENTS)
+    call_id = f"call_{uuid.uuid4().hex[:24]}"
+    products = [_product(random.randint(1, 500)) for _ in range(random.randint(1, 3))]
+    usage = {"input_tokens": 2400 + turn * 180, "output_tokens": 120, "total_tokens": 2520 + turn * 180}
+
+    state["messages"] = state["messages"] + [
+        HumanMessage(content=question, id=str(uuid.uuid4())),
+        AIMessage(content="", name="supervisor", id=str(uuid.uuid4()), response_metadata={"next": agent}),
+        AIMessage(
+            content="",
+            id=str(uuid.uuid4()),
+            tool_calls=[{"name": "get_products_tool", "args": {"query": question}, "id": call_id}],
+            response_metadata={"model_name": "gpt-4.1-mini", "finish_reason": "tool_calls"},
+            usage_metadata=usage
+        ),
+        ToolMessage(
+            content=json.dumps(products, ensure_ascii=False),
+            tool_call_id=call_id,
+            name="get_products_tool",
+            id=str(uuid.uuid4())
+        ),
+        AIMessage(
+            content=f"Dạ, em gửi anh/chị {len(products)} mẫu phù hợp ạ: "
+            + "; ".join(f"{p['name']} giá 199.200đ" for p in products),
+            name=agent,
+            id=str(uuid.uuid4()),
+            response_metadata={"model_name": "gpt-4.1-mini", "finish_reason": "stop"},
+            usage_metadata=usage
+        )
+    ]
+    state["user_input"] = question
+
+    for product in products:
+        state["seen_products"][product["product_id"]] = product
+    if turn % 5 == 3:
+        product = products[0]
+        variance_id = next(iter(product["variances"]))
+        state["cart"][f"{product['product_id']}-{variance_id}"] = {
+            "product_id": product["product_id"],
+            "variance_id": variance_id,
+            "price": 199200,
+            "quantity": 2,
+            "subtotal": 398400
+        }
+    if turn % 10 == 9:
+        order_id = random.randint(1, 10**5)
+        state["order"] = {**(state["order"] or {}), order_id: {
+            "order_id": order_id,
+            "status": "pending",
+            "payment": "COD",
+            "order_total": 398400,
+            "shipping_fee": 30000,
+            "grand_total": 428400,
+            "created_at": now_vietnam_time() - timedelta(hours=2),
+            "receiver_name": state["name"],
+            "receiver_phone_number": state["phone_number"],
+            "receiver_address": state["address"],
+            "items": None
+        }}
+
+
+def build_state(turns: int) -> dict:
+    """
+    State of a session after `turns` customer messages.
+    """
+    state = new_state()
+    for turn in range(turns):
+        add_turn(state, turn)
+    return state
+
+
+def _legacy_encode(state: dict) -> str:
+    return base64.b64encode(pickle.dumps(state)).decode("utf-8")
+
+
+def _legacy_decode(data: str) -> dict:
+    return pickle.loads(base64.b64decode(data.encode("utf-8")))
+
+
+def _time_ms(fn, arg, rounds: int) -> float:
+    samples = []
+    for _ in range(rounds):
+        started_at = time.perf_counter()
+        fn(arg)
+        samples.append((time.perf_counter() - started_at) * 1000)
+    return statistics.median(samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, nargs="+", default=[20, 35, 50], help="Conversation lengths to measure")
+    parser.add_argument("--rounds", type=int, default=200, help="Encode/decode runs per measurement")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    print(f"Rounds: {args.rounds} | Times are medians per state")
+    print(
+        f"{'turns':>5}{'legacy size':>13}{'v1 size':>10}{'ratio':>7}"
+        f"{'legacy enc':>12}{'v1 enc':>9}{'legacy dec':>12}{'v1 dec':>9}"
+    )
+    for turns in args.turns:
+        state = build_state(turns)
+        legacy, v1 = _legacy_encode(state), encode_state(state)
+        assert decode_state(v1) == decode_state(legacy) == state
+
+        print(
+            f"{turns:>5}{len(legacy) / 1024:>11.1f}KB{len(v1) / 1024:>8.1f}KB{len(legacy) / len(v1):>6.1f}x"
+            f"{_time_ms(_legacy_encode, state, args.rounds):>10.2f}ms{_time_ms(encode_state, state, args.rounds):>7.2f}ms"
+            f"{_time_ms(_legacy_decode, legacy, args.rounds):>10.2f}ms{_time_ms(decode_state, v1, args.rounds):>7.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark session state persistence: the full state rewritten after every turn
+vs a snapshot plus per-turn deltas compacted every `--compact-every` turns, on
+the synthetic conversations of `scripts.bench_state_codec`.
+
+Reports the bytes written for each turn, the bytes written over the whole
+conversation and the time to load the state back (snapshot + deltas decoded
+and applied, as `find_customer` does).
+
+Usage (from the project root, with the usual .env):
+    python -m scripts.bench_state_delta --turns 50 --compact-every 10
+"""
+import time
+import random
+import argparse
+import statistics
+
+from repository import state_delta
+from repository.async_repo import build_state_delta_row, build_state_payload
+from repository.state_codec import decode_state
+from repository.state_delta import apply_state_deltas, build_state_delta, detach_state
+from scripts.bench_state_codec import add_turn, new_state
+
+REPORT_TURNS = (1, 2, 5, 10, 11, 20, 30, 40, 50)
+
+
+def _load(snapshot: str, rows: list[dict]) -> tuple[dict, int]:
+    return apply_state_deltas(decode_state(snapshot), [decode_state(row["delta"]) for row in rows])
+
+
+def _load_ms(snapshot: str, rows: list[dict], rounds: int) -> float:
+    samples = []
+    for _ in range(rounds):
+        started_at = time.perf_counter()
+        _load(snapshot, rows)
+        samples.append((time.perf_counter() - started_at) * 1000)
+    return statistics.median(samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--compact-every", type=int, default=state_delta.STATE_COMPACT_EVERY)
+    parser.add_argument("--rounds", type=int, default=50, help="Load runs per measurement")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    state_delta.STATE_DELTAS_ENABLED = True
+    state_delta.STATE_COMPACT_EVERY = args.compact_every
+
+    # What a session row and its delta rows hold between turns
+    snapshot, rows = "", []
+    full_total = delta_total = 0
+
+    print(f"Compact every: {args.compact_every} deltas | Load times are medians of {args.rounds} runs")
+    print(
+        f"{'turn':>4}{'full write':>12}{'delta write':>13}{'full total':>12}{'delta total':>13}"
+        f"{'deltas':>8}{'full load':>11}{'delta load':>12}"
+    )
+    for turn in range(1, args.turns + 1):
+        base, delta_count = _load(snapshot, rows) if snapshot else ({}, 0)
+        state = detach_state(base) if base else new_state()
+        add_turn(state, turn)
+
+        full_payload = build_state_payload(state=state)["state_base64"]
+        delta = build_state_delta(base=base, state=state, delta_count=delta_count)
+        if delta is None:
+            snapshot, rows = full_payload, []
+            written = len(full_payload)
+        else:
+            rows.append(build_state_delta_row(session_id=1, delta=delta))
+            written = len(rows[-1]["delta"])
+
+        assert _load(snapshot, rows)[0] == state
+        full_total += len(full_payload)
+        delta_total += written
+
+        if turn in REPORT_TURNS or turn == args.turns:
+            print(
+                f"{turn:>4}{len(full_payload) / 1024:>10.1f}KB{written / 1024:>11.1f}KB"
+                f"{full_total / 1024:>10.0f}KB{delta_total / 1024:>11.0f}KB{len(rows):>8}"
+                f"{_load_ms(full_payload, [], args.rounds):>9.2f}ms{_load_ms(snapshot, rows, args.rounds):>10.2f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Benchmark the wall-clock time of a webhook turn with its repository operations
+awaited one at a time vs run by the dependency-aware turn executor, against the
+in-memory repositories and a callback receiver with simulated latencies.
+
+The LLM is stubbed out, so the numbers are the turn's own overhead around it.
+
+Usage (from the project root, with the usual .env):
+    python -m scripts.bench_turn_executor --latency-ms 40 --callback-ms 80 --turns 30
+"""
+import time
+import uuid
+import asyncio
+import argparse
+import statistics
+from types import SimpleNamespace
+from zoneinfo import ZoneInfo
+from datetime import datetime, timedelta
+
+import httpx
+
+from repository.span_index import span_index
+from services.callback_client import callback_client
+from services.utils import now_vietnam_time
+from services.v5.process_chat import N_DAYS, ChatbotService
+from repository.memory_repo import (
+    MemoryCustomerRepo,
+    MemoryDatabase,
+    MemoryEventRepo,
+    MemoryMessageSpanRepo,
+    MemorySessionRepo
+)
+
+SCENARIOS = ("returning_active", "returning_expired")
+
+
+class FakeCheckpointer:
+    async def adelete_thread(self, thread_id: str) -> None:
+        pass
+
+
+class FakeGraph:
+    checkpointer = FakeCheckpointer()
+
+    async def aget_state(self, config: dict) -> SimpleNamespace:
+        return SimpleNamespace(values={"messages": [], "chat_id": config["configurable"]["thread_id"]})
+
+
+class BenchChatbotService(ChatbotService):
+    async def handle_normal_chat(self, **kwargs) -> dict:
+        return {"error": None, "content": "Dạ, em gửi anh/chị thông tin sản phẩm ạ."}
+
+
+def _build_service(db: MemoryDatabase, parallel: bool) -> BenchChatbotService:
+    service = BenchChatbotService(
+        product_repo=None,
+        customer_repo=MemoryCustomerRepo(db),
+        session_repo=MemorySessionRepo(db),
+        event_repo=MemoryEventRepo(db),
+        message_repo=MemoryMessageSpanRepo(db)
+    )
+    service.resolve_session_rpc = False
+    service.parallel_steps = parallel
+    return service
+
+
+def _use_callback_receiver(latency_ms: float) -> None:
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latency_ms / 1000)
+        now = now_vietnam_time().isoformat()
+        return httpx.Response(200, json={"message_span": {
+            "timestamp_start": now,
+            "timestamp_end": now,
+            "step_name": "gateway_delivery",
+            "service_name": "gateway",
+            "direction": "outbound",
+            "status": "ok"
+        }})
+
+    callback_client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def _expire_sessions(db: MemoryDatabase) -> None:
+    past = datetime.now(ZoneInfo("Asia/Ho_Chi_Minh")) - timedelta(days=N_DAYS + 1)
+    past = past.strftime("%Y-%m-%d %H:%M:%S+07")
+    for session in db.sessions.values():
+        if session["status"] == "active":
+            session["last_active_at"] = past
+
+
+async def _turn(service: ChatbotService, chat_id: str) -> None:
+    timestamp_start = now_vietnam_time()
+    await service._process_webhook_message(
+        chat_id=chat_id,
+        user_input="Cho em xem áo thun",
+        graph=FakeGraph(),
+        timestamp_start=timestamp_start,
+        message_spans=[{
+            "timestamp_start": timestamp_start.isoformat(),
+            "timestamp_end": timestamp_start.isoformat(),
+            "step_name": "gateway_receive",
+            "service_name": "gateway",
+            "direction": "inbound",
+            "status": "ok"
+        }]
+    )
+
+
+async def _run(parallel: bool, latency_ms: float, turns: int) -> dict[str, dict]:
+    db = MemoryDatabase(latency_ms=0)
+    service = _build_service(db, parallel)
+    chat_ids = [f"bench-{uuid.uuid4()}" for _ in range(turns)]
+
+    # First contact, not measured: creates the customers, sessions and span index entries
+    for chat_id in chat_ids:
+        await _turn(service, chat_id)
+
+    results = {}
+    for scenario in SCENARIOS:
+        if scenario == "returning_expired":
+            _expire_sessions(db)
+
+        db.latency_ms = latency_ms
+        durations = []
+        for chat_id in chat_ids:
+            started_at = time.perf_counter()
+            await _turn(service, chat_id)
+            durations.append((time.perf_counter() - started_at) * 1000)
+        db.latency_ms = 0
+
+        durations.sort()
+        results[scenario] = {
+            "p50_ms": statistics.median(durations),
+            "p95_ms": durations[int(len(durations) * 0.95) - 1]
+        }
+    return results
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=40.0, help="Simulated repository round trip")
+    parser.add_argument("--callback-ms", type=float, default=80.0, help="Simulated callback receiver latency")
+    parser.add_argument("--turns", type=int, default=30, help="Turns measured per scenario")
+    args = parser.parse_args()
+
+    _use_callback_receiver(args.callback_ms)
+    before = await _run(parallel=False, latency_ms=args.latency_ms, turns=args.turns)
+    span_index._entries.clear()
+    after = await _run(parallel=True, latency_ms=args.latency_ms, turns=args.turns)
+
+    print(f"Round trip latency: {args.latency_ms} ms | Callback latency: {args.callback_ms} ms | Turns: {args.turns}")
+    print(f"{'scenario':<20}{'p50 sequential':>16}{'p50 executor':>14}{'p95 sequential':>16}{'p95 executor':>14}")
+    for scenario in SCENARIOS:
+        b, a = before[scenario], after[scenario]
+        print(f"{scenario:<20}{b['p50_ms']:>14.1f}ms{a['p50_ms']:>12.1f}ms{b['p95_ms']:>14.1f}ms{a['p95_ms']:>12.1f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
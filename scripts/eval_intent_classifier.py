@@ -0,0 +1,70 @@
+"""
+Evaluate the supervisor's intent classifier on logged routing decisions:
+accuracy, per-agent precision/recall, and for each confidence threshold the
+share of turns it would route (the rest go to the orchestrator LLM) with the
+accuracy on those turns. Also reports the routing latency per turn, feature
+extraction included.
+
+Usage (from the project root, with the usual .env):
+    python -m scripts.eval_intent_classifier --data data/supervisor_decisions.*.jsonl --thresholds 0.8 0.9 0.95
+"""
+import time
+import argparse
+import statistics
+
+import numpy as np
+
+from core.graph.intent_classifier import INTENT_MODEL_PATH, IntentModel, load_records, record_features
+
+
+def print_report(model: IntentModel, records: list[dict], thresholds: list[float]) -> None:
+    latencies_us = []
+    predicted, confidence = [], []
+    for record in records:
+        started_at = time.perf_counter()
+        proba = model.predict_proba(record_features(record))
+        latencies_us.append((time.perf_counter() - started_at) * 1e6)
+        best = int(proba.argmax())
+        predicted.append(model.labels[best])
+        confidence.append(float(proba[best]))
+
+    expected = [record["next"] for record in records]
+    correct = np.array([p == e for p, e in zip(predicted, expected)])
+    confidence = np.array(confidence)
+    print(f"Decisions: {len(records)} | Accuracy: {correct.mean():.1%}")
+
+    print(f"{'agent':<20}{'support':>9}{'precision':>11}{'recall':>8}")
+    for label in sorted(set(expected) | set(predicted)):
+        support = sum(e == label for e in expected)
+        hits = sum(p == e == label for p, e in zip(predicted, expected))
+        chosen = sum(p == label for p in predicted)
+        print(f"{label:<20}{support:>9}{hits / chosen if chosen else 0:>11.1%}{hits / support if support else 0:>8.1%}")
+
+    print(f"{'threshold':>9}{'routed':>9}{'accuracy':>10}{'to llm':>8}")
+    for threshold in thresholds:
+        routed = confidence >= threshold
+        accuracy = correct[routed].mean() if routed.any() else 0.0
+        print(f"{threshold:>9.2f}{routed.mean():>9.1%}{accuracy:>10.1%}{(~routed).mean():>8.1%}")
+
+    print(
+        f"Routing latency: p50 {statistics.median(latencies_us):.0f} us"
+        f" | p99 {np.percentile(latencies_us, 99):.0f} us"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", nargs="+", required=True, help="JSONL decision logs")
+    parser.add_argument("--model", default=INTENT_MODEL_PATH)
+    parser.add_argument("--sources", nargs="+", default=None, help="Decision sources to evaluate on, all by default")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.7, 0.8, 0.9, 0.95])
+    args = parser.parse_args()
+
+    records = load_records(args.data, sources=set(args.sources) if args.sources else None)
+    if not records:
+        raise SystemExit("No decisions to evaluate on")
+    print_report(IntentModel.load(args.model), records, thresholds=args.thresholds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Train the supervisor's intent classifier on logged routing decisions
+(`SUPERVISOR_DECISION_LOG`), report it on a held-out split and write the model
+file. A running app picks the new file up within `INTENT_MODEL_CHECK_SECONDS`.
+
+Decisions of the classifier itself are left out by default, the model would
+otherwise learn from its own mistakes.
+
+Each worker process logs to its own file (`decisions.jsonl` -> `decisions.<pid>.jsonl`),
+pass them all to `--data`.
+
+Usage (from the project root, with the usual .env):
+    python -m scripts.train_intent_classifier --data data/supervisor_decisions.*.jsonl
+"""
+import random
+import argparse
+
+from core.graph.intent_classifier import (
+    HASH_DIM,
+    INTENT_CONFIDENCE_THRESHOLD,
+    INTENT_MODEL_PATH,
+    load_records,
+    train
+)
+from scripts.eval_intent_classifier import print_report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", nargs="+", required=True, help="JSONL decision logs")
+    parser.add_argument("--out", default=INTENT_MODEL_PATH)
+    parser.add_argument(
+        "--sources",
+        nargs="+",
+        default=None,
+        help="Decision sources to learn from (llm, rule names), all but classifier by default"
+    )
+    parser.add_argument("--holdout", type=float, default=0.2, help="Share of the decisions kept for evaluation")
+    parser.add_argument("--dim", type=int, default=HASH_DIM, help="Hashed feature space size")
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--learning-rate", type=float, default=0.5)
+    parser.add_argument("--threshold", type=float, default=INTENT_CONFIDENCE_THRESHOLD)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    records = load_records(args.data, sources=set(args.sources) if args.sources else None)
+    if args.sources is None:
+        records = [record for record in records if record.get("source") != "classifier"]
+    if not records:
+        raise SystemExit("No decisions to train on")
+
+    random.Random(args.seed).shuffle(records)
+    holdout = int(len(records) * args.holdout)
+    train_records, eval_records = records[holdout:], records[:holdout]
+    print(f"Decisions: {len(records)} | Train: {len(train_records)} | Held out: {len(eval_records)}")
+
+    try:
+        model = train(
+            train_records,
+            dim=args.dim,
+            epochs=args.epochs,
+            learning_rate=args.learning_rate,
+            seed=args.seed
+        )
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if eval_records:
+        print_report(model, eval_records, thresholds=sorted({0.5, 0.7, 0.8, 0.9, 0.95, args.threshold}))
+
+    model.save(args.out)
+    print(f"Model written to {args.out} | Labels: {', '.join(model.labels)}")
+
+
+if __name__ == "__main__":
+    main()
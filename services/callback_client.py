@@ -0,0 +1,149 @@
+import os
+import time
+import httpx
+from dotenv import load_dotenv
+from tenacity import AsyncRetrying, stop_after_attempt, wait_random_exponential, retry_if_exception
+
+from log.logger_config import setup_logging
+from services.metrics import CALLBACK_FAILURES, CALLBACK_SECONDS
+
+load_dotenv()
+logger = setup_logging(__name__)
+
+CALLBACK_URL = os.getenv("CALLBACK_URL")
+CALLBACK_TIMEOUT_SECONDS = float(os.getenv("CALLBACK_TIMEOUT_SECONDS", 30))
+CALLBACK_CONNECT_TIMEOUT_SECONDS = float(os.getenv("CALLBACK_CONNECT_TIMEOUT_SECONDS", 5))
+CALLBACK_MAX_CONNECTIONS = int(os.getenv("CALLBACK_MAX_CONNECTIONS", 100))
+CALLBACK_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("CALLBACK_MAX_KEEPALIVE_CONNECTIONS", 20))
+CALLBACK_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("CALLBACK_KEEPALIVE_EXPIRY_SECONDS", 30))
+CALLBACK_HTTP2 = os.getenv("CALLBACK_HTTP2", "false").lower() == "true"
+# Attempts per reply, retries wait a random exponential backoff capped at CALLBACK_RETRY_MAX_WAIT_SECONDS
+CALLBACK_MAX_ATTEMPTS = int(os.getenv("CALLBACK_MAX_ATTEMPTS", 3))
+CALLBACK_RETRY_MAX_WAIT_SECONDS = float(os.getenv("CALLBACK_RETRY_MAX_WAIT_SECONDS", 2))
+
+# The receiver did not process the request, so sending it again cannot duplicate the reply.
+# Errors raised once the request may have been sent (read timeouts, RemoteProtocolError on a
+# dropped connection) are not retried: the receiver may already have handled the POST.
+# Keep CALLBACK_KEEPALIVE_EXPIRY_SECONDS below the receiver's idle timeout so pooled
+# connections are not dropped under a request.
+RETRYABLE_STATUS_CODES = {429, 502, 503, 504}
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class RetryableStatusError(Exception):
+    def __init__(self, response: httpx.Response):
+        super().__init__(f"Callback answered {response.status_code}")
+        self.response = response
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    return isinstance(exc, (RetryableStatusError, *RETRYABLE_ERRORS))
+
+
+def _failure_reason(exc: BaseException) -> str:
+    if isinstance(exc, RetryableStatusError):
+        return str(exc.response.status_code)
+    return type(exc).__name__
+
+
+class CallbackClient:
+    """
+    App-lifetime HTTP client delivering replies to `CALLBACK_URL`.
+
+    One pooled `httpx.AsyncClient` is shared by every reply, so connections
+    (DNS, TCP, TLS) are reused through keep-alive instead of being set up per
+    message. Only failures where the receiver cannot have handled the request
+    (connection errors, 429/502/503/504) are retried, with jittered backoff.
+    """
+
+    def __init__(
+        self,
+        url: str | None = CALLBACK_URL,
+        max_attempts: int = CALLBACK_MAX_ATTEMPTS,
+        retry_max_wait: float = CALLBACK_RETRY_MAX_WAIT_SECONDS
+    ):
+        self.url = url
+        self.max_attempts = max_attempts
+        self.retry_max_wait = retry_max_wait
+        self._client: httpx.AsyncClient | None = None
+
+    def _build_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(CALLBACK_TIMEOUT_SECONDS, connect=CALLBACK_CONNECT_TIMEOUT_SECONDS),
+            limits=httpx.Limits(
+                max_connections=CALLBACK_MAX_CONNECTIONS,
+                max_keepalive_connections=CALLBACK_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=CALLBACK_KEEPALIVE_EXPIRY_SECONDS
+            ),
+            http2=CALLBACK_HTTP2,
+            headers={"Content-Type": "application/json"}
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Outside the app (scripts) the client is created on first use
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+        return self._client
+
+    async def start(self) -> None:
+        self._client = self._build_client()
+        await logger.info(
+            f"Callback client ready | HTTP/2: {CALLBACK_HTTP2} | Max connections: {CALLBACK_MAX_CONNECTIONS}"
+        )
+
+    async def stop(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _post_once(self, payload: dict) -> httpx.Response:
+        response = await self.client.post(self.url, json=payload)
+        if response.status_code in RETRYABLE_STATUS_CODES:
+            raise RetryableStatusError(response)
+        return response
+
+    async def post(self, payload: dict) -> httpx.Response:
+        """
+        POST a reply to the callback URL.
+
+        Args:
+            payload (dict): JSON body.
+
+        Returns:
+            httpx.Response: Response of the last attempt, including non-retryable error statuses.
+
+        Raises:
+            httpx.RequestError: When every attempt failed before getting a response.
+        """
+        started_at = time.perf_counter()
+        response = None
+        try:
+            async for attempt in AsyncRetrying(
+                stop=stop_after_attempt(self.max_attempts),
+                wait=wait_random_exponential(multiplier=0.1, max=self.retry_max_wait),
+                retry=retry_if_exception(_is_retryable),
+                before_sleep=lambda state: CALLBACK_FAILURES.inc(
+                    reason=_failure_reason(state.outcome.exception()), final="false"
+                ),
+                reraise=True
+            ):
+                with attempt:
+                    response = await self._post_once(payload)
+        except RetryableStatusError as e:
+            response = e.response
+        except Exception as e:
+            CALLBACK_FAILURES.inc(reason=_failure_reason(e), final="true")
+            raise
+        finally:
+            CALLBACK_SECONDS.observe(
+                time.perf_counter() - started_at,
+                status=response.status_code if response is not None else "error"
+            )
+
+        if response.status_code >= 400:
+            CALLBACK_FAILURES.inc(reason=str(response.status_code), final="true")
+        return response
+
+
+callback_client = CallbackClient()
@@ -0,0 +1,447 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import threading
+import traceback
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+import httpx
+from dotenv import load_dotenv
+
+from log.logger_config import setup_logging
+from services.callback_client import RETRYABLE_STATUS_CODES, callback_client
+
+load_dotenv()
+logger = setup_logging(__name__)
+
+# Enqueue replies and deliver them from a background dispatcher instead of awaiting the callback
+CALLBACK_OUTBOX_ENABLED = os.getenv("CALLBACK_OUTBOX_ENABLED", "false").lower() == "true"
+# "sqlite": durable, shared by the worker processes of the node, "memory": tests and local runs
+CALLBACK_OUTBOX_BACKEND = os.getenv("CALLBACK_OUTBOX_BACKEND", "sqlite")
+CALLBACK_OUTBOX_SQLITE_PATH = os.getenv("CALLBACK_OUTBOX_SQLITE_PATH", "data/callback_outbox.sqlite")
+# Replies of different chats delivered at the same time, one at a time per chat
+CALLBACK_OUTBOX_CONCURRENCY = int(os.getenv("CALLBACK_OUTBOX_CONCURRENCY", 16))
+CALLBACK_OUTBOX_POLL_INTERVAL_MS = int(os.getenv("CALLBACK_OUTBOX_POLL_INTERVAL_MS", 500))
+# Failed deliveries of a reply before it is dead-lettered
+CALLBACK_OUTBOX_MAX_ATTEMPTS = int(os.getenv("CALLBACK_OUTBOX_MAX_ATTEMPTS", 10))
+CALLBACK_OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv("CALLBACK_OUTBOX_MAX_BACKOFF_SECONDS", 300))
+# A claimed reply is offered again after this long if its process died before settling it
+CALLBACK_OUTBOX_LEASE_SECONDS = float(os.getenv("CALLBACK_OUTBOX_LEASE_SECONDS", 180))
+
+
+@dataclass
+class OutboxEntry:
+    """
+    One reply waiting for delivery, `context` is kept for the caller once it is settled.
+    """
+    id: int
+    chat_id: str
+    payload: dict
+    context: dict
+    attempts: int = 0
+    created_at: float = 0.0
+
+
+class MemoryOutboxBackend:
+    """
+    In-process outbox, replies are lost with the process.
+    """
+
+    def __init__(self):
+        self._entries: dict[int, OutboxEntry] = {}
+        # id -> (next_attempt_at, lease_until)
+        self._schedule: dict[int, tuple[float, float]] = {}
+        self._dead: list[tuple[OutboxEntry, str]] = []
+        self._next_id = 1
+
+    def add(self, chat_id: str, payload: dict, context: dict, now: float) -> int:
+        entry = OutboxEntry(id=self._next_id, chat_id=chat_id, payload=payload, context=context, created_at=now)
+        self._next_id += 1
+        self._entries[entry.id] = entry
+        self._schedule[entry.id] = (now, 0.0)
+        return entry.id
+
+    def claim_due(self, now: float, limit: int, lease: float) -> list[OutboxEntry]:
+        heads: dict[str, OutboxEntry] = {}
+        for entry in self._entries.values():
+            heads.setdefault(entry.chat_id, entry)
+
+        due = []
+        for entry in heads.values():
+            next_attempt_at, lease_until = self._schedule[entry.id]
+            if next_attempt_at <= now and lease_until <= now:
+                self._schedule[entry.id] = (next_attempt_at, now + lease)
+                due.append(entry)
+                if len(due) >= limit:
+                    break
+        return due
+
+    def ack(self, entry_id: int) -> None:
+        self._entries.pop(entry_id, None)
+        self._schedule.pop(entry_id, None)
+
+    def retry(self, entry_id: int, attempts: int, next_attempt_at: float, error: str) -> None:
+        if entry_id in self._entries:
+            self._entries[entry_id].attempts = attempts
+            self._schedule[entry_id] = (next_attempt_at, 0.0)
+
+    def dead_letter(self, entry_id: int, error: str) -> None:
+        entry = self._entries.pop(entry_id, None)
+        self._schedule.pop(entry_id, None)
+        if entry is not None:
+            self._dead.append((entry, error))
+
+    def pending(self) -> int:
+        return len(self._entries)
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteOutboxBackend:
+    """
+    Outbox table in a local SQLite file, shared by the worker processes of the node.
+
+    Entries are claimed with a lease, so a reply claimed by a process that dies
+    is delivered by another one once the lease expires (at-least-once).
+    """
+
+    def __init__(self, path: str = CALLBACK_OUTBOX_SQLITE_PATH):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS callback_outbox ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id TEXT NOT NULL, payload TEXT NOT NULL, "
+                "context TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL, "
+                "lease_until REAL NOT NULL DEFAULT 0, created_at REAL NOT NULL, last_error TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_callback_outbox_chat ON callback_outbox (chat_id, id)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS callback_outbox_dead ("
+                "id INTEGER PRIMARY KEY, chat_id TEXT NOT NULL, payload TEXT NOT NULL, context TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL, created_at REAL NOT NULL, dead_at REAL NOT NULL, last_error TEXT)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def add(self, chat_id: str, payload: dict, context: dict, now: float) -> int:
+        with self._lock:
+            cursor = self._connection().execute(
+                "INSERT INTO callback_outbox (chat_id, payload, context, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (chat_id, json.dumps(payload, ensure_ascii=False), json.dumps(context, ensure_ascii=False, default=str), now, now)
+            )
+            return cursor.lastrowid
+
+    def claim_due(self, now: float, limit: int, lease: float) -> list[OutboxEntry]:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Only the oldest entry of each chat is deliverable, which keeps replies in order
+                rows = conn.execute(
+                    "SELECT id, chat_id, payload, context, attempts, created_at FROM callback_outbox AS o "
+                    "WHERE next_attempt_at <= ? AND lease_until <= ? "
+                    "AND id = (SELECT MIN(id) FROM callback_outbox WHERE chat_id = o.chat_id) "
+                    "ORDER BY id LIMIT ?",
+                    (now, now, limit)
+                ).fetchall()
+                conn.executemany(
+                    "UPDATE callback_outbox SET lease_until = ? WHERE id = ?",
+                    [(now + lease, row[0]) for row in rows]
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        return [
+            OutboxEntry(
+                id=row[0],
+                chat_id=row[1],
+                payload=json.loads(row[2]),
+                context=json.loads(row[3]),
+                attempts=row[4],
+                created_at=row[5]
+            )
+            for row in rows
+        ]
+
+    def ack(self, entry_id: int) -> None:
+        with self._lock:
+            self._connection().execute("DELETE FROM callback_outbox WHERE id = ?", (entry_id,))
+
+    def retry(self, entry_id: int, attempts: int, next_attempt_at: float, error: str) -> None:
+        with self._lock:
+            self._connection().execute(
+                "UPDATE callback_outbox SET attempts = ?, next_attempt_at = ?, lease_until = 0, last_error = ? WHERE id = ?",
+                (attempts, next_attempt_at, error, entry_id)
+            )
+
+    def dead_letter(self, entry_id: int, error: str) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO callback_outbox_dead "
+                    "(id, chat_id, payload, context, attempts, created_at, dead_at, last_error) "
+                    "SELECT id, chat_id, payload, context, attempts, created_at, ?, ? FROM callback_outbox WHERE id = ?",
+                    (time.time(), error, entry_id)
+                )
+                conn.execute("DELETE FROM callback_outbox WHERE id = ?", (entry_id,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM callback_outbox").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def create_outbox_backend(backend: str = CALLBACK_OUTBOX_BACKEND) -> MemoryOutboxBackend | SqliteOutboxBackend:
+    if backend == "sqlite":
+        return SqliteOutboxBackend()
+    if backend == "memory":
+        return MemoryOutboxBackend()
+    raise ValueError(f"Invalid CALLBACK_OUTBOX_BACKEND: {backend}. Must be one of {{'sqlite', 'memory'}}")
+
+
+class CallbackOutbox:
+    """
+    Durable queue of replies to `CALLBACK_URL`, delivered by a background dispatcher.
+
+    - `enqueue` only writes the reply to the backend, so a webhook turn never waits
+      on a slow or unavailable gateway.
+    - Replies of one chat_id are delivered one at a time in enqueue order, different
+      chats are delivered concurrently: up to `concurrency` deliveries are in flight
+      and a new reply is claimed as soon as one of them settles, so a slow gateway
+      call only holds its own slot.
+    - Failed deliveries are retried with jittered exponential backoff. A reply is
+      dead-lettered after `max_attempts`, or at once when the gateway rejects it (4xx).
+    - `on_settled(entry, response_data)` runs once a reply is delivered or dead-lettered,
+      `response_data` is the decoded callback response, None if it was not delivered.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = CALLBACK_OUTBOX_ENABLED,
+        backend: MemoryOutboxBackend | SqliteOutboxBackend | None = None,
+        concurrency: int = CALLBACK_OUTBOX_CONCURRENCY,
+        poll_interval_ms: int = CALLBACK_OUTBOX_POLL_INTERVAL_MS,
+        max_attempts: int = CALLBACK_OUTBOX_MAX_ATTEMPTS,
+        max_backoff: float = CALLBACK_OUTBOX_MAX_BACKOFF_SECONDS,
+        lease: float = CALLBACK_OUTBOX_LEASE_SECONDS
+    ):
+        self.enabled = enabled
+        self.backend = backend
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval_ms / 1000
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.lease = lease
+
+        self._on_settled: Callable[[OutboxEntry, dict | None], Awaitable[None]] | None = None
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._inflight: set[asyncio.Task] = set()
+
+        self._pending = 0
+        self._enqueued = 0
+        self._delivered = 0
+        self._retried = 0
+        self._dead_lettered = 0
+
+    @property
+    def active(self) -> bool:
+        """
+        True once started: replies can be enqueued instead of sent inline.
+        """
+        return self._task is not None
+
+    async def enqueue(self, chat_id: str, payload: dict, context: dict) -> int:
+        entry_id = await asyncio.to_thread(self.backend.add, chat_id, payload, context, time.time())
+        self._pending += 1
+        self._enqueued += 1
+        self._wakeup.set()
+        return entry_id
+
+    def _backoff(self, attempts: int) -> float:
+        # Full jitter keeps replies of many chats from retrying in lockstep after an outage
+        return random.uniform(0, min(self.max_backoff, self.poll_interval * (2 ** attempts)))
+
+    async def _settle(self, entry: OutboxEntry, response_data: dict | None) -> None:
+        if self._on_settled is None:
+            return
+        try:
+            await self._on_settled(entry, response_data)
+        except Exception as e:
+            await logger.error(f"Outbox settle hook failed for reply {entry.id}: {e}\nDetail: {traceback.format_exc()}")
+
+    async def _fail(self, entry: OutboxEntry, error: str, retryable: bool) -> None:
+        attempts = entry.attempts + 1
+        if retryable and attempts < self.max_attempts:
+            self._retried += 1
+            delay = self._backoff(attempts)
+            await asyncio.to_thread(self.backend.retry, entry.id, attempts, time.time() + delay, error)
+            await logger.warning(
+                f"Callback delivery failed, retrying | chat_id: {entry.chat_id} | Attempt: {attempts} | "
+                f"Retry in: {delay:.1f} s | Error: {error}"
+            )
+            return
+
+        self._dead_lettered += 1
+        self._pending = max(self._pending - 1, 0)
+        await asyncio.to_thread(self.backend.dead_letter, entry.id, error)
+        await logger.error(f"Callback reply dead-lettered | chat_id: {entry.chat_id} | Attempts: {attempts} | Error: {error}")
+        await self._settle(entry, None)
+
+    async def _deliver(self, entry: OutboxEntry) -> None:
+        try:
+            response = await callback_client.post(entry.payload)
+        except httpx.RequestError as e:
+            await self._fail(entry, f"{type(e).__name__}: {e}", retryable=True)
+            return
+
+        if response.status_code >= 400:
+            await self._fail(
+                entry,
+                f"HTTP {response.status_code}",
+                retryable=response.status_code in RETRYABLE_STATUS_CODES or response.status_code >= 500
+            )
+            return
+
+        await asyncio.to_thread(self.backend.ack, entry.id)
+        self._delivered += 1
+        self._pending = max(self._pending - 1, 0)
+        try:
+            response_data = response.json()
+        except ValueError:
+            response_data = None
+        await self._settle(entry, response_data)
+
+    async def _deliver_claimed(self, entry: OutboxEntry) -> None:
+        try:
+            await self._deliver(entry)
+        except Exception as e:
+            # The lease expires and the reply is claimed again
+            await logger.error(f"Outbox delivery of reply {entry.id} failed: {e}\nDetail: {traceback.format_exc()}")
+        finally:
+            # Free the slot before waking the dispatcher to claim the next reply
+            self._inflight.discard(asyncio.current_task())
+            self._wakeup.set()
+
+    async def dispatch(self) -> int:
+        """
+        Claim due replies for the free delivery slots and start delivering them in
+        the background, returning how many were claimed.
+        """
+        free = self.concurrency - len(self._inflight)
+        if free <= 0:
+            return 0
+
+        entries = await asyncio.to_thread(self.backend.claim_due, time.time(), free, self.lease)
+        for entry in entries:
+            task = asyncio.create_task(self._deliver_claimed(entry), name=f"callback-outbox:{entry.chat_id}")
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+        return len(entries)
+
+    async def _run(self) -> None:
+        while True:
+            # Cleared before claiming, so an enqueue or a settled delivery from now on wakes the loop
+            self._wakeup.clear()
+            try:
+                if await self.dispatch() and len(self._inflight) < self.concurrency:
+                    continue
+            except Exception as e:
+                await logger.error(f"Outbox dispatcher error: {e}\nDetail: {traceback.format_exc()}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self, on_settled: Callable[[OutboxEntry, dict | None], Awaitable[None]] | None = None) -> None:
+        """
+        Start the dispatcher, replies left by a previous run are delivered first.
+        """
+        if not self.enabled or self._task is not None:
+            return
+
+        if self.backend is None:
+            self.backend = create_outbox_backend()
+        self._on_settled = on_settled
+        self._pending = await asyncio.to_thread(self.backend.pending)
+
+        self._task = asyncio.create_task(self._run(), name="callback-outbox")
+        await logger.info(f"Callback outbox started | Backend: {type(self.backend).__name__} | Pending: {self._pending}")
+
+    async def stop(self, timeout: float) -> bool:
+        """
+        Stop the dispatcher after delivering what is due within `timeout`.
+        Undelivered replies stay in a durable backend for the next start.
+
+        Returns:
+            bool: True if nothing is left pending.
+        """
+        if self._task is None:
+            return True
+
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+        async def drain() -> None:
+            while True:
+                await self.dispatch()
+                if not self._inflight:
+                    return
+                await asyncio.wait(self._inflight, return_when=asyncio.FIRST_COMPLETED)
+
+        try:
+            await asyncio.wait_for(drain(), timeout=max(timeout, 0))
+        except asyncio.TimeoutError:
+            pass
+        # Deliveries cut off by the deadline are claimed again once their lease expires
+        for task in self._inflight:
+            task.cancel()
+        await asyncio.gather(*self._inflight, return_exceptions=True)
+
+        pending = await asyncio.to_thread(self.backend.pending)
+        if pending:
+            await logger.warning(f"Callback outbox stopped with {pending} pending replies")
+        self.backend.close()
+        return not pending
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "pending": self._pending,
+            "in_flight": len(self._inflight),
+            "enqueued": self._enqueued,
+            "delivered": self._delivered,
+            "retried": self._retried,
+            "dead_lettered": self._dead_lettered
+        }
+
+
+callback_outbox = CallbackOutbox()
@@ -0,0 +1,114 @@
+import os
+import time
+import asyncio
+import hashlib
+import tempfile
+from dotenv import load_dotenv
+from typing import AsyncIterator
+from contextlib import asynccontextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock is available
+    fcntl = None
+
+load_dotenv()
+
+# "file": flock-based lock shared by every worker process on the node, "local": in-process only
+CHAT_LOCK_BACKEND = os.getenv("CHAT_LOCK_BACKEND", "file")
+CHAT_LOCK_DIR = os.getenv("CHAT_LOCK_DIR", os.path.join(tempfile.gettempdir(), "agent_bot_chat_locks"))
+CHAT_LOCK_TIMEOUT_SECONDS = float(os.getenv("CHAT_LOCK_TIMEOUT_SECONDS", 120))
+CHAT_LOCK_POLL_INTERVAL_SECONDS = float(os.getenv("CHAT_LOCK_POLL_INTERVAL_SECONDS", 0.05))
+
+
+class ChatLockTimeout(Exception):
+    """Raised when a chat stays locked by another turn for longer than the timeout."""
+
+
+class LocalChatLock:
+    """
+    Per-chat_id mutual exclusion inside one process.
+    """
+
+    def __init__(self, timeout: float = CHAT_LOCK_TIMEOUT_SECONDS):
+        self.timeout = timeout
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._waiters: dict[str, int] = {}
+
+    @asynccontextmanager
+    async def hold(self, chat_id: str) -> AsyncIterator[None]:
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        self._waiters[chat_id] = self._waiters.get(chat_id, 0) + 1
+        try:
+            try:
+                await asyncio.wait_for(lock.acquire(), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                raise ChatLockTimeout(f"Chat {chat_id} is still locked after {self.timeout} s")
+            try:
+                yield
+            finally:
+                lock.release()
+        finally:
+            self._waiters[chat_id] -= 1
+            if not self._waiters[chat_id]:
+                del self._waiters[chat_id]
+                del self._locks[chat_id]
+
+
+class FileChatLock:
+    """
+    Per-chat_id mutual exclusion across worker processes of one node using `flock`.
+
+    The lock is tied to the open file description, so it is released by the kernel
+    if the holding process dies. Lock files are tiny and reused across turns.
+    """
+
+    def __init__(
+        self,
+        lock_dir: str = CHAT_LOCK_DIR,
+        timeout: float = CHAT_LOCK_TIMEOUT_SECONDS,
+        poll_interval: float = CHAT_LOCK_POLL_INTERVAL_SECONDS
+    ):
+        os.makedirs(lock_dir, exist_ok=True)
+        self.lock_dir = lock_dir
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        # flock also conflicts between two descriptors of one process, the local
+        # lock keeps same-process waiters off the polling loop
+        self._local = LocalChatLock(timeout=timeout)
+
+    def _path(self, chat_id: str) -> str:
+        digest = hashlib.sha1(chat_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.lock_dir, f"{digest}.lock")
+
+    @asynccontextmanager
+    async def hold(self, chat_id: str) -> AsyncIterator[None]:
+        async with self._local.hold(chat_id):
+            fd = os.open(self._path(chat_id), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                deadline = time.monotonic() + self.timeout
+                while True:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if time.monotonic() >= deadline:
+                            raise ChatLockTimeout(f"Chat {chat_id} is still locked after {self.timeout} s")
+                        await asyncio.sleep(self.poll_interval)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+            finally:
+                os.close(fd)
+
+
+def create_chat_lock(backend: str = CHAT_LOCK_BACKEND) -> LocalChatLock | FileChatLock:
+    if backend == "file" and fcntl is not None:
+        return FileChatLock()
+    if backend in ("file", "local"):
+        return LocalChatLock()
+    raise ValueError(f"Invalid CHAT_LOCK_BACKEND: {backend}. Must be one of {{'file', 'local'}}")
+
+
+chat_lock = create_chat_lock()
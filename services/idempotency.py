@@ -0,0 +1,145 @@
+import os
+import time
+import sqlite3
+import asyncio
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", 24 * 60 * 60))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", 100_000))
+# Persistent fallback shared by worker processes and restarts, empty to keep memory only
+IDEMPOTENCY_SQLITE_PATH = os.getenv("IDEMPOTENCY_SQLITE_PATH", "data/idempotency.sqlite")
+# Expired rows of the persistent store are pruned once every N claims
+IDEMPOTENCY_PRUNE_EVERY = int(os.getenv("IDEMPOTENCY_PRUNE_EVERY", 1000))
+
+# Keys of a message span that may carry the upstream message id, in priority order
+MESSAGE_ID_KEYS = ("message_id", "mid", "upstream_message_id", "external_message_id")
+
+
+def extract_message_id(message_spans: list[dict] | None) -> str | None:
+    """
+    Find the upstream message id carried by the gateway in `message_spans`.
+    """
+    for span in message_spans or []:
+        if not isinstance(span, dict):
+            continue
+        for key in MESSAGE_ID_KEYS:
+            if span.get(key):
+                return str(span[key])
+    return None
+
+
+class IdempotencyStore:
+    """
+    Remembers which upstream messages were already accepted.
+
+    Lookups hit a bounded in-memory TTL map first. Misses fall back to a SQLite
+    table, which also makes the check hold across worker processes and restarts.
+    """
+
+    def __init__(
+        self,
+        ttl: float = IDEMPOTENCY_TTL_SECONDS,
+        max_entries: int = IDEMPOTENCY_MAX_ENTRIES,
+        sqlite_path: str | None = IDEMPOTENCY_SQLITE_PATH
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.sqlite_path = sqlite_path
+
+        self._memory: OrderedDict[str, float] = OrderedDict()
+        self._conn: sqlite3.Connection | None = None
+        self._conn_lock = threading.Lock()
+
+        self._claims = 0
+        self._duplicates = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            Path(self.sqlite_path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.sqlite_path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS processed_messages ("
+                "key TEXT PRIMARY KEY, created_at REAL NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _claim_persistent(self, key: str, now: float) -> bool:
+        with self._conn_lock:
+            conn = self._connection()
+            if self._claims % IDEMPOTENCY_PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM processed_messages WHERE created_at < ?", (now - self.ttl,))
+            # An expired row is replaced, a live one makes the insert a no-op
+            conn.execute(
+                "DELETE FROM processed_messages WHERE key = ? AND created_at < ?",
+                (key, now - self.ttl)
+            )
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO processed_messages (key, created_at) VALUES (?, ?)",
+                (key, now)
+            )
+            conn.commit()
+            return cursor.rowcount == 1
+
+    def _release_persistent(self, key: str) -> None:
+        with self._conn_lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM processed_messages WHERE key = ?", (key,))
+            conn.commit()
+
+    def _remember(self, key: str, expires_at: float) -> None:
+        self._memory[key] = expires_at
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def claim(self, key: str) -> bool:
+        """
+        Mark a message as accepted.
+
+        Returns:
+            bool: True if this is the first delivery, False for a duplicate.
+        """
+        now = time.time()
+        self._claims += 1
+
+        expires_at = self._memory.get(key)
+        if expires_at is not None and expires_at > now:
+            self._duplicates += 1
+            return False
+
+        if self.sqlite_path:
+            claimed = await asyncio.to_thread(self._claim_persistent, key, now)
+            if not claimed:
+                # Not cached: the owning process may still release its claim
+                self._duplicates += 1
+                return False
+
+        self._remember(key, now + self.ttl)
+        return True
+
+    async def release(self, key: str) -> None:
+        """
+        Forget a claim, e.g. when the message was rejected before processing,
+        so that the gateway's redelivery is processed normally.
+        """
+        self._memory.pop(key, None)
+        if self.sqlite_path:
+            await asyncio.to_thread(self._release_persistent, key)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._memory),
+            "claims": self._claims,
+            "duplicates": self._duplicates
+        }
+
+
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,303 @@
+import os
+import time
+import asyncio
+import traceback
+from datetime import datetime
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+from dotenv import load_dotenv
+from log.logger_config import setup_logging
+from services.idempotency import idempotency_store
+from services.worker_pool import WorkerPool, PoolClosedError, PoolSaturatedError, worker_pool
+
+load_dotenv()
+logger = setup_logging(__name__)
+
+# Number of recent wait-time samples kept for percentile metrics
+MAILBOX_WAIT_SAMPLES = int(os.getenv("MAILBOX_WAIT_SAMPLES", 1000))
+# Maximum number of messages waiting in a single chat mailbox
+MAILBOX_MAX_DEPTH = int(os.getenv("MAILBOX_MAX_DEPTH", 20))
+# Debounce window: messages of one chat arriving within it are merged into one turn (0 disables)
+MAILBOX_COALESCE_WINDOW_MS = int(os.getenv("MAILBOX_COALESCE_WINDOW_MS", 0))
+# Upper bound on how long the first message of a burst may wait for the burst to end
+MAILBOX_COALESCE_MAX_WAIT_MS = int(os.getenv("MAILBOX_COALESCE_MAX_WAIT_MS", 5000))
+
+# Control commands are never merged with other messages
+CHAT_COMMANDS = ("/start", "/restart", "/delete_me")
+
+
+@dataclass
+class MailboxMessage:
+    """
+    A single inbound webhook message waiting in a chat mailbox.
+    """
+    chat_id: str
+    user_input: str
+    timestamp_start: datetime | None = None
+    message_spans: list[dict] = field(default_factory=list)
+    enqueued_at: float = field(default_factory=time.monotonic)
+    # Claimed for the upstream message id, released if the message is dropped
+    idempotency_key: str | None = None
+
+
+MessageHandler = Callable[[MailboxMessage], Awaitable[None]]
+
+
+def _is_command(message: MailboxMessage) -> bool:
+    return any(cmd in message.user_input for cmd in CHAT_COMMANDS)
+
+
+def merge_messages(messages: list[MailboxMessage]) -> MailboxMessage:
+    """
+    Merge a burst of messages into a single turn.
+
+    The user inputs are joined line by line, the turn starts at the first message
+    and every original message span is kept so each one is still recorded.
+    """
+    if len(messages) == 1:
+        return messages[0]
+
+    first = messages[0]
+    return MailboxMessage(
+        chat_id=first.chat_id,
+        user_input="\n".join(message.user_input for message in messages),
+        timestamp_start=first.timestamp_start,
+        message_spans=[span for message in messages for span in message.message_spans],
+        enqueued_at=first.enqueued_at
+    )
+
+
+def _percentile(samples: list[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, int(round(q * (len(samples) - 1))))
+    return samples[index]
+
+
+class ChatMailbox:
+    """
+    In-process mailbox keyed by `chat_id`.
+
+    Messages of the same chat are handled strictly one after another in arrival
+    order, while different chats are drained concurrently. Each chat with pending
+    messages owns exactly one drain job on the worker pool, so two messages of one
+    customer never run the graph against the same session at the same time.
+
+    With a coalesce window, a burst of consecutive messages of one chat is merged
+    into a single turn before it is handed to the handler. The burst is awaited
+    with a per-chat timer in the mailbox, the drain job is only submitted once the
+    burst ended, so a waiting chat never holds a worker.
+    """
+
+    def __init__(
+        self,
+        executor: WorkerPool = worker_pool,
+        max_depth: int = MAILBOX_MAX_DEPTH,
+        coalesce_window_ms: int = MAILBOX_COALESCE_WINDOW_MS,
+        coalesce_max_wait_ms: int = MAILBOX_COALESCE_MAX_WAIT_MS,
+        wait_samples: int = MAILBOX_WAIT_SAMPLES
+    ):
+        self._executor = executor
+        self.max_depth = max_depth
+        self.coalesce_window = coalesce_window_ms / 1000
+        self.coalesce_max_wait = coalesce_max_wait_ms / 1000
+
+        self._queues: dict[str, deque[tuple[MailboxMessage, MessageHandler]]] = {}
+        # Chats with a drain job queued or running on the pool
+        self._scheduled: set[str] = set()
+        # Chats waiting for the end of a burst before their drain job is submitted
+        self._timers: dict[str, asyncio.TimerHandle] = {}
+        self._wait_samples: deque[float] = deque(maxlen=wait_samples)
+        self._processed = 0
+        self._failed = 0
+        self._batches = 0
+        self._coalesced = 0
+        self._deferred = 0
+        self._closing = False
+        self._releases: set[asyncio.Task] = set()
+
+    def post(self, message: MailboxMessage, handler: MessageHandler) -> int:
+        """
+        Append a message to its chat mailbox and make sure the chat is being drained.
+
+        Args:
+            message (MailboxMessage): Inbound message.
+            handler (MessageHandler): Coroutine function that processes one message.
+
+        Returns:
+            int: Mailbox depth of the chat after enqueueing.
+
+        Raises:
+            PoolSaturatedError: The chat mailbox or the worker pool queue is full.
+            PoolClosedError: The worker pool is not accepting work.
+        """
+        chat_id = message.chat_id
+        if self._closing:
+            raise PoolClosedError("Mailbox is closed, the service is shutting down")
+        if self.depth(chat_id) >= self.max_depth:
+            raise PoolSaturatedError(f"Mailbox of chat {chat_id} is full ({self.max_depth} messages)")
+
+        # Admission happens before enqueueing so a rejected message leaves no trace
+        if chat_id not in self._scheduled:
+            if self.coalesce_window > 0:
+                self._executor.check_admission()
+            else:
+                self._submit(chat_id)
+
+        queue = self._queues.setdefault(chat_id, deque())
+        queue.append((message, handler))
+        if chat_id not in self._scheduled:
+            # Every message of the burst pushes the timer back
+            self._arm(chat_id)
+
+        return len(queue)
+
+    def close(self) -> None:
+        """
+        Reject new messages and stop waiting for bursts to end, so pending
+        messages are handed to the pool right away and processed by its drain.
+        """
+        self._closing = True
+        for chat_id, timer in list(self._timers.items()):
+            timer.cancel()
+            self._on_burst_end(chat_id)
+
+    def _burst_deadline(self, queue: deque) -> float:
+        """
+        No message arrived for one coalesce window, or the oldest pending message
+        waited `coalesce_max_wait`.
+        """
+        return min(
+            queue[-1][0].enqueued_at + self.coalesce_window,
+            queue[0][0].enqueued_at + self.coalesce_max_wait
+        )
+
+    def _arm(self, chat_id: str, delay: float | None = None) -> None:
+        timer = self._timers.pop(chat_id, None)
+        if timer is not None:
+            timer.cancel()
+        if delay is None:
+            delay = max(self._burst_deadline(self._queues[chat_id]) - time.monotonic(), 0)
+        self._timers[chat_id] = asyncio.get_running_loop().call_later(delay, self._on_burst_end, chat_id)
+
+    def _on_burst_end(self, chat_id: str) -> None:
+        self._timers.pop(chat_id, None)
+        if self._executor.saturated and not self._closing:
+            # Try again once the pool had time to drain
+            self._deferred += 1
+            self._arm(chat_id, delay=self.coalesce_window)
+            return
+        try:
+            # The messages were already acknowledged to the gateway, they are never rejected
+            self._submit(chat_id, admitted=True)
+        except PoolClosedError:
+            self._drop(chat_id)
+
+    def _drop(self, chat_id: str) -> None:
+        """
+        Give up on the chat's messages when the pool is stopped. Their idempotency
+        claims are released, so the gateway's redelivery is processed.
+        """
+        queue = self._queues.pop(chat_id, None)
+        if not queue:
+            return
+        self._failed += len(queue)
+        keys = [message.idempotency_key for message, _ in queue if message.idempotency_key]
+        if keys:
+            task = asyncio.get_running_loop().create_task(self._release(chat_id, keys))
+            self._releases.add(task)
+            task.add_done_callback(self._releases.discard)
+
+    async def _release(self, chat_id: str, keys: list[str]) -> None:
+        await logger.warning(f"Chat ID: {chat_id} | Dropped {len(keys)} messages, releasing their idempotency claims")
+        for key in keys:
+            await idempotency_store.release(key)
+
+    def _submit(self, chat_id: str, admitted: bool = False) -> None:
+        self._executor.submit(
+            name=f"mailbox:{chat_id}",
+            job=lambda: self._drain(chat_id),
+            admitted=admitted
+        )
+        self._scheduled.add(chat_id)
+
+    async def _drain(self, chat_id: str) -> None:
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                if (
+                    self.coalesce_window > 0
+                    and not self._closing
+                    and self._burst_deadline(queue) > time.monotonic()
+                ):
+                    # A new burst started while the previous turn ran, wait for it off the pool
+                    break
+
+                batch = self._take_batch(queue)
+                now = time.monotonic()
+                for message, _ in batch:
+                    self._wait_samples.append((now - message.enqueued_at) * 1000)
+
+                # All handlers of one chat are the same service entry point
+                handler = batch[-1][1]
+                self._batches += 1
+                self._coalesced += len(batch) - 1
+                try:
+                    await handler(merge_messages([message for message, _ in batch]))
+                    self._processed += len(batch)
+                except Exception as e:
+                    self._failed += len(batch)
+                    error_details = traceback.format_exc()
+                    await logger.error(f"Chat ID: {chat_id} | Mailbox handler failed: {e}\nDetail: {error_details}")
+        finally:
+            # No await between the empty check above and this cleanup, so a message
+            # posted concurrently always either sees the drainer or starts a new one
+            self._scheduled.discard(chat_id)
+            if not queue:
+                self._queues.pop(chat_id, None)
+            elif not self._closing:
+                self._arm(chat_id)
+
+    def _take_batch(self, queue: deque) -> list[tuple[MailboxMessage, MessageHandler]]:
+        batch = [queue.popleft()]
+        if self.coalesce_window <= 0 or _is_command(batch[0][0]):
+            return batch
+
+        while queue and not _is_command(queue[0][0]):
+            batch.append(queue.popleft())
+        return batch
+
+    def depth(self, chat_id: str) -> int:
+        queue = self._queues.get(chat_id)
+        return len(queue) if queue else 0
+
+    def stats(self) -> dict:
+        """
+        Snapshot of queue depth and wait-time metrics.
+        """
+        samples = sorted(self._wait_samples)
+        depths = [len(queue) for queue in self._queues.values()]
+
+        return {
+            "active_chats": len(self._scheduled),
+            "queued_messages": sum(depths),
+            "max_chat_depth": max(depths, default=0),
+            "processed": self._processed,
+            "failed": self._failed,
+            "waiting_chats": len(self._timers),
+            "batches": self._batches,
+            "coalesced_messages": self._coalesced,
+            "deferred_submits": self._deferred,
+            "wait_ms": {
+                "count": len(samples),
+                "avg": sum(samples) / len(samples) if samples else 0.0,
+                "p50": _percentile(samples, 0.50),
+                "p95": _percentile(samples, 0.95),
+                "max": samples[-1] if samples else 0.0,
+            }
+        }
+
+
+chat_mailbox = ChatMailbox()
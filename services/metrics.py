@@ -0,0 +1,375 @@
+import math
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Iterable
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langgraph.errors import GraphBubbleUp
+
+# Latency buckets in seconds, from cache hits up to long agent turns
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Sample = tuple[dict[str, str], float]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+    def _key(self, labels: dict[str, Any]) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key: tuple[str, ...]) -> dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def _render_samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {_escape(self.documentation)}",
+            f"# TYPE {self.name} {self.type}"
+        ]
+        lines.extend(self._render_samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing value per label set.
+    """
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_samples(self) -> Iterable[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self._labels(key))} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """
+    Bucketed distribution of observed values per label set.
+
+    Observing is a dict lookup plus a bisect, buckets are made cumulative
+    only when the metrics are scraped.
+    """
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [per-bucket counts (last one is +Inf), sum]
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    def _render_samples(self) -> Iterable[str]:
+        for key, (counts, total) in self._series.items():
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                bucket_labels = _format_labels({**labels, "le": _format_value(bound)})
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(total[0])}"
+            yield f"{self.name}_count{_format_labels(labels)} {cumulative}"
+
+
+class CallbackMetric(_Metric):
+    """
+    Gauge or counter whose samples are read from a component's `stats()` at scrape time,
+    so the hot path of that component is not touched at all.
+    """
+
+    def __init__(self, name: str, documentation: str, collect: Callable[[], Iterable[Sample]], type: str = "gauge"):
+        super().__init__(name, documentation)
+        self.collect = collect
+        self.type = type
+
+    def _render_samples(self) -> Iterable[str]:
+        for labels, value in self.collect():
+            yield f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(
+        self,
+        name: str,
+        documentation: str,
+        collect: Callable[[], Iterable[Sample]],
+        type: str = "gauge"
+    ) -> CallbackMetric:
+        return self.register(CallbackMetric(name, documentation, collect, type))
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+        """
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "chatbot_http_request_duration_seconds",
+    "HTTP request latency until the response starts, by route and status code.",
+    ("method", "route", "status")
+)
+GRAPH_NODE_SECONDS = registry.histogram(
+    "chatbot_graph_node_duration_seconds",
+    "Latency of one run of a top-level graph node (supervisor or agent).",
+    ("node", "status")
+)
+TOOL_SECONDS = registry.histogram(
+    "chatbot_tool_duration_seconds",
+    "Latency of one agent tool call.",
+    ("tool", "status")
+)
+LLM_SECONDS = registry.histogram(
+    "chatbot_llm_duration_seconds",
+    "Latency of one LLM call.",
+    ("model", "status")
+)
+LLM_TOKENS = registry.counter(
+    "chatbot_llm_tokens_total",
+    "Tokens consumed by LLM calls.",
+    ("model", "kind")
+)
+DB_CALL_SECONDS = registry.histogram(
+    "chatbot_db_call_duration_seconds",
+    "Latency of one repository call to Supabase, retries included.",
+    ("repo", "operation", "status")
+)
+CALLBACK_SECONDS = registry.histogram(
+    "chatbot_callback_duration_seconds",
+    "Latency of delivering one reply to the callback URL, retries included, by final status code.",
+    ("status",)
+)
+CALLBACK_FAILURES = registry.counter(
+    "chatbot_callback_failures_total",
+    "Failed callback attempts by reason (status code or error); final=false attempts were retried.",
+    ("reason", "final")
+)
+BOT_RESPONSES = registry.counter(
+    "chatbot_bot_responses_total",
+    "Chat turns answered by the graph, by outcome event type.",
+    ("event_type",)
+)
+STATE_CODEC_OPERATIONS = registry.counter(
+    "chatbot_state_codec_operations_total",
+    "Session states encoded or decoded, by format; legacy_pickle decodes are rows not migrated yet.",
+    ("operation", "format")
+)
+CONTEXT_WINDOW_TOKENS = registry.histogram(
+    "chatbot_context_window_tokens",
+    "Estimated tokens of conversation history (rolling summary included) sent with one LLM call, by agent.",
+    ("agent",),
+    buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+)
+SUPERVISOR_ROUTES = registry.counter(
+    "chatbot_supervisor_routes_total",
+    "Supervisor routing decisions by source: a routing rule's name, or llm when no rule matched.",
+    ("source", "next")
+)
+CONTEXT_SUMMARY_REFRESHES = registry.counter(
+    "chatbot_context_summary_refreshes_total",
+    "Older turns folded into the rolling conversation summary, by agent and outcome.",
+    ("agent", "status")
+)
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    LangChain callback recording graph node, tool and LLM latencies plus token usage.
+
+    It is attached once to the compiled graph and inherited by every nested run,
+    including the agents' inner ReAct graphs.
+    """
+    # Called directly on the event loop instead of being dispatched to a thread
+    run_inline = True
+
+    def __init__(self):
+        # run_id -> (histogram, labels, started_at)
+        self._runs: dict[UUID, tuple[Histogram, dict[str, str], float]] = {}
+        self._llm_models: dict[UUID, str] = {}
+
+    def _start(self, run_id: UUID, histogram: Histogram, **labels: str) -> None:
+        self._runs[run_id] = (histogram, labels, time.perf_counter())
+
+    def _end(self, run_id: UUID, status: str) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        histogram, labels, started_at = run
+        histogram.observe(time.perf_counter() - started_at, status=status, **labels)
+
+    # -------------------------------- graph nodes --------------------------------
+
+    def on_chain_start(
+        self,
+        serialized: dict[str, Any] | None,
+        inputs: Any,
+        *,
+        run_id: UUID,
+        metadata: dict[str, Any] | None = None,
+        **kwargs: Any
+    ) -> None:
+        if not metadata:
+            return
+        node = metadata.get("langgraph_node")
+        checkpoint_ns = metadata.get("langgraph_checkpoint_ns", "")
+        # Only the node run itself of the top-level graph, not the chains inside it
+        # nor the nodes of the agents' subgraphs
+        if node and kwargs.get("name") == node and "|" not in checkpoint_ns:
+            self._start(run_id, GRAPH_NODE_SECONDS, node=node)
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, "ok")
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        # Interrupts and Command-based routing bubble up as exceptions but are not failures
+        self._end(run_id, "ok" if isinstance(error, GraphBubbleUp) else "error")
+
+    # ----------------------------------- tools -----------------------------------
+
+    def on_tool_start(
+        self,
+        serialized: dict[str, Any] | None,
+        input_str: str,
+        *,
+        run_id: UUID,
+        **kwargs: Any
+    ) -> None:
+        name = kwargs.get("name") or (serialized or {}).get("name", "unknown")
+        self._start(run_id, TOOL_SECONDS, tool=name)
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, "ok")
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, "error")
+
+    # ------------------------------------ LLM ------------------------------------
+
+    def _start_llm(self, serialized: dict[str, Any] | None, run_id: UUID, metadata: dict[str, Any] | None) -> None:
+        model = (metadata or {}).get("ls_model_name") \
+            or ((serialized or {}).get("kwargs") or {}).get("model_name") \
+            or "unknown"
+        self._llm_models[run_id] = model
+        self._start(run_id, LLM_SECONDS, model=model)
+
+    def on_chat_model_start(
+        self,
+        serialized: dict[str, Any] | None,
+        messages: Any,
+        *,
+        run_id: UUID,
+        metadata: dict[str, Any] | None = None,
+        **kwargs: Any
+    ) -> None:
+        self._start_llm(serialized, run_id, metadata)
+
+    def on_llm_start(
+        self,
+        serialized: dict[str, Any] | None,
+        prompts: list[str],
+        *,
+        run_id: UUID,
+        metadata: dict[str, Any] | None = None,
+        **kwargs: Any
+    ) -> None:
+        self._start_llm(serialized, run_id, metadata)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        model = self._llm_models.pop(run_id, "unknown")
+        self._end(run_id, "ok")
+
+        input_tokens = output_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    input_tokens += usage.get("input_tokens", 0)
+                    output_tokens += usage.get("output_tokens", 0)
+
+        # Providers that do not fill `usage_metadata` report usage in `llm_output`
+        if not input_tokens and not output_tokens:
+            token_usage = (response.llm_output or {}).get("token_usage") or {}
+            input_tokens = token_usage.get("prompt_tokens", 0)
+            output_tokens = token_usage.get("completion_tokens", 0)
+
+        if input_tokens:
+            LLM_TOKENS.inc(input_tokens, model=model, kind="input")
+        if output_tokens:
+            LLM_TOKENS.inc(output_tokens, model=model, kind="output")
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._llm_models.pop(run_id, None)
+        self._end(run_id, "error")
+
+
+metrics_callback = MetricsCallbackHandler()
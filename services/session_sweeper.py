@@ -0,0 +1,176 @@
+import os
+import time
+import asyncio
+import traceback
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+from supabase import AsyncClient
+from langgraph.checkpoint.base import BaseCheckpointSaver
+
+from core.graph.checkpointer import CHECKPOINT_DURABLE, DurableSqliteSaver
+from log.logger_config import setup_logging
+from repository.span_index import span_index
+from repository.async_repo import AsyncSessionRepo
+from repository.cache import control_mode_cache, customer_cache
+
+load_dotenv()
+logger = setup_logging(__name__)
+
+# Close idle sessions in the background instead of on the customer's next message
+SESSION_SWEEPER_ENABLED = os.getenv("SESSION_SWEEPER_ENABLED", "false").lower() == "true"
+CLEANUP_INTERVAL_MINUTES = float(os.getenv("CLEANUP_INTERVAL_MINUTES", 30))
+STATE_TTL_MINUTES = float(os.getenv("STATE_TTL_MINUTES", 120))
+N_DAYS = int(os.getenv("N_DAYS"))
+# Sessions closed per round trip, a sweep loops until no idle session is left
+SESSION_SWEEPER_BATCH_SIZE = int(os.getenv("SESSION_SWEEPER_BATCH_SIZE", 500))
+
+
+class SessionSweeper:
+    """
+    Periodic cleanup of the session lifecycle, every `CLEANUP_INTERVAL_MINUTES`:
+
+    - active sessions idle for more than `N_DAYS` are closed in bulk, so the next
+      message of the customer simply opens a new session;
+    - checkpoints of threads untouched for `STATE_TTL_MINUTES` are deleted (turns
+      normally delete theirs, this catches the turns that failed midway); with
+      `CHECKPOINT_DURABLE` they hold the session state and live `N_DAYS`, as long
+      as an idle session;
+    - expired entries of the in-process caches are dropped.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = SESSION_SWEEPER_ENABLED,
+        interval_minutes: float = CLEANUP_INTERVAL_MINUTES,
+        state_ttl_minutes: float = STATE_TTL_MINUTES,
+        n_days: int = N_DAYS,
+        batch_size: int = SESSION_SWEEPER_BATCH_SIZE
+    ):
+        self.enabled = enabled
+        self.interval = interval_minutes * 60
+        self.state_ttl = timedelta(days=n_days) if CHECKPOINT_DURABLE else timedelta(minutes=state_ttl_minutes)
+        self.n_days = n_days
+        self.batch_size = batch_size
+
+        self._client: AsyncClient | None = None
+        self._checkpointer: BaseCheckpointSaver | None = None
+        self._task: asyncio.Task | None = None
+
+        self._sweeps = 0
+        self._sessions_closed = 0
+        self._checkpoints_evicted = 0
+        self._cache_entries_evicted = 0
+        self._last_sweep_ms = 0.0
+
+    async def _close_idle_sessions(self) -> int:
+        repo = AsyncSessionRepo(client=self._client)
+        idle_before = (datetime.now(timezone.utc) - timedelta(days=self.n_days)).isoformat()
+
+        closed: set[int] = set()
+        while True:
+            sessions = await repo.end_idle_sessions(idle_before=idle_before, limit=self.batch_size)
+            ids = {session["id"] for session in sessions}
+            if ids & closed:
+                # The update did not close them, stop instead of picking them again
+                await logger.warning(f"Idle sessions were not closed: {sorted(ids & closed)[:10]}")
+                return len(closed)
+            closed |= ids
+            if len(sessions) < self.batch_size:
+                return len(closed)
+
+    async def _evict_checkpoints(self) -> int:
+        if self._checkpointer is None:
+            return 0
+
+        cutoff = datetime.now(timezone.utc) - self.state_ttl
+        if isinstance(self._checkpointer, DurableSqliteSaver):
+            # Last turn of each thread, without reading every checkpoint
+            stale = await self._checkpointer.aidle_threads(before=cutoff)
+            for thread_id in stale:
+                await self._checkpointer.adelete_thread(thread_id)
+            return len(stale)
+
+        latest: dict[str, datetime] = {}
+        async for item in self._checkpointer.alist(None):
+            thread_id = item.config["configurable"]["thread_id"]
+            ts = datetime.fromisoformat(item.checkpoint["ts"])
+            if thread_id not in latest or ts > latest[thread_id]:
+                latest[thread_id] = ts
+
+        stale = [thread_id for thread_id, ts in latest.items() if ts < cutoff]
+        for thread_id in stale:
+            await self._checkpointer.adelete_thread(thread_id)
+        return len(stale)
+
+    def _evict_caches(self) -> int:
+        return (
+            control_mode_cache.evict_expired()
+            + customer_cache.evict_expired()
+            + span_index.evict_expired()
+        )
+
+    async def sweep(self) -> dict:
+        """
+        Run one cleanup pass, each step runs even if another one failed.
+        """
+        started_at = time.perf_counter()
+        result = {"sessions_closed": 0, "checkpoints_evicted": 0, "cache_entries_evicted": 0}
+
+        try:
+            result["sessions_closed"] = await self._close_idle_sessions()
+        except Exception as e:
+            await logger.error(f"Session sweep failed: {e}\nDetail: {traceback.format_exc()}")
+        try:
+            result["checkpoints_evicted"] = await self._evict_checkpoints()
+        except Exception as e:
+            await logger.error(f"Checkpoint eviction failed: {e}\nDetail: {traceback.format_exc()}")
+        result["cache_entries_evicted"] = self._evict_caches()
+
+        self._sweeps += 1
+        self._sessions_closed += result["sessions_closed"]
+        self._checkpoints_evicted += result["checkpoints_evicted"]
+        self._cache_entries_evicted += result["cache_entries_evicted"]
+        self._last_sweep_ms = (time.perf_counter() - started_at) * 1000
+
+        await logger.info(f"Sweep done in {self._last_sweep_ms:.0f} ms | {result}")
+        return result
+
+    async def _run(self) -> None:
+        while True:
+            # The first pass catches up on what went idle while the app was down
+            await self.sweep()
+            await asyncio.sleep(self.interval)
+
+    async def start(self, client: AsyncClient, checkpointer: BaseCheckpointSaver | None = None) -> None:
+        if not self.enabled or self._task is not None:
+            return
+
+        self._client = client
+        self._checkpointer = checkpointer
+        self._task = asyncio.create_task(self._run(), name="session-sweeper")
+        await logger.info(
+            f"Session sweeper started | Interval: {self.interval / 60:.0f} min | "
+            f"Idle sessions: {self.n_days} days | State TTL: {self.state_ttl}"
+        )
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "sweeps": self._sweeps,
+            "sessions_closed": self._sessions_closed,
+            "checkpoints_evicted": self._checkpoints_evicted,
+            "cache_entries_evicted": self._cache_entries_evicted,
+            "last_sweep_ms": self._last_sweep_ms
+        }
+
+
+session_sweeper = SessionSweeper()
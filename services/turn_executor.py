@@ -0,0 +1,93 @@
+import os
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Run independent steps of a turn concurrently, "false" runs them one by one in declaration order
+TURN_PARALLEL_STEPS = os.getenv("TURN_PARALLEL_STEPS", "true").lower() == "true"
+
+
+@dataclass
+class TurnStep:
+    """
+    One operation of a turn.
+
+    `run` receives the results of the steps finished so far, keyed by name, and
+    starts once every step named in `after` has succeeded.
+    """
+    name: str
+    run: Callable[[dict[str, Any]], Awaitable[Any]]
+    after: tuple[str, ...] = ()
+
+
+class TurnStepsError(Exception):
+    """
+    Raised once every step has finished or been skipped, when at least one failed.
+    """
+
+    def __init__(self, errors: dict[str, BaseException], results: dict[str, Any], skipped: list[str]):
+        details = ", ".join(f"{name}: {error!r}" for name, error in errors.items())
+        super().__init__(f"Turn steps failed ({details})" + (f", skipped: {skipped}" if skipped else ""))
+        self.errors = errors
+        self.results = results
+        self.skipped = skipped
+
+
+def _validate(steps: list[TurnStep]) -> None:
+    seen: set[str] = set()
+    for step in steps:
+        if step.name in seen:
+            raise ValueError(f"Duplicate turn step: {step.name}")
+        unknown = [name for name in step.after if name not in seen]
+        if unknown:
+            # Declaring dependencies first keeps the declaration order a valid sequential order
+            raise ValueError(f"Turn step {step.name} must be declared after {unknown}")
+        seen.add(step.name)
+
+
+async def run_turn_steps(steps: list[TurnStep], concurrent: bool = TURN_PARALLEL_STEPS) -> dict[str, Any]:
+    """
+    Run the steps of a turn, each as soon as its dependencies are done.
+
+    A failed step does not stop the independent ones; the steps depending on it are
+    skipped. Failures are collected and raised together as `TurnStepsError`.
+
+    Args:
+        steps (list[TurnStep]): Steps, declared after the steps they depend on.
+        concurrent (bool): False runs the steps one at a time in declaration order.
+
+    Returns:
+        dict[str, Any]: Result of every step, keyed by name.
+    """
+    _validate(steps)
+
+    results: dict[str, Any] = {}
+    errors: dict[str, BaseException] = {}
+    skipped: list[str] = []
+
+    async def run(step: TurnStep, dependencies: list[asyncio.Task]) -> None:
+        if dependencies:
+            await asyncio.wait(dependencies)
+        if any(name in errors or name in skipped for name in step.after):
+            skipped.append(step.name)
+            return
+        try:
+            results[step.name] = await step.run(results)
+        except Exception as e:
+            errors[step.name] = e
+
+    if concurrent:
+        tasks: dict[str, asyncio.Task] = {}
+        for step in steps:
+            tasks[step.name] = asyncio.create_task(run(step, [tasks[name] for name in step.after]))
+        await asyncio.gather(*tasks.values())
+    else:
+        for step in steps:
+            await run(step, [])
+
+    if errors:
+        raise TurnStepsError(errors=errors, results=results, skipped=skipped)
+    return results
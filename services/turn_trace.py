@@ -0,0 +1,179 @@
+import uuid
+from uuid import UUID
+from typing import Any, AsyncIterator
+from datetime import datetime
+from contextlib import asynccontextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langgraph.errors import GraphBubbleUp
+
+from services.utils import cal_duration_ms, now_vietnam_time
+
+SERVICE_NAME = "chatbot_service"
+
+
+def build_stage_span(
+    step_name: str,
+    timestamp_start: datetime,
+    timestamp_end: datetime,
+    status: str,
+    parent_span_id: str,
+    span_id: str | None = None
+) -> dict:
+    """
+    Internal span of one stage of a turn, already linked to its parent.
+    """
+    return {
+        "id": span_id or str(uuid.uuid4()),
+        "parent_span_id": parent_span_id,
+        "timestamp_start": timestamp_start.isoformat(),
+        "timestamp_end": timestamp_end.isoformat(),
+        "duration_ms": cal_duration_ms(timestamp_start=timestamp_start, timestamp_end=timestamp_end),
+        "step_name": step_name,
+        "service_name": SERVICE_NAME,
+        "direction": "internal",
+        "status": status
+    }
+
+
+class TurnTrace:
+    """
+    Child spans of one turn: every pipeline stage, graph node and tool call.
+
+    The main span id is known upfront, so stage spans are created already linked to
+    it through `parent_span_id`, and graph nodes/tools to the stage that ran them.
+    """
+
+    def __init__(self, main_span_id: str | None = None):
+        self.main_span_id = main_span_id or str(uuid.uuid4())
+        self.spans: list[dict] = []
+
+    def add(
+        self,
+        step_name: str,
+        timestamp_start: datetime,
+        timestamp_end: datetime,
+        status: str = "ok",
+        parent_span_id: str | None = None,
+        span_id: str | None = None
+    ) -> dict:
+        span = build_stage_span(
+            step_name=step_name,
+            timestamp_start=timestamp_start,
+            timestamp_end=timestamp_end,
+            status=status,
+            parent_span_id=parent_span_id or self.main_span_id,
+            span_id=span_id
+        )
+        self.spans.append(span)
+        return span
+
+    @asynccontextmanager
+    async def stage(self, step_name: str, parent_span_id: str | None = None) -> AsyncIterator[dict]:
+        """
+        Time a stage. The yielded dict holds the span `id` for children and a `status`
+        the stage can set to "error" without raising; an exception sets it too.
+        """
+        handle = {"id": str(uuid.uuid4()), "status": "ok"}
+        timestamp_start = now_vietnam_time()
+        try:
+            yield handle
+        except BaseException:
+            handle["status"] = "error"
+            raise
+        finally:
+            self.add(
+                step_name=step_name,
+                timestamp_start=timestamp_start,
+                timestamp_end=now_vietnam_time(),
+                status=handle["status"],
+                parent_span_id=parent_span_id,
+                span_id=handle["id"]
+            )
+
+    def callback_handler(self, parent_span_id: str) -> "TraceCallbackHandler":
+        return TraceCallbackHandler(trace=self, parent_span_id=parent_span_id)
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """
+    Per-turn LangChain callback adding a span for each top-level graph node
+    (`graph.supervisor`, `graph.product_agent`, ...) and each tool call
+    (`tool.<name>`), the latter under the node that called it.
+    """
+    run_inline = True
+
+    def __init__(self, trace: TurnTrace, parent_span_id: str):
+        self.trace = trace
+        self.parent_span_id = parent_span_id
+        # run_id -> (step_name, span_id, parent_span_id, timestamp_start)
+        self._open: dict[UUID, tuple[str, str, str, datetime]] = {}
+        # run_id -> parent run_id, to find the node a tool runs under
+        self._parents: dict[UUID, UUID | None] = {}
+
+    def _node_span_id(self, run_id: UUID | None) -> str:
+        while run_id is not None:
+            if run_id in self._open:
+                return self._open[run_id][1]
+            run_id = self._parents.get(run_id)
+        return self.parent_span_id
+
+    def _start(self, run_id: UUID, step_name: str, parent_span_id: str) -> None:
+        self._open[run_id] = (step_name, str(uuid.uuid4()), parent_span_id, now_vietnam_time())
+
+    def _end(self, run_id: UUID, status: str) -> None:
+        self._parents.pop(run_id, None)
+        run = self._open.pop(run_id, None)
+        if run is None:
+            return
+        step_name, span_id, parent_span_id, timestamp_start = run
+        self.trace.add(
+            step_name=step_name,
+            timestamp_start=timestamp_start,
+            timestamp_end=now_vietnam_time(),
+            status=status,
+            parent_span_id=parent_span_id,
+            span_id=span_id
+        )
+
+    def on_chain_start(
+        self,
+        serialized: dict[str, Any] | None,
+        inputs: Any,
+        *,
+        run_id: UUID,
+        parent_run_id: UUID | None = None,
+        metadata: dict[str, Any] | None = None,
+        **kwargs: Any
+    ) -> None:
+        self._parents[run_id] = parent_run_id
+        node = (metadata or {}).get("langgraph_node")
+        checkpoint_ns = (metadata or {}).get("langgraph_checkpoint_ns", "")
+        # Same selection as MetricsCallbackHandler: the node runs of the top-level graph only
+        if node and kwargs.get("name") == node and "|" not in checkpoint_ns:
+            self._start(run_id, f"graph.{node}", self.parent_span_id)
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, "ok")
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, "ok" if isinstance(error, GraphBubbleUp) else "error")
+
+    def on_tool_start(
+        self,
+        serialized: dict[str, Any] | None,
+        input_str: str,
+        *,
+        run_id: UUID,
+        parent_run_id: UUID | None = None,
+        **kwargs: Any
+    ) -> None:
+        name = kwargs.get("name") or (serialized or {}).get("name", "unknown")
+        self._parents[run_id] = parent_run_id
+        self._start(run_id, f"tool.{name}", self._node_span_id(parent_run_id))
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, "ok")
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, "error")
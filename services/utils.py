@@ -5,7 +5,7 @@ from typing import Optional
 from zoneinfo import ZoneInfo
 from langgraph.graph import StateGraph
 from datetime import datetime, timezone
-from langchain_core.messages import AIMessage
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
 from core.graph.state import AgentState
 from database.connection import supabase_client
 
@@ -14,44 +14,85 @@ from log.logger_config import setup_logging
 logger = setup_logging(__name__)
 
 
-async def stream_messages(events: Any, thread_id: str):
+# Nodes whose LLM tokens are forwarded to the client; the supervisor only routes
+STREAMED_AGENT_NODES = ("product_agent", "order_agent", "modify_order_agent")
+
+
+def sse_event(data: dict | str) -> str:
+    """
+    Format one SSE frame.
+    """
+    if not isinstance(data, str):
+        data = json.dumps(data, ensure_ascii=False)
+    return f"data: {data}\n\n"
+
+
+def _top_level_node(namespace: tuple[str, ...], metadata: dict | None = None) -> str | None:
+    # Subgraph namespaces look like ("product_agent:<task_id>", "agent:<task_id>")
+    if namespace:
+        return namespace[0].split(":")[0]
+    return metadata.get("langgraph_node") if metadata else None
+
+
+def _update_messages(update: Any) -> list:
+    # A node update is either a dict or, for tool nodes returning Commands, a list of dicts
+    updates = update if isinstance(update, list) else [update]
+    messages = []
+    for item in updates:
+        if isinstance(item, dict):
+            messages.extend(item.get("messages", []) or [])
+    return messages
+
+
+async def stream_messages(events: Any, thread_id: str, outcome: dict | None = None):
     """
     Chuyển đổi luồng sự kiện từ graph thành SSE để client nhận theo thời gian thực.
 
+    `events` là kết quả của `graph.astream(..., stream_mode=["messages", "updates"], subgraphs=True)`.
+    Các frame gửi đi:
+        - `{"type": "route", "next": ...}` khi supervisor chọn agent.
+        - `{"type": "tool_start" | "tool_end", "name": ...}` khi agent gọi tool.
+        - `{"type": "token", "node": ..., "content": ...}` cho từng token LLM của agent.
+        - `{"error": ..., "thread_id": ...}` nếu có lỗi.
+
     Args:
         events (Any): Async iterator sự kiện từ graph.astream.
         thread_id (str): Định danh luồng hội thoại.
+        outcome (dict | None): Nếu truyền vào, lỗi (nếu có) được ghi vào key `error`.
 
     Yields:
         str: Chuỗi SSE dạng `data: {...}\n\n`.
     """
-    last_printed = None
-    closed = False
-
     try:
-        async for data in events:
-            for key, value in data.items():
-                    messages = value.get("messages", [])
-                    if not messages:
+        async for namespace, mode, chunk in events:
+            if mode == "messages":
+                message, metadata = chunk
+                node = _top_level_node(namespace, metadata)
+                if (
+                    node in STREAMED_AGENT_NODES
+                    and isinstance(message, AIMessageChunk)
+                    and isinstance(message.content, str)
+                    and message.content
+                ):
+                    yield sse_event({"type": "token", "node": node, "content": message.content})
+
+            elif mode == "updates":
+                for key, value in chunk.items():
+                    if not namespace and key == "supervisor" and isinstance(value, dict):
+                        yield sse_event({"type": "route", "next": value.get("next")})
                         continue
 
-                    last_msg = messages[-1]
-                    if isinstance(last_msg, AIMessage):
-                        content = last_msg.content.strip()
-                        if content and content != last_printed:
-                            last_printed = content
-                            msg = {"content": content}
-                            yield f"data: {json.dumps(msg, ensure_ascii=False)}\n\n"
-                            await asyncio.sleep(0.01)  # slight delay for smoother streaming
-    except GeneratorExit:
-        closed = True
-        raise
+                    for message in _update_messages(value):
+                        if isinstance(message, AIMessage):
+                            for tool_call in message.tool_calls:
+                                yield sse_event({"type": "tool_start", "name": tool_call["name"]})
+                        elif isinstance(message, ToolMessage):
+                            yield sse_event({"type": "tool_end", "name": message.name})
+
     except Exception as e:
-        error_dict = {"error": str(e), "thread_id": thread_id}
-        yield f"data: {json.dumps(error_dict, ensure_ascii=False)}\n\n"
-    finally:
-        if not closed:
-            yield "data: [DONE]\n\n"
+        if outcome is not None:
+            outcome["error"] = str(e)
+        yield sse_event({"error": str(e), "thread_id": thread_id})
 
 async def check_state(config: dict, graph: StateGraph) -> AgentState:
     state = graph.get_state(config).values
@@ -4,15 +4,36 @@ import httpx
 import asyncio
 import traceback
 from zoneinfo import ZoneInfo
+from typing import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
 from langgraph.graph import StateGraph
 from schemas.response import ChatResponse
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from dataclasses import dataclass, field
 from datetime import timedelta, datetime, timezone
 
 from schemas.response import ResponseModel
 from core.graph.state import AgentState, init_state
-from services.utils import cal_duration_ms, now_vietnam_time
+from core.graph.checkpointer import CHECKPOINT_DURABLE
+from services.utils import cal_duration_ms, now_vietnam_time, sse_event, stream_messages
+from services.chat_lock import chat_lock
+from services.metrics import BOT_RESPONSES
+from repository.cache import control_mode_cache, customer_cache
+from services.idempotency import extract_message_id, idempotency_store
+from services.mailbox import MailboxMessage, chat_mailbox
+from services.worker_pool import worker_pool
+from services.write_behind import WriteBehindError, write_behind
+from services.callback_client import callback_client
+from services.callback_outbox import callback_outbox
+from services.session_sweeper import session_sweeper
+from services.turn_executor import TURN_PARALLEL_STEPS, TurnStep, TurnStepsError, run_turn_steps
+from services.turn_trace import TurnTrace
+from repository.span_index import span_index
+from repository.state_delta import build_state_delta, detach_state
 from repository.async_repo import (
+    build_event,
+    build_state_payload,
+    build_state_delta_row,
     AsyncProductRepo,
     AsyncCustomerRepo, 
     AsyncEventRepo, 
@@ -26,13 +47,45 @@ from dotenv import load_dotenv
 load_dotenv()
 logger = setup_logging(__name__)
 
-CALLBACK_URL = os.getenv("CALLBACK_URL")
 N_DAYS = int(os.getenv("N_DAYS"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 8))
+# Resolve customer + session with the `resolve_customer_session` RPC (one round trip)
+# instead of 3-5 sequential PostgREST calls; requires database/migrations/001_*.sql
+RESOLVE_SESSION_RPC = os.getenv("RESOLVE_SESSION_RPC", "false").lower() == "true"
 
 # ----------------------------------------------------------------
 # Handle chat functions
 # ----------------------------------------------------------------
 
+def link_message_spans(message_spans: list[dict], latest_span: dict | None) -> None:
+    """
+    Point the main span of a turn at the previous bot reply and compute the customer's response time.
+    """
+    latest_span = latest_span or {"span_id": None, "span_end_ts": None}
+    
+    response_duration_ms = None
+    if latest_span["span_end_ts"] is not None:
+        response_duration_ms = cal_duration_ms(
+            timestamp_start=datetime.fromisoformat(latest_span["span_end_ts"]),
+            timestamp_end=datetime.fromisoformat(message_spans[0]["timestamp_start"])
+        )
+    
+    message_spans[0].update({
+        "response_to_span_id": latest_span["span_id"],
+        "response_duration_ms": response_duration_ms
+    })
+
+
+@dataclass
+class BatchWrites:
+    """
+    Events and message spans of the items of one batch request, written with one
+    bulk insert each once every item ran.
+    """
+    events: list[dict] = field(default_factory=list)
+    message_spans: list[dict] = field(default_factory=list)
+
+
 class ChatbotService:
     def __init__(
         self,
@@ -47,6 +100,72 @@ class ChatbotService:
         self.async_session_repo = session_repo
         self.async_event_repo = event_repo
         self.async_message_repo = message_repo
+        self.resolve_session_rpc = RESOLVE_SESSION_RPC
+        self.parallel_steps = TURN_PARALLEL_STEPS
+        
+    def _prepare_state(
+        self,
+        user_input: str,
+        chat_id: str,
+        customer: dict,
+        resume: bool = False
+    ) -> AgentState:
+        """
+        Nạp state của phiên hiện tại và cập nhật thông tin khách cho lượt chat mới.
+        With `resume`, the graph resumes the session's thread from its checkpoint and
+        only gets the fields of the new turn.
+        """
+        if resume:
+            state = {}
+        else:
+            state: AgentState = customer["sessions"][0]["state_base64"]
+            # The loaded state stays untouched, the turn's delta is computed against it
+            state = detach_state(state) if state else init_state()
+
+        state["user_input"] = user_input
+        state["chat_id"] = chat_id
+        
+        state["customer_id"] = customer["id"]
+        state["name"] = customer["name"]
+        state["phone_number"] = customer["phone_number"]
+        state["address"] = customer["address"]
+        state["email"] = customer["email"]
+        state["session_id"] = customer["sessions"][0]["id"]
+        
+        return state
+    
+    async def _resumes_thread(self, graph: StateGraph, config: dict) -> bool:
+        """
+        Whether the turn resumes its thread's checkpoint. Sessions started before durable
+        checkpoints have none yet, their first turn is loaded from the session row.
+        """
+        return CHECKPOINT_DURABLE and await graph.checkpointer.aget_tuple(config) is not None
+
+    async def _delete_closed_thread(self, graph: StateGraph | None, thread_id: str | None) -> None:
+        """
+        With `CHECKPOINT_DURABLE` the thread holds the state of its session, once the
+        session is closed or its customer deleted the thread is never resumed again.
+        """
+        if CHECKPOINT_DURABLE and graph is not None and thread_id:
+            await graph.checkpointer.adelete_thread(thread_id)
+            await logger.info(f"Delete checkpoints of closed thread: {thread_id}")
+
+    @asynccontextmanager
+    async def _hold_chat(self, chat_id: str) -> AsyncIterator[None]:
+        """
+        Serialize turns of one chat across every worker process of the node.
+        The chat's queued writes are flushed before the lock is released: the next
+        turn may run in another process, whose barrier only sees its own queue.
+        """
+        async with chat_lock.hold(chat_id):
+            try:
+                yield
+            finally:
+                if write_behind.active:
+                    try:
+                        await write_behind.barrier(chat_id)
+                    except WriteBehindError as e:
+                        await logger.error(f"Chat ID: {chat_id} | {e}, the next turn may read a stale state")
         
     async def handle_normal_chat(
         self,
@@ -69,21 +188,15 @@ class ChatbotService:
             tuple[Any, str] | tuple[None, None]: Cặp (events, thread_id) hoặc (None, None) nếu lỗi.
         """
         try:
-            state: AgentState = customer["sessions"][0]["state_base64"]
-            if not state:
-                state = init_state()
-
-            state["user_input"] = user_input
-            state["chat_id"] = chat_id
-            
-            state["customer_id"] = customer["id"]
-            state["name"] = customer["name"]
-            state["phone_number"] = customer["phone_number"]
-            state["address"] = customer["address"]
-            state["email"] = customer["email"]
-            state["session_id"] = customer["sessions"][0]["id"]
+            state = self._prepare_state(
+                user_input=user_input,
+                chat_id=chat_id,
+                customer=customer,
+                resume=await self._resumes_thread(graph=graph, config=config)
+            )
 
-            result = await graph.ainvoke(state, config=config)
+            # Checkpoint once at the end of the run, not after every node
+            result = await graph.ainvoke(state, config=config, durability="exit")
             data = result["messages"][-1].content
 
             return ResponseModel(
@@ -103,7 +216,8 @@ class ChatbotService:
     async def handle_new_chat(
         self,
         customer: dict,
-        new_customer_flag: bool
+        new_customer_flag: bool,
+        graph: StateGraph | None = None
     ) -> ResponseModel:
         try:
             if new_customer_flag is False:
@@ -130,6 +244,7 @@ class ChatbotService:
                         error="Lỗi không thể cập nhật thread_id"
                     )
                 await logger.info(f"Close session successfully id: {end_session["id"]}")
+                await self._delete_closed_thread(graph=graph, thread_id=session["thread_id"])
                 await logger.info(f"Cập nhật thread_id của khách: {customer["id"]} là {thread_id}")
             else:
                 await logger.info("New customer -> no need to update thread_id")
@@ -159,10 +274,13 @@ class ChatbotService:
             
     async def handle_delete_me(
         self,
-        customer_id: int
+        customer_id: int,
+        thread_id: str | None = None,
+        graph: StateGraph | None = None
     ) -> ResponseModel:
         try:
             deleted_customer = await self.async_customer_repo.delete_customer(customer_id=customer_id)
+            span_index.invalidate(customer_id)
 
             if not deleted_customer:
                 await logger.error(f"Lỗi ở cấp DB -> Không xóa khách với id: {customer_id}")
@@ -173,6 +291,7 @@ class ChatbotService:
                 
             else:
                 await logger.info(f"Xóa thành công khách với id: {customer_id}")
+                await self._delete_closed_thread(graph=graph, thread_id=thread_id)
 
                 response = (
                     "Dev only: Đã xóa thành công khách hàng khỏi hệ thống."
@@ -197,53 +316,104 @@ class ChatbotService:
     # Helper functions
     # ----------------------------------------------------------------
 
-    async def _handle_message_spans(
+    def _prepare_message_spans(
         self,
         session_id: int,
         customer_id: int,
         message_spans: list[dict]
-    ) -> bool:
-        main_span_id = str(uuid.uuid4())
-        
-        # Get the last outbound span_id from DB
-        await logger.info("Get the latest event and bot span from DB")
-        latest_span = await self.async_message_repo.get_latest_event_and_bot_span(
-            customer_id=customer_id
-        )
-        
-        response_duration_ms = None
-        if latest_span["span_end_ts"] is not None:
-            response_duration_ms = cal_duration_ms(
-                timestamp_start=datetime.fromisoformat(latest_span["span_end_ts"]),
-                timestamp_end=datetime.fromisoformat(message_spans[0]["timestamp_start"])
-            )
-        
-        await logger.info(f"Customer id: {customer_id} | Latest span: {latest_span} | Response duration ms: {response_duration_ms}")
+    ) -> list[dict]:
+        """
+        Give every span an id and attach the spans after the first one to it.
+        Spans already linked to a parent (the stages of a `TurnTrace`) keep their id and parent.
+        """
+        main_span_id = message_spans[0].get("id") or str(uuid.uuid4())
         
-        # Config the main span
         message_spans[0].update({
             "id": main_span_id,
             "session_id": session_id,
             "parent_span_id": None,
-            "customer_id": customer_id,
-            "response_to_span_id": latest_span["span_id"],
-            "response_duration_ms": response_duration_ms
+            "customer_id": customer_id
         })
         
         for span in message_spans[1:]:
+            if not span.get("parent_span_id"):
+                span.update({
+                    "id": str(uuid.uuid4()),
+                    "parent_span_id": main_span_id
+                })
             span.update({
-                "id": str(uuid.uuid4()),
                 "session_id": session_id,
-                "parent_span_id": main_span_id,
                 "customer_id": customer_id
             })
+        
+        return message_spans
+
+    async def _handle_message_spans(
+        self,
+        session_id: int,
+        customer_id: int,
+        message_spans: list[dict],
+        batch: BatchWrites | None = None
+    ) -> bool:
+        message_spans = self._prepare_message_spans(
+            session_id=session_id,
+            customer_id=customer_id,
+            message_spans=message_spans
+        )
+        
+        # Last bot reply from the in-process index, the DB is only read on a miss
+        latest_span = await span_index.get(
+            customer_id=customer_id,
+            session_id=session_id,
+            message_repo=self.async_message_repo
+        )
+        link_message_spans(message_spans=message_spans, latest_span=latest_span)
+        
+        await logger.info(f"Customer id: {customer_id} | Latest span: {latest_span} | Response duration ms: {message_spans[0]["response_duration_ms"]}")
+        
+        if write_behind.active:
+            span_index.record(customer_id=customer_id, session_id=session_id, message_spans=message_spans)
+            write_behind.insert("message_spans", message_spans, key=str(session_id))
+            return True
+        
+        if batch is not None:
+            # Recorded right away, the next item of the same chat links to this reply
+            span_index.record(customer_id=customer_id, session_id=session_id, message_spans=message_spans)
+            batch.message_spans.extend(message_spans)
+            return True
             
         created_spans = await self.async_message_repo.create_message_span_bulk(
             message_spans=message_spans
         )
+        if created_spans:
+            span_index.record(customer_id=customer_id, session_id=session_id, message_spans=message_spans)
         
         return True if created_spans else False
 
+    def _build_direct_spans(
+        self,
+        timestamp_start: datetime,
+        timestamp_end: datetime,
+        duration_ms: float,
+        status: str
+    ) -> list[dict]:
+        """
+        Build the inbound/outbound span pair of a direct (non-webhook) chat turn.
+        The inbound span is always `ok`, `status` applies to the outbound span.
+        """
+        return [
+            {
+                "timestamp_start": timestamp_start.isoformat(),
+                "timestamp_end": timestamp_end.isoformat(),
+                "duration_ms": duration_ms,
+                "step_name": "chatbot_process",
+                "service_name": "chatbot_service",
+                "direction": direction,
+                "status": span_status
+            }
+            for direction, span_status in (("inbound", "ok"), ("outbound", status))
+        ]
+
     async def send_to_callback(
         self,
         text: str, 
@@ -253,12 +423,17 @@ class ChatbotService:
         message_spans: list[dict] = [],
         session_id: int = None,
         customer_id: int = None,
+        trace: TurnTrace | None = None,
+        persist: Callable[[], Awaitable[None]] | None = None
     ):
         """
         Gửi response data đến webhook URL
         Args:
             text (str): Nội dung tin nhắn
             chat_id (str): ID của chat
+            trace (TurnTrace | None): Stage spans of the turn, created with the turn's spans.
+            persist (Callable | None): Event and state writes of the turn, run alongside the
+                delivery; a failure there is logged, the reply is still sent.
         """
         try:
             timestamp_end = now_vietnam_time()
@@ -275,49 +450,108 @@ class ChatbotService:
                 "direction": "internal",
                 "status": status
             }]
+            trace = trace or TurnTrace(main_span_id=message_spans[0].get("id"))
+            message_spans[0]["id"] = trace.main_span_id
             
             payload = {
                 "chat_id": chat_id,
                 "response": text
             }
             
-            timeout = httpx.Timeout(30.0)  # thiết lập timeout 30 giây
-            async with httpx.AsyncClient(timeout=timeout) as client:
+            async def persist_turn(_: dict) -> None:
                 try:
-                    response = await client.post(
-                        CALLBACK_URL,
-                        json=payload,
-                        headers={"Content-Type": "application/json"},
-                    )
-                    
-                    data = response.json()
-                    if response.status_code == 200:
-                        await logger.info(f"Scucessfully sent response to webhook for chat_id: {chat_id}")
-                    else:
-                        await logger.error(f"Error sending to webhook. Status: {response.status_code}, chat_id: {chat_id}, detail: {data["detail"]}")
-                    
-                except httpx.RequestError as exc:
-                    await logger.error(f"An error occurred: {exc}")
-                except httpx.HTTPStatusError as exc:
-                    await logger.error(f"Non-success status: {exc.response.status_code}")
+                    await persist()
+                except Exception as e:
+                    await logger.error(f"Reply sent but the turn was not fully recorded: {e}")
             
-            message_spans += [data["message_span"]]
-            check_create_spans = await self._handle_message_spans(
-                session_id=session_id,
-                customer_id=customer_id,
-                message_spans=message_spans
-            )
+            if callback_outbox.active:
+                # The persist stage runs first so that its span is part of the context,
+                # the reply is delivered by the outbox dispatcher and the spans are
+                # recorded once it settles
+                if persist:
+                    await persist_turn({})
+                await callback_outbox.enqueue(
+                    chat_id=chat_id,
+                    payload=payload,
+                    context={
+                        "session_id": session_id,
+                        "customer_id": customer_id,
+                        "message_spans": message_spans + trace.spans
+                    }
+                )
+                await logger.info(f"Queued response in the callback outbox for chat_id: {chat_id}")
+                return
             
-            if not check_create_spans:
-                await logger.error("Error in DB -> Cannot create message spans")
-                raise Exception("Error in DB -> Cannot create message spans")
-            await logger.info("Create message spans successfully")
+            async def post_reply(_: dict) -> dict | None:
+                async with trace.stage("callback") as stage:
+                    stage["status"] = "error"
+                    try:
+                        response = await callback_client.post(payload)
+                        
+                        data = response.json()
+                        if response.status_code == 200:
+                            await logger.info(f"Scucessfully sent response to webhook for chat_id: {chat_id}")
+                            stage["status"] = "ok"
+                            return data
+                        await logger.error(f"Error sending to webhook. Status: {response.status_code}, chat_id: {chat_id}, detail: {data.get("detail")}")
+                        
+                    except httpx.RequestError as exc:
+                        await logger.error(f"An error occurred: {exc}")
+                    except ValueError as exc:
+                        await logger.error(f"Invalid webhook response for chat_id: {chat_id}: {exc}")
+                    return None
+            
+            async def write_spans(results: dict) -> None:
+                # One insert for the whole turn: gateway spans, stages and delivery span
+                await self.record_callback_spans(
+                    session_id=session_id,
+                    customer_id=customer_id,
+                    message_spans=message_spans + trace.spans,
+                    response_data=results["post_reply"]
+                )
+            
+            # The reply does not wait for the event and state writes of the turn
+            steps = [TurnStep("post_reply", post_reply)]
+            if persist:
+                steps.append(TurnStep("persist", persist_turn))
+            steps.append(TurnStep("write_spans", write_spans, after=tuple(step.name for step in steps)))
+            await run_turn_steps(steps, concurrent=self.parallel_steps)
             
         except Exception as e:
             error_details = traceback.format_exc()
             await logger.error(f"Exception: {e}")
             await logger.error(f"Chi tiết lỗi: \n{error_details}")
         
+    async def record_callback_spans(
+        self,
+        session_id: int,
+        customer_id: int,
+        message_spans: list[dict],
+        response_data: dict | None
+    ) -> None:
+        """
+        Create the spans of a turn once its reply was delivered, or given up on.
+        The gateway's delivery span is only there when the callback succeeded.
+        """
+        if customer_id is None:
+            # The turn failed before its customer was resolved, there is no session to attach them to
+            await logger.warning(f"No customer for the turn, {len(message_spans)} message spans dropped")
+            return
+        
+        if response_data and response_data.get("message_span"):
+            message_spans = message_spans + [response_data["message_span"]]
+        
+        check_create_spans = await self._handle_message_spans(
+            session_id=session_id,
+            customer_id=customer_id,
+            message_spans=message_spans
+        )
+        
+        if not check_create_spans:
+            await logger.error("Error in DB -> Cannot create message spans")
+            raise Exception("Error in DB -> Cannot create message spans")
+        await logger.info("Create message spans successfully")
+        
     def _is_expired_over_n_days_vn(
         self,
         last_active_at: str, 
@@ -367,29 +601,41 @@ class ChatbotService:
         
         return True
 
-    async def _handle_old_customer(self, customer: dict):
+    async def _handle_old_customer(self, customer: dict, graph: StateGraph | None = None):
         if customer["sessions"]:
             session = customer["sessions"][0]
             last_active_at = session["last_active_at"]
             
-            if self._is_expired_over_n_days_vn(last_active_at=last_active_at):
+            # With the sweeper running, idle sessions are already closed in the background
+            if not session_sweeper.enabled and self._is_expired_over_n_days_vn(last_active_at=last_active_at):
                 await logger.info("Customer last active exceed specify day -> create new session")
                 thread_id = str(uuid.uuid4())
 
-                # Create new session -> end old session -> add new event
-                session_and_event = await self._create_session_and_event(
-                    customer=customer, 
-                    thread_id=thread_id,
-                    event_type="returning_customer"
-                )
-                if not session_and_event:
-                    return None, None
-
-                end_session = await self.async_session_repo.update_end_session(session_id=session["id"])
-                if not end_session:
-                    await logger.error(f"Error in DB -> Cannot close session id: {session["id"]}")
+                async def create_session_and_event(_: dict) -> None:
+                    if not await self._create_session_and_event(
+                        customer=customer, 
+                        thread_id=thread_id,
+                        event_type="returning_customer"
+                    ):
+                        raise Exception("Error in DB -> Cannot create session and event")
+                
+                async def end_session(_: dict) -> None:
+                    ended = await self.async_session_repo.update_end_session(session_id=session["id"])
+                    if not ended:
+                        raise Exception(f"Error in DB -> Cannot close session id: {session["id"]}")
+                    await logger.info(f"Close session successfully id: {ended["id"]}")
+                
+                # Create new session + add new event, then end old session: a failed create
+                # leaves the old session active instead of leaving the customer without one
+                try:
+                    await run_turn_steps([
+                        TurnStep("create_session_and_event", create_session_and_event),
+                        TurnStep("end_session", end_session, after=("create_session_and_event",))
+                    ], concurrent=self.parallel_steps)
+                except TurnStepsError as e:
+                    await logger.error(str(e))
                     return None, None
-                await logger.info(f"Close session successfully id: {end_session["id"]}")
+                await self._delete_closed_thread(graph=graph, thread_id=session["thread_id"])
             else:
                 await logger.info("Customer last active does not exceed specify day -> update last active session")
                 update_session = await self.async_session_repo.update_last_active_session(session_id=session["id"])
@@ -400,17 +646,19 @@ class ChatbotService:
                 thread_id = session["thread_id"]
         else:
             # Trường hợp này sảy ra chỉ khi đã tạo khách thành công nhưng có lỗi trong quá
-            # trình tạo session -> session không tồn tại
+            # trình tạo session -> session không tồn tại, hoặc khi session sweeper đã đóng
+            # session không hoạt động của khách cũ
             thread_id = str(uuid.uuid4())
             session_and_event = await self._create_session_and_event(
                 customer=customer, 
                 thread_id=thread_id,
-                event_type="new_customer"
+                event_type="returning_customer" if session_sweeper.enabled else "new_customer"
             )
             if not session_and_event:
                 return None, None
 
-        customer = await self.async_customer_repo.find_customer(chat_id=customer["chat_id"])
+        # The row was just written by this turn, under the chat lock
+        customer = await self.async_customer_repo.find_customer(chat_id=customer["chat_id"], revalidate=False)
         if not customer:
             await logger.error("Error in DB -> Cannot find customer after create")
             return None, None
@@ -445,17 +693,50 @@ class ChatbotService:
         
         return customer, thread_id
 
+    async def _resolve_customer(
+        self, 
+        chat_id: str,
+        graph: StateGraph | None = None
+    ) -> tuple[None, None, None] | tuple[dict, str, bool]:
+        """
+        Same outcome as the step-by-step path of `_handle_customer`, done server-side in one call.
+        """
+        customer = await self.async_customer_repo.resolve_customer_session(
+            chat_id=chat_id,
+            thread_id=str(uuid.uuid4()),
+            # None: idle sessions are closed by the sweeper, not rotated here
+            n_days=None if session_sweeper.enabled else N_DAYS
+        )
+        if not customer or not customer["sessions"]:
+            await logger.error(f"Error in DB -> Cannot resolve customer session for chat_id: {chat_id}")
+            return None, None, None
+        await self._delete_closed_thread(graph=graph, thread_id=customer.get("closed_thread_id"))
+        
+        thread_id = customer["sessions"][0]["thread_id"]
+        await logger.info(
+            f"Resolved customer id: {customer["id"]} | thread_id: {thread_id} | New customer: {customer["is_new_customer"]}"
+        )
+        
+        return customer, thread_id, customer["is_new_customer"]
+
     async def _handle_customer(
         self, 
-        chat_id: str
+        chat_id: str,
+        graph: StateGraph | None = None
     ) -> tuple[None, None, None] | tuple[dict, str, bool]:
+        # Flushed when the previous turn released the chat, unless that flush failed
+        await write_behind.barrier(chat_id)
+        
+        if self.resolve_session_rpc:
+            return await self._resolve_customer(chat_id=chat_id, graph=graph)
+        
         customer = await self.async_customer_repo.find_customer(chat_id=chat_id)
         new_customer_flag = False
             
         if customer:
             await logger.info(f"Customer exist id: {customer["id"]}")
             
-            customer, thread_id = await self._handle_old_customer(customer=customer)
+            customer, thread_id = await self._handle_old_customer(customer=customer, graph=graph)
             await logger.info(f"Handle old customer id: {customer["id"]} | thread_id: {thread_id}")
         else:
             # Customer is new -> create customer and add event
@@ -476,142 +757,372 @@ class ChatbotService:
         graph: StateGraph,
         config: dict,
         thread_id: str,
-        event_type: str = "bot_response_success"
+        event_type: str = "bot_response_success",
+        batch: BatchWrites | None = None
     ):
-        # Create event chatbot response successfully
-        event = await self.async_event_repo.create_event(
-            customer_id=customer["id"],
-            session_id=customer["sessions"][0]["id"],
-            event_type=event_type
-        )
-        if not event:
-            await logger.error("Error in DB -> Cannot add event record")
-        await logger.info(f"Add event bot_response_success successfully id: {event["id"]}")
-        
-        # Update state to session table
-        session = await self.async_session_repo.update_state_session(
-            state=graph.get_state(config).values,
-            session_id=customer["sessions"][0]["id"],
-        )
-        if not session:
-            await logger.error("Error in DB -> Cannot update state in session record")
-        await logger.info(f"Update state to session record successfully id: {session["id"]}")
+        BOT_RESPONSES.inc(event_type=event_type)
         
-        # Delete the state in graph
-        graph.checkpointer.delete_thread(thread_id)
+        if write_behind.active:
+            # Queued: the reply does not wait for the DB, the next turn of the
+            # chat flushes them first (see `_handle_customer`)
+            write_behind.insert(
+                "events",
+                [build_event(
+                    customer_id=customer["id"],
+                    session_id=customer["sessions"][0]["id"],
+                    event_type=event_type
+                )],
+                key=customer["chat_id"]
+            )
+            if CHECKPOINT_DURABLE:
+                # The session state stays in the checkpointer for the next turn
+                await graph.checkpointer.aprune(thread_id)
+                return
+            
+            try:
+                session = customer["sessions"][0]
+                state = (await graph.aget_state(config)).values
+                delta = build_state_delta(
+                    base=session["state_base64"],
+                    state=state,
+                    delta_count=session.get("state_delta_count", 0)
+                )
+                if delta is None:
+                    payload = build_state_payload(state=state)
+                    write_behind.update(
+                        "sessions",
+                        row_id=session["id"],
+                        payload=payload,
+                        key=customer["chat_id"]
+                    )
+                    customer_cache.set_state(
+                        session["id"],
+                        state,
+                        encoded_size=len(payload["state_base64"]),
+                        delta_count=0
+                    )
+                else:
+                    write_behind.insert(
+                        "session_state_deltas",
+                        [build_state_delta_row(session_id=session["id"], delta=delta)],
+                        key=customer["chat_id"]
+                    )
+                    customer_cache.set_state(session["id"], state, delta_count=delta["seq"])
+            finally:
+                # The thread only lived for this turn, failed or not
+                await graph.checkpointer.adelete_thread(thread_id)
+            return
         
-    async def _process_webhook_message(
+        async def create_event(_: dict) -> dict:
+            if batch is not None:
+                event = build_event(
+                    customer_id=customer["id"],
+                    session_id=customer["sessions"][0]["id"],
+                    event_type=event_type
+                )
+                batch.events.append(event)
+                return event
+            
+            # Create event chatbot response successfully
+            event = await self.async_event_repo.create_event(
+                customer_id=customer["id"],
+                session_id=customer["sessions"][0]["id"],
+                event_type=event_type
+            )
+            if not event:
+                raise Exception("Error in DB -> Cannot add event record")
+            await logger.info(f"Add event {event_type} successfully id: {event["id"]}")
+            return event
+        
+        if CHECKPOINT_DURABLE:
+            async def prune_thread(_: dict) -> None:
+                # The session state stays in the checkpointer, only its latest checkpoint is needed
+                await graph.checkpointer.aprune(thread_id)
+            
+            await run_turn_steps([
+                TurnStep("create_event", create_event),
+                TurnStep("prune_thread", prune_thread)
+            ], concurrent=self.parallel_steps)
+            return
+        
+        async def read_state(_: dict) -> dict:
+            return (await graph.aget_state(config)).values
+        
+        async def save_state(results: dict) -> None:
+            # Append the turn's delta, or rewrite the session's state snapshot
+            saved = await self.async_session_repo.save_state(
+                session=customer["sessions"][0],
+                state=results["read_state"]
+            )
+            if not saved:
+                raise Exception("Error in DB -> Cannot update state in session record")
+            await logger.info(f"Update state to session record successfully id: {customer["sessions"][0]["id"]}")
+        
+        # The event and the state are independent writes
+        try:
+            await run_turn_steps([
+                TurnStep("create_event", create_event),
+                TurnStep("read_state", read_state),
+                TurnStep("save_state", save_state, after=("read_state",))
+            ], concurrent=self.parallel_steps)
+        finally:
+            # Delete the state in graph, also when a step failed: the thread only lived for this turn
+            await graph.checkpointer.adelete_thread(thread_id)
+        
+    async def _run_turn_stages(
         self,
-        chat_id: str, 
-        user_input: str, 
+        turn: dict,
+        user_input: str,
         graph: StateGraph,
-        timestamp_start: datetime = None,
-        message_spans: list[dict] = None,
-    ):
-        messages = None
-        try:
-            customer, thread_id, new_customer_flag = await self._handle_customer(chat_id=chat_id)
+        trace: TurnTrace
+    ) -> bool:
+        """
+        Stages shared by the webhook and invoke flows, each recorded as a child span of
+        the turn's main span:
+
+        - `resolve_customer`: admin checks, customer and session lookup or creation;
+        - `respond`: the command or the graph, whose nodes (supervisor, agents) and
+          tool calls get their own spans under it.
+
+        `turn` is filled as the stages go (`customer`, `thread_id`, `config`, `messages`),
+        so that the error path knows how far the turn got.
+
+        Returns:
+            bool: False when the chat is under admin control and the bot stays silent.
+        """
+        chat_id = turn["chat_id"]
+        
+        async with trace.stage("resolve_customer"):
+            # Taken over while the message was waiting in the mailbox
+            if control_mode_cache.is_admin(chat_id):
+                await logger.info(f"Customer {chat_id} is under ADMIN control (cached). Skipping bot response.")
+                return False
+            
+            customer, thread_id, new_customer_flag = await self._handle_customer(chat_id=chat_id, graph=graph)
             if not customer or not thread_id:
                 await logger.error("Not found customer or thread_id")
                 raise Exception("Not found customer or thread_id")
+            turn.update({
+                "customer": customer,
+                "thread_id": thread_id,
+                "config": {"configurable": {"thread_id": thread_id}}
+            })
             
             if customer["control_mode"] == "ADMIN":
                 await logger.info(f"Customer {chat_id} is under ADMIN control. Skipping bot response.")
-                return
-            
-            config = {"configurable": {"thread_id": thread_id}}
-
-            await logger.info(f"Tin nhắn của khách: {user_input}")
-
+                return False
+        
+        await logger.info(f"Tin nhắn của khách: {user_input}")
+        
+        async with trace.stage("respond") as stage:
             if any(cmd in user_input for cmd in ["/start", "/restart"]):
                 messages = await self.handle_new_chat(
                     customer=customer,
-                    new_customer_flag=new_customer_flag
+                    new_customer_flag=new_customer_flag,
+                    graph=graph
                 )
 
                 if not messages["error"]:
                     await logger.info("Create new chat session successfully")
 
             elif user_input == "/delete_me":
-                messages = await self.handle_delete_me(customer_id=customer["id"])
+                messages = await self.handle_delete_me(
+                    customer_id=customer["id"],
+                    thread_id=thread_id,
+                    graph=graph
+                )
 
                 if not messages["error"]:
                     await logger.info("Delete new customer in DB successfully")
             else:
+                turn["normal_chat"] = True
                 messages = await self.handle_normal_chat(
                     user_input=user_input,
                     chat_id=chat_id,
                     customer=customer,
-                    config=config,
+                    config={**turn["config"], "callbacks": [trace.callback_handler(parent_span_id=stage["id"])]},
                     graph=graph
                 )
+            
+            if messages["error"]:
+                stage["status"] = "error"
+            turn["messages"] = messages
+        
+        return True
 
-                if messages["error"]:
-                    await logger.error("Error in processing chat -> add event")
-                    event_type = "bot_response_failure"
-                else:
-                    await logger.info("Chat process successfully -> add event")
-                    event_type = "bot_response_success"
-
-                await self._handle_final_process(
-                    customer=customer,
-                    graph=graph,
-                    config=config,
-                    thread_id=thread_id,
-                    event_type=event_type
-                )
+    async def _persist_turn(
+        self,
+        turn: dict,
+        graph: StateGraph,
+        trace: TurnTrace
+    ) -> None:
+        """
+        `persist` stage: event and state writes of a graph turn, commands have none.
+        """
+        if not turn.get("normal_chat"):
+            return
+        
+        async with trace.stage("persist"):
+            await self._handle_final_process(
+                customer=turn["customer"],
+                graph=graph,
+                config=turn["config"],
+                thread_id=turn["thread_id"],
+                event_type="bot_response_failure" if turn["messages"]["error"] else "bot_response_success",
+                batch=turn.get("batch")
+            )
+        
+    async def _process_webhook_message(
+        self,
+        chat_id: str, 
+        user_input: str, 
+        graph: StateGraph,
+        timestamp_start: datetime = None,
+        message_spans: list[dict] = None,
+    ):
+        trace = TurnTrace()
+        if message_spans:
+            # Without gateway spans, `send_to_callback` makes its own span the main one
+            message_spans[0]["id"] = trace.main_span_id
+        turn = {"chat_id": chat_id, "customer": None}
+        try:
+            if not await self._run_turn_stages(turn=turn, user_input=user_input, graph=graph, trace=trace):
+                return
             
-            if messages:
-                if messages["error"]:
-                    await logger.error(f"Error in processing chat: {messages['error']}")
-                    raise Exception(messages["error"])
-                else:
-                    await self.send_to_callback(
-                        text=messages["content"], 
-                        chat_id=chat_id,
-                        status="ok",
-                        timestamp_start=timestamp_start,
-                        message_spans=message_spans,
-                        session_id=customer["sessions"][0]["id"],
-                        customer_id=customer["id"]
-                    )
-                    await logger.info(f"Send to webhook: {messages}")
-            else:
-                await logger.error("Messages is None")
-                raise Exception("Messages is None")
-                
+            messages = turn["messages"]
+            if messages["error"]:
+                await logger.error("Chat process failed -> add event")
+                await self._persist_turn(turn=turn, graph=graph, trace=trace)
+                await logger.error(f"Error in processing chat: {messages['error']}")
+                raise Exception(messages["error"])
+            
+            await logger.info("Chat process successfully -> add event and send reply")
+            await self.send_to_callback(
+                text=messages["content"], 
+                chat_id=chat_id,
+                status="ok",
+                timestamp_start=timestamp_start,
+                message_spans=message_spans,
+                session_id=turn["customer"]["sessions"][0]["id"],
+                customer_id=turn["customer"]["id"],
+                trace=trace,
+                persist=lambda: self._persist_turn(turn=turn, graph=graph, trace=trace)
+            )
+            await logger.info(f"Send to webhook: {messages}")
             
         except Exception as e:
             error_details = traceback.format_exc()
             await logger.error(f"Exception: {e}")
             await logger.error(f"Chi tiết lỗi: \n{error_details}")
             
+            customer = turn["customer"]
             await self.send_to_callback(
                 text="Lỗi server, xin vui lòng thử lại sau", 
                 chat_id=chat_id,
                 status="error",
                 timestamp_start=timestamp_start,
                 message_spans=message_spans,
-                session_id=customer["sessions"][0]["id"],
-                customer_id=customer["id"]
+                session_id=customer["sessions"][0]["id"] if customer else None,
+                customer_id=customer["id"] if customer else None,
+                trace=trace
             )
             
     async def _process_invoke_message(
+        self,
+        chat_id: str, 
+        user_input: str, 
+        graph: StateGraph,
+        timestamp_start: datetime = None,
+        batch: BatchWrites | None = None
+    ):
+        trace = TurnTrace()
+        turn = {"chat_id": chat_id, "customer": None, "batch": batch}
+        timestamp_start = timestamp_start if timestamp_start else now_vietnam_time()
+        try:
+            if not await self._run_turn_stages(turn=turn, user_input=user_input, graph=graph, trace=trace):
+                return
+            
+            messages = turn["messages"]
+            if messages["error"]:
+                await logger.error("Chat process failed -> add event")
+            else:
+                await logger.info("Chat process successfully -> add event and create spans")
+            await self._persist_turn(turn=turn, graph=graph, trace=trace)
+            
+            if messages["error"]:
+                await logger.error(f"Error in processing chat: {messages['error']}")
+                raise Exception(messages["error"])
+            
+            status, content = "ok", messages["content"]
+            
+        except Exception as e:
+            error_details = traceback.format_exc()
+            await logger.error(f"Exception: {e}")
+            await logger.error(f"Chi tiết lỗi: \n{error_details}")
+            
+            status, content = "error", "Lỗi server, xin vui lòng thử lại sau"
+        
+        customer = turn["customer"]
+        if customer:
+            timestamp_end = now_vietnam_time()
+            message_spans = self._build_direct_spans(
+                timestamp_start=timestamp_start,
+                timestamp_end=timestamp_end,
+                duration_ms=cal_duration_ms(
+                    timestamp_start=timestamp_start,
+                    timestamp_end=timestamp_end
+                ),
+                status=status
+            )
+            message_spans[0]["id"] = trace.main_span_id
+            
+            try:
+                check_create_spans = await self._handle_message_spans(
+                    session_id=customer["sessions"][0]["id"],
+                    customer_id=customer["id"],
+                    message_spans=message_spans + trace.spans,
+                    batch=batch
+                )
+            except Exception as e:
+                check_create_spans = False
+                await logger.error(f"Exception: {e}")
+            
+            if not check_create_spans:
+                await logger.error("Error in DB -> Cannot create message spans")
+            else:
+                await logger.info("Create message spans successfully")
+        
+        return (200, content) if status == "ok" else (500, content)
+
+    async def _process_stream_message(
         self,
         chat_id: str, 
         user_input: str, 
         graph: StateGraph,
         timestamp_start: datetime = None
     ):
-        messages = None
+        """
+        Same bookkeeping as `_process_invoke_message`, but agent tokens, routing and
+        tool progress are streamed to the client as SSE frames while the graph runs.
+
+        Always consumed to the end by `handle_stream_request`, never by the client
+        connection itself, so the bookkeeping after the graph run cannot be skipped.
+        """
+        customer = None
         try:
-            customer, thread_id, new_customer_flag = await self._handle_customer(chat_id=chat_id)
+            if control_mode_cache.is_admin(chat_id):
+                await logger.info(f"Customer {chat_id} is under ADMIN control (cached). Skipping bot response.")
+                yield sse_event("[DONE]")
+                return
+            
+            customer, thread_id, new_customer_flag = await self._handle_customer(chat_id=chat_id, graph=graph)
             if not customer or not thread_id:
                 await logger.error("Not found customer or thread_id")
                 raise Exception("Not found customer or thread_id")
             
             if customer["control_mode"] == "ADMIN":
                 await logger.info(f"Customer {chat_id} is under ADMIN control. Skipping bot response.")
+                yield sse_event("[DONE]")
                 return
 
             config = {"configurable": {"thread_id": thread_id}}
@@ -620,129 +1131,80 @@ class ChatbotService:
             if any(cmd in user_input for cmd in ["/start", "/restart"]):
                 messages = await self.handle_new_chat(
                     customer=customer,
-                    new_customer_flag=new_customer_flag
+                    new_customer_flag=new_customer_flag,
+                    graph=graph
                 )
-
-                if not messages["error"]:
-                    await logger.info("Create new chat session successfully")
-
             elif user_input == "/delete_me":
-                messages = await self.handle_delete_me(customer_id=customer["id"])
-
-                if not messages["error"]:
-                    await logger.info("Delete new customer in DB successfully")
+                messages = await self.handle_delete_me(
+                    customer_id=customer["id"],
+                    thread_id=thread_id,
+                    graph=graph
+                )
             else:
-                messages = await self.handle_normal_chat(
+                state = self._prepare_state(
                     user_input=user_input,
                     chat_id=chat_id,
                     customer=customer,
-                    config=config,
-                    graph=graph
+                    resume=await self._resumes_thread(graph=graph, config=config)
                 )
                 
-                if messages["error"]:
-                    await logger.error("Error in processing chat -> add event")
-                    event_type = "bot_response_failure"
+                outcome = {"error": None}
+                events = graph.astream(
+                    state, 
+                    config=config, 
+                    stream_mode=["messages", "updates"], 
+                    subgraphs=True,
+                    durability="exit"
+                )
+                async for frame in stream_messages(events=events, thread_id=thread_id, outcome=outcome):
+                    yield frame
+                
+                if outcome["error"]:
+                    messages = ResponseModel(content=None, error=outcome["error"])
                 else:
-                    await logger.info("Chat process successfully -> add event")
-                    event_type = "bot_response_success"
-
+                    result = (await graph.aget_state(config)).values
+                    messages = ResponseModel(content=result["messages"][-1].content, error=None)
+                
                 await self._handle_final_process(
                     customer=customer,
                     graph=graph,
                     config=config,
                     thread_id=thread_id,
-                    event_type=event_type
+                    event_type="bot_response_failure" if messages["error"] else "bot_response_success"
                 )
-                
-            if messages:
-                if messages["error"]:
-                    await logger.error(f"Error in processing chat: {messages['error']}")
-                    raise Exception(messages["error"])
-                else:
-                    timestamp_end = now_vietnam_time()
-                    duration_ms = cal_duration_ms(
-                        timestamp_start=timestamp_start,
-                        timestamp_end=timestamp_end
-                    )
-                    
-                    check_create_spans = await self._handle_message_spans(
-                        session_id=customer["sessions"][0]["id"],
-                        customer_id=customer["id"],
-                        message_spans=[
-                            {
-                                "timestamp_start": timestamp_start.isoformat(),
-                                "timestamp_end": timestamp_end.isoformat(),
-                                "duration_ms": duration_ms,
-                                "step_name": "chatbot_process",
-                                "service_name": "chatbot_service",
-                                "direction": "inbound",
-                                "status": "ok"
-                            },
-                            {
-                                "timestamp_start": timestamp_start.isoformat(),
-                                "timestamp_end": timestamp_end.isoformat(),
-                                "duration_ms": duration_ms,
-                                "step_name": "chatbot_process",
-                                "service_name": "chatbot_service",
-                                "direction": "outbound",
-                                "status": "ok"
-                            }
-                        ]
-                    )
-                    
-                    if not check_create_spans:
-                        await logger.error("Error in DB -> Cannot create message spans")
-                    await logger.info("Create message spans successfully")
-                    
-                    return 200, messages["content"]
-            else:
-                await logger.error("Messages is None")
-                raise Exception("Messages is None")
             
+            if messages["error"]:
+                raise Exception(messages["error"])
+            
+            yield sse_event({"type": "message", "content": messages["content"]})
+            status = "ok"
+        
         except Exception as e:
             error_details = traceback.format_exc()
             await logger.error(f"Exception: {e}")
             await logger.error(f"Chi tiết lỗi: \n{error_details}")
             
+            yield sse_event({"type": "message", "content": "Lỗi server, xin vui lòng thử lại sau"})
+            status = "error"
+        
+        if customer:
             timestamp_start = timestamp_start if timestamp_start else now_vietnam_time()
             timestamp_end = now_vietnam_time()
             
-            duration_ms = cal_duration_ms(
-                timestamp_start=timestamp_start,
-                timestamp_end=timestamp_end
-            )
-            
             check_create_spans = await self._handle_message_spans(
                 session_id=customer["sessions"][0]["id"],
                 customer_id=customer["id"],
-                message_spans=[
-                    {
-                        "timestamp_start": timestamp_start.isoformat(),
-                        "timestamp_end": timestamp_end.isoformat(),
-                        "duration_ms": duration_ms,
-                        "step_name": "chatbot_process",
-                        "service_name": "chatbot_service",
-                        "direction": "inbound",
-                        "status": "ok"
-                    },
-                    {
-                        "timestamp_start": timestamp_start.isoformat(),
-                        "timestamp_end": timestamp_end.isoformat(),
-                        "duration_ms": duration_ms,
-                        "step_name": "chatbot_process",
-                        "service_name": "chatbot_service",
-                        "direction": "outbound",
-                        "status": "error"
-                    }
-                ]
+                message_spans=self._build_direct_spans(
+                    timestamp_start=timestamp_start,
+                    timestamp_end=timestamp_end,
+                    duration_ms=cal_duration_ms(timestamp_start, timestamp_end),
+                    status=status
+                )
             )
-            
             if not check_create_spans:
                 await logger.error("Error in DB -> Cannot create message spans")
-            await logger.info("Create error message spans successfully")
-            
-            return 500, "Lỗi server, xin vui lòng thử lại sau"
+        
+        yield sse_event("[DONE]")
 
     # ---------------------------------------------------------------------------------
     # Main function
@@ -755,15 +1217,154 @@ class ChatbotService:
         graph: StateGraph,
         timestamp_start: datetime = None
     ) -> ChatResponse:
-        status_code, response = await self._process_invoke_message(
-            chat_id=chat_id,
-            user_input=user_input,
-            graph=graph,
-            timestamp_start=timestamp_start
-        )
+        async with self._hold_chat(chat_id):
+            result = await self._process_invoke_message(
+                chat_id=chat_id,
+                user_input=user_input,
+                graph=graph,
+                timestamp_start=timestamp_start
+            )
+        
+        # `None` means the chat is under ADMIN control and the bot stays silent
+        if result is None:
+            return PlainTextResponse(content="", status_code=204)
         
+        status_code, response = result
         return PlainTextResponse(content=response, status_code=status_code)
 
+    async def handle_batch_request(
+        self,
+        items: list[dict],
+        graph: StateGraph,
+        concurrency: int | None = None
+    ) -> dict:
+        """
+        Chạy nhiều cặp (chat_id, user_input) qua luồng invoke với số lượng đồng thời giới hạn.
+        Tin nhắn cùng `chat_id` được xử lý tuần tự theo thứ tự gửi lên, các chat khác chạy song song.
+        Event và message span của mọi item được ghi bằng một lệnh bulk insert mỗi bảng ở cuối batch
+        (khi write-behind bật, chúng đi qua write-behind như các luồng khác).
+
+        Args:
+            items (list[dict]): Danh sách {"chat_id", "user_input"}.
+            graph (StateGraph): Đồ thị tác vụ chính.
+            concurrency (int | None): Số chat xử lý đồng thời, tối đa `BATCH_MAX_CONCURRENCY`.
+
+        Returns:
+            dict: Kết quả và thời gian xử lý của từng item theo đúng thứ tự đầu vào.
+        """
+        concurrency = min(concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+        results: list[dict | None] = [None] * len(items)
+        batch = BatchWrites()
+        
+        groups: dict[str, list[int]] = {}
+        for index, item in enumerate(items):
+            groups.setdefault(item["chat_id"], []).append(index)
+        
+        async def run_chat(indexes: list[int]) -> None:
+            async with semaphore:
+                for index in indexes:
+                    item = items[index]
+                    timestamp_start = now_vietnam_time()
+                    async with self._hold_chat(item["chat_id"]):
+                        result = await self._process_invoke_message(
+                            chat_id=item["chat_id"],
+                            user_input=item["user_input"],
+                            graph=graph,
+                            timestamp_start=timestamp_start,
+                            batch=batch
+                        )
+                    timestamp_end = now_vietnam_time()
+                    
+                    # `None` means the chat is under ADMIN control and the bot stayed silent
+                    status_code, response = result if result else (204, None)
+                    results[index] = {
+                        "chat_id": item["chat_id"],
+                        "user_input": item["user_input"],
+                        "status_code": status_code,
+                        "response": response,
+                        "started_at": timestamp_start.isoformat(),
+                        "duration_ms": cal_duration_ms(timestamp_start, timestamp_end)
+                    }
+        
+        timestamp_start = now_vietnam_time()
+        await asyncio.gather(*(run_chat(indexes) for indexes in groups.values()))
+        await self._write_batch(batch)
+        timestamp_end = now_vietnam_time()
+        
+        return {
+            "total": len(items),
+            "succeeded": sum(1 for result in results if result["status_code"] < 400),
+            "failed": sum(1 for result in results if result["status_code"] >= 400),
+            "concurrency": concurrency,
+            "duration_ms": cal_duration_ms(timestamp_start, timestamp_end),
+            "results": results
+        }
+
+    async def _write_batch(self, batch: BatchWrites) -> None:
+        async def write_events() -> None:
+            if batch.events and not await self.async_event_repo.create_event_bulk(events=batch.events):
+                raise Exception("Error in DB -> Cannot add event records")
+        
+        async def write_spans() -> None:
+            if batch.message_spans and not await self.async_message_repo.create_message_span_bulk(
+                message_spans=batch.message_spans
+            ):
+                raise Exception("Error in DB -> Cannot create message spans")
+        
+        results = await asyncio.gather(write_events(), write_spans(), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                await logger.error(f"Batch bookkeeping failed: {result}")
+        await logger.info(f"Batch bookkeeping | Events: {len(batch.events)} | Message spans: {len(batch.message_spans)}")
+
+    async def handle_stream_request(
+        self,
+        chat_id: str, 
+        user_input: str, 
+        graph: StateGraph,
+        timestamp_start: datetime = None
+    ) -> StreamingResponse:
+        """
+        Raises:
+            PoolSaturatedError: The worker pool queue is full.
+            PoolClosedError: The worker pool is not accepting work.
+        """
+        frames: asyncio.Queue[str | None] = asyncio.Queue()
+        client = {"connected": True}
+
+        async def run_turn() -> None:
+            try:
+                async with self._hold_chat(chat_id):
+                    async for frame in self._process_stream_message(
+                        chat_id=chat_id,
+                        user_input=user_input,
+                        graph=graph,
+                        timestamp_start=timestamp_start
+                    ):
+                        if client["connected"]:
+                            frames.put_nowait(frame)
+            finally:
+                frames.put_nowait(None)
+
+        async def forward_frames():
+            try:
+                while (frame := await frames.get()) is not None:
+                    yield frame
+            finally:
+                client["connected"] = False
+
+        # The turn runs on the worker pool, not in the response generator: a client
+        # disconnecting mid-stream only stops the forwarding, the graph run and its
+        # bookkeeping (event, state, checkpoint cleanup, spans) still complete
+        worker_pool.submit(name=f"stream:{chat_id}", job=run_turn)
+
+        return StreamingResponse(
+            forward_frames(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
     async def handle_webhook_request(
         self,
         chat_id: str, 
@@ -772,14 +1373,48 @@ class ChatbotService:
         timestamp_start: datetime = None,
         message_spans: list[dict] = None,
     ):
-        asyncio.create_task(
-            self._process_webhook_message(
-                chat_id=chat_id,
-                user_input=user_input,
-                graph=graph,
-                timestamp_start=timestamp_start,
-                message_spans=message_spans
+        # Chats taken over by an admin are skipped before any DB or state work
+        if control_mode_cache.is_admin(chat_id):
+            await logger.info(f"Customer {chat_id} is under ADMIN control (cached). Skipping bot response.")
+            return PlainTextResponse(content="OK", status_code=200)
+        
+        # Gateways redeliver on timeout: a message id seen before is acknowledged
+        # without touching the graph or sending a second reply
+        message_id = extract_message_id(message_spans)
+        idempotency_key = f"{chat_id}:{message_id}" if message_id else None
+        if idempotency_key and not await idempotency_store.claim(idempotency_key):
+            await logger.info(f"Chat ID: {chat_id} | Duplicate webhook message {message_id} -> skipped")
+            return PlainTextResponse(content="OK", status_code=200)
+        
+        async def handler(message: MailboxMessage) -> None:
+            # The mailbox orders messages inside this process, the chat lock
+            # keeps other worker processes off the same chat
+            async with self._hold_chat(message.chat_id):
+                await self._process_webhook_message(
+                    chat_id=message.chat_id,
+                    user_input=message.user_input,
+                    graph=graph,
+                    timestamp_start=message.timestamp_start,
+                    message_spans=message.message_spans
+                )
+
+        # Messages of one chat are processed strictly in order, other chats keep running
+        try:
+            depth = chat_mailbox.post(
+                message=MailboxMessage(
+                    chat_id=chat_id,
+                    user_input=user_input,
+                    timestamp_start=timestamp_start,
+                    message_spans=message_spans if message_spans is not None else [],
+                    idempotency_key=idempotency_key
+                ),
+                handler=handler
             )
-        )
+        except Exception:
+            # Rejected messages must be processed when the gateway retries them
+            if idempotency_key:
+                await idempotency_store.release(idempotency_key)
+            raise
+        await logger.info(f"Chat ID: {chat_id} | Queued webhook message | Mailbox depth: {depth}")
         
         return PlainTextResponse(content="OK", status_code=200)
\ No newline at end of file
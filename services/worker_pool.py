@@ -0,0 +1,187 @@
+import os
+import time
+import asyncio
+import traceback
+from typing import Awaitable, Callable
+
+from dotenv import load_dotenv
+from log.logger_config import setup_logging
+
+load_dotenv()
+logger = setup_logging(__name__)
+
+WORKER_POOL_CONCURRENCY = int(os.getenv("WORKER_POOL_CONCURRENCY", 16))
+WORKER_POOL_MAX_QUEUE = int(os.getenv("WORKER_POOL_MAX_QUEUE", 200))
+
+Job = Callable[[], Awaitable[None]]
+
+
+class PoolSaturatedError(Exception):
+    """Raised when the pool queue is full and new work must be rejected (HTTP 429)."""
+
+
+class PoolClosedError(Exception):
+    """Raised when the pool is not accepting work, e.g. before startup or while draining (HTTP 503)."""
+
+
+class WorkerPool:
+    """
+    Supervised pool of long-lived worker tasks consuming a bounded job queue.
+
+    Jobs are executed inside the workers, which are owned by the pool, so no
+    job can be garbage-collected mid-flight. Submitting never blocks: when the
+    queue is full the job is rejected immediately so the caller can shed load.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = WORKER_POOL_CONCURRENCY,
+        max_queue: int = WORKER_POOL_MAX_QUEUE
+    ):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+
+        self._queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        self._running: dict[int, tuple[str, float]] = {}
+        self._accepting = False
+
+        self._accepted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._failed = 0
+
+    async def start(self) -> None:
+        """
+        Spawn the worker tasks and start accepting jobs.
+        """
+        if self._workers:
+            return
+
+        # `max_queue` is enforced on admission, jobs admitted earlier may go past it
+        self._queue = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._worker(index), name=f"worker-{index}")
+            for index in range(self.concurrency)
+        ]
+        self._accepting = True
+        await logger.info(f"Worker pool started | Concurrency: {self.concurrency} | Max queue: {self.max_queue}")
+
+    async def shutdown(self, timeout: float) -> bool:
+        """
+        Stop accepting jobs, wait for queued and running jobs to finish, then stop the workers.
+        Jobs still running when `timeout` expires are cancelled.
+
+        Args:
+            timeout (float): Seconds to wait for the queue to drain.
+
+        Returns:
+            bool: True if every job finished before the deadline.
+        """
+        self._accepting = False
+        if not self._workers:
+            return True
+        
+        await logger.info(f"Draining worker pool | Queued: {self._queue.qsize()} | Running: {len(self._running)}")
+        drained = True
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=max(timeout, 0))
+        except asyncio.TimeoutError:
+            drained = False
+            running = [name for name, _ in self._running.values()]
+            await logger.warning(
+                f"Worker pool drain deadline exceeded | Queued: {self._queue.qsize()} | Cancelling: {running}"
+            )
+        
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        
+        await logger.info(f"Worker pool stopped | Completed: {self._completed} | Failed: {self._failed}")
+        return drained
+
+    def submit(self, name: str, job: Job, admitted: bool = False) -> None:
+        """
+        Enqueue a job without waiting.
+
+        Args:
+            name (str): Human readable job name, used in the task registry.
+            job (Job): Zero-argument coroutine function to run.
+            admitted (bool): The work was accepted earlier (see `check_admission`), it is
+                queued even if the queue is full or the pool is draining.
+
+        Raises:
+            PoolClosedError: The pool is not running or is shutting down.
+            PoolSaturatedError: The job queue is full.
+        """
+        if not admitted:
+            self.check_admission()
+        elif not self._workers:
+            raise PoolClosedError("Worker pool is stopped")
+        self._queue.put_nowait((name, job))
+        self._accepted += 1
+
+    @property
+    def saturated(self) -> bool:
+        return self._queue is not None and self._queue.qsize() >= self.max_queue
+
+    def check_admission(self) -> None:
+        """
+        Raise like `submit` would, without enqueueing anything. Used by callers that
+        accept work now and submit it later.
+
+        Raises:
+            PoolClosedError: The pool is not running or is shutting down.
+            PoolSaturatedError: The job queue is full.
+        """
+        if not self._accepting or self._queue is None:
+            self._rejected += 1
+            raise PoolClosedError("Worker pool is not accepting new work")
+        if self._queue.qsize() >= self.max_queue:
+            self._rejected += 1
+            raise PoolSaturatedError(f"Worker pool queue is full ({self.max_queue} jobs)")
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            name, job = await self._queue.get()
+            self._running[index] = (name, time.monotonic())
+            try:
+                await job()
+                self._completed += 1
+            except Exception as e:
+                self._failed += 1
+                error_details = traceback.format_exc()
+                await logger.error(f"Job {name} failed: {e}\nDetail: {error_details}")
+            finally:
+                self._running.pop(index, None)
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        """
+        Snapshot of pool utilization, used to size replicas.
+        """
+        now = time.monotonic()
+        busy = len(self._running)
+        queued = self._queue.qsize() if self._queue else 0
+
+        return {
+            "accepting": self._accepting,
+            "concurrency": self.concurrency,
+            "busy": busy,
+            "utilization": busy / self.concurrency if self.concurrency else 0.0,
+            "queued": queued,
+            "max_queue": self.max_queue,
+            "queue_utilization": queued / self.max_queue if self.max_queue else 0.0,
+            "accepted": self._accepted,
+            "rejected": self._rejected,
+            "completed": self._completed,
+            "failed": self._failed,
+            "running": [
+                {"name": name, "elapsed_ms": (now - started_at) * 1000}
+                for name, started_at in self._running.values()
+            ]
+        }
+
+
+worker_pool = WorkerPool()
@@ -0,0 +1,498 @@
+import os
+import re
+import json
+import time
+import asyncio
+import traceback
+from pathlib import Path
+from dataclasses import dataclass, asdict
+
+try:
+    import fcntl
+except ImportError:  # Windows: spill files of other processes are not replayed
+    fcntl = None
+
+from dotenv import load_dotenv
+from supabase import AsyncClient
+
+from log.logger_config import setup_logging
+from repository.async_repo import AsyncEventRepo, AsyncMessageSpanRepo, AsyncSessionRepo
+
+load_dotenv()
+logger = setup_logging(__name__)
+
+# Queue per-turn bookkeeping writes (events, spans, session state) instead of awaiting them
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() == "true"
+WRITE_BEHIND_FLUSH_INTERVAL_MS = int(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL_MS", 200))
+# Operations written per flush, the rest waits for the next one
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", 500))
+# Failed flushes of an operation before it is moved to the dead-letter file
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", 5))
+# Pending operations are appended here and replayed on startup. Each worker process spills
+# to its own file named after its pid (`write_behind.jsonl` -> `write_behind.<pid>.jsonl`) and
+# holds a lock on it while running; on startup a process also replays, then removes, the files
+# of processes that are no longer running, so every spilled write is replayed exactly by one process
+WRITE_BEHIND_SPILL_PATH = os.getenv("WRITE_BEHIND_SPILL_PATH", "data/write_behind.jsonl")
+
+# Tables are flushed in this order, operations of one table keep their enqueue order
+TABLE_ORDER = ("events", "message_spans", "session_state_deltas", "sessions")
+
+
+class WriteBehindError(Exception):
+    """Raised when queued writes a read depends on could not be flushed."""
+
+
+@dataclass
+class WriteOp:
+    """
+    One queued write: rows inserted into `table`, or a payload applied to row `row_id`.
+    """
+    seq: int
+    table: str
+    key: str
+    rows: list[dict] | None = None
+    row_id: int | None = None
+    payload: dict | None = None
+    attempts: int = 0
+
+
+def _lock_path(spill_path: Path) -> Path:
+    return spill_path.with_suffix(".lock")
+
+
+def _try_lock(path: Path) -> int | None:
+    """
+    Open and lock `path`, None if another process holds it.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _read_spill(path: Path) -> list[WriteOp]:
+    ops: dict[tuple, WriteOp] = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    op = WriteOp(**json.loads(line))
+                except (json.JSONDecodeError, TypeError):
+                    # A torn last line from a crash mid-write
+                    continue
+                # Updates of one row keep their latest payload, inserts are unique by seq
+                ops[(op.table, op.row_id) if op.row_id is not None else ("seq", op.seq)] = op
+    except FileNotFoundError:
+        # Replayed and removed by another process meanwhile
+        return []
+    return sorted(ops.values(), key=lambda op: op.seq)
+
+
+class WriteBehind:
+    """
+    Batches per-turn bookkeeping writes and flushes them by table on a short interval.
+
+    - Inserts of one table are sent as one bulk insert, updates of the same row
+      are coalesced (the latest payload wins) while they are still pending, so a
+      row has at most one queued update and its writes can never overtake each other.
+    - Operations are ordered by `key` (the chat_id or session id) inside a table;
+      `barrier(key)` flushes them before a read that depends on them.
+    - Every operation is appended to a local spill file of the process right after
+      `insert`/`update`, and the file is compacted after each flush, so a crash loses
+      nothing: pending operations are replayed on the next start (at-least-once).
+      Spill writes run in a thread, one at a time, never on the event loop.
+    - Failed operations are retried with backoff, then dead-lettered next to the spill file.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = WRITE_BEHIND_ENABLED,
+        flush_interval_ms: int = WRITE_BEHIND_FLUSH_INTERVAL_MS,
+        max_batch: int = WRITE_BEHIND_MAX_BATCH,
+        max_attempts: int = WRITE_BEHIND_MAX_ATTEMPTS,
+        spill_path: str = WRITE_BEHIND_SPILL_PATH
+    ):
+        self.enabled = enabled
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.base_spill_path = Path(spill_path)
+        # Known at start, in the worker process itself
+        self.spill_path = self.base_spill_path
+        self.dead_letter_path = self.base_spill_path.with_suffix(".dead.jsonl")
+
+        self._client: AsyncClient | None = None
+        self._pending: list[WriteOp] = []
+        self._pending_updates: dict[tuple[str, int], WriteOp] = {}
+        self._pending_keys: dict[str, int] = {}
+        self._seq = 0
+        self._spill = None
+        self._spill_fd: int | None = None
+        # Lines waiting to be appended to the spill file by `_write_spill`
+        self._spill_lines: list[str] = []
+        self._spill_lock = asyncio.Lock()
+        self._spill_task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._consecutive_failures = 0
+
+        self._flushed = 0
+        self._failed = 0
+        self._dead_lettered = 0
+        self._batches = 0
+        self._last_flush_ms = 0.0
+
+    @property
+    def active(self) -> bool:
+        """
+        True once started: writes can be queued instead of awaited.
+        """
+        return self._task is not None
+
+    # ------------------------------------------------------------------
+    # Enqueue
+    # ------------------------------------------------------------------
+
+    def _track(self, op: WriteOp) -> None:
+        self._pending.append(op)
+        self._pending_keys[op.key] = self._pending_keys.get(op.key, 0) + 1
+        if op.row_id is not None:
+            self._pending_updates[(op.table, op.row_id)] = op
+
+    def _untrack(self, op: WriteOp) -> None:
+        self._pending_keys[op.key] -= 1
+        if not self._pending_keys[op.key]:
+            del self._pending_keys[op.key]
+        if op.row_id is not None and self._pending_updates.get((op.table, op.row_id)) is op:
+            del self._pending_updates[(op.table, op.row_id)]
+
+    def _append_spill(self, op: WriteOp) -> None:
+        self._spill_lines.append(json.dumps(asdict(op), ensure_ascii=False) + "\n")
+        if self._spill_task is None or self._spill_task.done():
+            self._spill_task = asyncio.create_task(self._write_spill(), name="write-behind-spill")
+
+    def _next_seq(self) -> int:
+        self._seq += 1
+        return self._seq
+
+    def insert(self, table: str, rows: list[dict], key: str) -> None:
+        op = WriteOp(seq=self._next_seq(), table=table, key=key, rows=rows)
+        self._append_spill(op)
+        self._track(op)
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+    def update(self, table: str, row_id: int, payload: dict, key: str) -> None:
+        op = self._pending_updates.get((table, row_id))
+        if op is not None:
+            op.payload.update(payload)
+            # Replaying the spill applies lines in order, so the merged payload is
+            # written again and overrides the older line of the same row
+            self._append_spill(op)
+            return
+
+        op = WriteOp(seq=self._next_seq(), table=table, key=key, row_id=row_id, payload=dict(payload))
+        self._append_spill(op)
+        self._track(op)
+
+    def has_pending(self, key: str) -> bool:
+        return key in self._pending_keys
+
+    async def barrier(self, key: str) -> None:
+        """
+        Flush until no write of `key` is queued, e.g. before reading the session state they update.
+
+        Raises:
+            WriteBehindError: Writes of `key` are still queued after a failed flush,
+                a read now would return stale data.
+        """
+        while self.has_pending(key):
+            if not await self.flush() and self.has_pending(key):
+                raise WriteBehindError(f"Queued writes of {key} could not be flushed")
+
+    # ------------------------------------------------------------------
+    # Flush
+    # ------------------------------------------------------------------
+
+    async def _write_table(self, table: str, ops: list[WriteOp]) -> list[WriteOp]:
+        """
+        Write the ops of one table, returning those that failed.
+        """
+        if table == "sessions":
+            repo = AsyncSessionRepo(client=self._client)
+            # One op per row (see `update`), so the concurrent updates never race on a row
+            results = await asyncio.gather(
+                *(repo.update_session(session_id=op.row_id, update_payload=op.payload) for op in ops),
+                return_exceptions=True
+            )
+            failed = []
+            for op, result in zip(ops, results):
+                if isinstance(result, Exception):
+                    await logger.error(f"Write-behind update of session {op.row_id} failed: {result}")
+                    failed.append(op)
+                elif not result:
+                    # The session was deleted meanwhile (e.g. /delete_me), retrying cannot help
+                    await logger.warning(f"Write-behind update skipped, session {op.row_id} not found")
+            return failed
+
+        rows = [row for op in ops for row in op.rows]
+        if table == "events":
+            await AsyncEventRepo(client=self._client).create_event_bulk(events=rows)
+        elif table == "message_spans":
+            await AsyncMessageSpanRepo(client=self._client).create_message_span_bulk(
+                message_spans=rows,
+                ignore_duplicates=True
+            )
+        elif table == "session_state_deltas":
+            # A replayed delta is dropped when the state is rebuilt, it carries its seq
+            await AsyncSessionRepo(client=self._client).create_state_delta_bulk(rows=rows)
+        else:
+            raise ValueError(f"Unsupported write-behind table: {table}")
+        return []
+
+    async def flush(self) -> bool:
+        """
+        Write the pending operations.
+
+        Returns:
+            bool: True if every operation taken in this flush was written.
+        """
+        async with self._flush_lock:
+            if not self._pending or self._client is None:
+                return not self._pending
+
+            started_at = time.perf_counter()
+            batch = self._pending[:self.max_batch]
+            self._pending = self._pending[self.max_batch:]
+            for op in batch:
+                if op.row_id is not None and self._pending_updates.get((op.table, op.row_id)) is op:
+                    # Later updates of this row start a new op instead of changing an in-flight one
+                    del self._pending_updates[(op.table, op.row_id)]
+
+            by_table: dict[str, list[WriteOp]] = {}
+            for op in batch:
+                by_table.setdefault(op.table, []).append(op)
+
+            failed: list[WriteOp] = []
+            for table in sorted(by_table, key=lambda t: TABLE_ORDER.index(t) if t in TABLE_ORDER else len(TABLE_ORDER)):
+                ops = by_table[table]
+                try:
+                    failed.extend(await self._write_table(table, ops))
+                except Exception as e:
+                    await logger.error(f"Write-behind flush of {table} failed: {e}\nDetail: {traceback.format_exc()}")
+                    failed.extend(ops)
+
+            failed_ids = {id(op) for op in failed}
+            for op in batch:
+                if id(op) not in failed_ids:
+                    self._untrack(op)
+            self._flushed += len(batch) - len(failed)
+
+            retry, dead = [], []
+            for op in failed:
+                op.attempts += 1
+                (dead if op.attempts >= self.max_attempts else retry).append(op)
+            for op in dead:
+                self._untrack(op)
+            if dead:
+                await asyncio.to_thread(self._dead_letter, dead)
+            requeued = []
+            for op in sorted(retry, key=lambda op: op.seq):
+                if op.row_id is None:
+                    requeued.append(op)
+                    continue
+                newer = self._pending_updates.get((op.table, op.row_id))
+                if newer is None:
+                    # Updates of the row queued from now on merge into the retried op again
+                    self._pending_updates[(op.table, op.row_id)] = op
+                    requeued.append(op)
+                else:
+                    # The row was updated during the flush: one op, the newer payload wins
+                    newer.payload = {**op.payload, **newer.payload}
+                    newer.attempts = max(newer.attempts, op.attempts)
+                    self._untrack(op)
+            # Failed ops go back in front so they keep their order relative to newer ones
+            self._pending = requeued + self._pending
+            self._failed += len(failed)
+            self._consecutive_failures = self._consecutive_failures + 1 if failed else 0
+
+            await self._compact_spill()
+            self._batches += 1
+            self._last_flush_ms = (time.perf_counter() - started_at) * 1000
+
+            return not failed
+
+    def _dead_letter(self, ops: list[WriteOp]) -> None:
+        self._dead_lettered += len(ops)
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            for op in ops:
+                f.write(json.dumps(asdict(op), ensure_ascii=False) + "\n")
+
+    async def _write_spill(self) -> None:
+        async with self._spill_lock:
+            while self._spill_lines:
+                lines, self._spill_lines = self._spill_lines, []
+                await asyncio.to_thread(self._append_lines, lines)
+
+    def _append_lines(self, lines: list[str]) -> None:
+        self._spill.writelines(lines)
+        self._spill.flush()
+
+    async def _compact_spill(self) -> None:
+        async with self._spill_lock:
+            # Every line still waiting describes a pending op, the snapshot covers it
+            self._spill_lines = []
+            lines = [json.dumps(asdict(op), ensure_ascii=False) + "\n" for op in self._pending]
+            await asyncio.to_thread(self._rewrite_spill, lines)
+
+    def _rewrite_spill(self, lines: list[str]) -> None:
+        # Compact the spill file to the ops still pending, atomically
+        tmp_path = self.spill_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        if self._spill is not None:
+            self._spill.close()
+        os.replace(tmp_path, self.spill_path)
+        self._spill = open(self.spill_path, "a", encoding="utf-8")
+
+    def _orphan_spills(self) -> list[tuple[Path, int | None]]:
+        """
+        Spill files left by processes that are no longer running, each with the
+        lock taken on it (the base file is the one of the single-file layout).
+        """
+        if fcntl is None:
+            return []
+        pattern = re.compile(rf"^{re.escape(self.base_spill_path.stem)}(\.\d+)?{re.escape(self.base_spill_path.suffix)}$")
+        orphans = []
+        for path in sorted(self.base_spill_path.parent.iterdir(), key=lambda p: p.name):
+            if path == self.spill_path or not pattern.match(path.name):
+                continue
+            fd = _try_lock(_lock_path(path))
+            if fd is not None:
+                orphans.append((path, fd))
+        return orphans
+
+    def _replay_spill(self) -> tuple[list[WriteOp], list[tuple[Path, int | None]]]:
+        """
+        Ops of this process's spill file and of the orphan files, oldest file first.
+        """
+        orphans = self._orphan_spills()
+        paths = [path for path, _ in orphans if path.exists()]
+        if self.spill_path.exists():
+            paths.append(self.spill_path)
+        paths.sort(key=lambda path: path.stat().st_mtime)
+
+        # Seqs are per process, the ops are renumbered in replay order
+        ops: dict[tuple, WriteOp] = {}
+        for path in paths:
+            for op in _read_spill(path):
+                if op.row_id is not None:
+                    ops.pop((op.table, op.row_id), None)
+                    ops[(op.table, op.row_id)] = op
+                else:
+                    ops[("seq", path.name, op.seq)] = op
+        return list(ops.values()), orphans
+
+    def _release_orphans(self, orphans: list[tuple[Path, int | None]]) -> None:
+        # Their ops are in this process's spill file now
+        for path, fd in orphans:
+            path.unlink(missing_ok=True)
+            _lock_path(path).unlink(missing_ok=True)
+            os.close(fd)
+
+    async def _run(self) -> None:
+        while True:
+            delay = min(self.flush_interval * (2 ** self._consecutive_failures), 30)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                await logger.error(f"Write-behind flush loop error: {e}\nDetail: {traceback.format_exc()}")
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    async def start(self, client: AsyncClient) -> None:
+        """
+        Replay operations left in the spill file and start the periodic flusher.
+        """
+        if not self.enabled or self._task is not None:
+            return
+
+        self._client = client
+        self.spill_path = self.base_spill_path.with_name(
+            f"{self.base_spill_path.stem}.{os.getpid()}{self.base_spill_path.suffix}"
+        )
+        self.spill_path.parent.mkdir(parents=True, exist_ok=True)
+        if fcntl is not None:
+            # Held while the process runs, so no other process replays this file
+            self._spill_fd = os.open(_lock_path(self.spill_path), os.O_RDWR | os.O_CREAT, 0o644)
+            await asyncio.to_thread(fcntl.flock, self._spill_fd, fcntl.LOCK_EX)
+
+        ops, orphans = await asyncio.to_thread(self._replay_spill)
+        for op in ops:
+            op.seq = self._next_seq()
+            self._track(op)
+        replayed = len(ops)
+        await self._compact_spill()
+        await asyncio.to_thread(self._release_orphans, orphans)
+
+        self._task = asyncio.create_task(self._run(), name="write-behind")
+        await logger.info(
+            f"Write-behind started | Interval: {self.flush_interval * 1000:.0f} ms | Replayed: {replayed}"
+        )
+
+    async def stop(self, timeout: float) -> bool:
+        """
+        Stop the periodic flusher and flush what is left.
+        Operations not written before `timeout` stay in the spill file for the next start.
+        """
+        if self._task is None:
+            return True
+
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+        flushed = True
+        deadline = time.monotonic() + max(timeout, 0)
+        try:
+            while self._pending and flushed:
+                flushed = await asyncio.wait_for(self.flush(), timeout=max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            flushed = False
+
+        # Leaves exactly the ops not written, for the next start
+        await self._compact_spill()
+        self._spill.close()
+        if self._spill_fd is not None:
+            os.close(self._spill_fd)
+            self._spill_fd = None
+        await logger.info(f"Write-behind stopped | Flushed: {self._flushed} | Left in spill: {len(self._pending)}")
+        return flushed and not self._pending
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "pending": len(self._pending),
+            "pending_keys": len(self._pending_keys),
+            "flushed": self._flushed,
+            "failed": self._failed,
+            "dead_lettered": self._dead_lettered,
+            "batches": self._batches,
+            "last_flush_ms": self._last_flush_ms
+        }
+
+
+write_behind = WriteBehind()